@@ -0,0 +1,536 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# 报告中的统计在内存中一次算完，不需要 SQLite 数据库：
+# 总节点数、被标注的节点数、途径数、用户数和贡献最多的用户、信号灯最多的途径、
+# 以北京市中心划分的四个区域的节点数、网格直方图，以及报告中查询的几个标签的数量。
+# 统计可以在转换时顺带完成（osm2csv.py --analytics），也可以直接扫描 osm 文件或读取列式输出。
+# 用紧凑的计数结构：按 uid 下标的数组计数，节点 id 的分页位图（被标注的节点、信号灯节点），
+# 以及字典形式的网格直方图。
+# 用法：python analytics.py beijing_china.osm [--check openstreet.sqlite]
+#       python analytics.py --columnar .  （读取 osm2csv.py --format columnar 的输出）
+
+import argparse
+import array
+import collections
+import json
+import os
+import time
+
+import spatial
+import sqlschema
+
+
+GRID_CELL_SIZE = 0.01   # 网格直方图的网格边长（度）
+
+PAGE_BITS = 16   # 位图每页记录 2**16 个连续的 id
+
+# 报告中查询的标签：(元素类型, key, value)
+TAG_QUERIES = [('node', 'tourism', 'hotel'), ('way', 'bridge', 'viaduct')]
+
+SIGNAL_VALUE = 'traffic_signals'
+
+QUADRANTS = ('north east', 'north west', 'south east', 'south west')
+
+
+class NodeBitmap(object):
+    '''节点 id 的集合，按页存放的位图：只为出现过的 id 所在的页分配 2**PAGE_BITS 位。
+
+    OSM 的 id 很大但在局部是连续的，分页后内存与节点数而不是最大的 id 成正比。'''
+
+    def __init__(self):
+        self.pages = {}
+        self.count = 0
+
+    def add(self, node_id):
+        '''加入 node_id，返回它是否是新加入的。'''
+
+        page = self.pages.get(node_id >> PAGE_BITS)
+        if page is None:
+            page = self.pages[node_id >> PAGE_BITS] = bytearray(1 << (PAGE_BITS - 3))
+        offset = node_id & ((1 << PAGE_BITS) - 1)
+        mask = 1 << (offset & 7)
+        if page[offset >> 3] & mask:
+            return False
+        page[offset >> 3] |= mask
+        self.count += 1
+        return True
+
+    def update(self, ids):
+        '''加入一个 int64 数组中的所有 id（向量化）。'''
+
+        import numpy as np
+
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        pages = ids >> PAGE_BITS
+        offsets = ids & ((1 << PAGE_BITS) - 1)
+        bounds = np.flatnonzero(np.diff(pages)) + 1
+        for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(ids)]):
+            key = int(pages[start])
+            page = self.pages.get(key)
+            if page is None:
+                page = self.pages[key] = bytearray(1 << (PAGE_BITS - 3))
+            bits = np.frombuffer(page, dtype=np.uint8)
+            before = int(np.unpackbits(bits).sum())
+            np.bitwise_or.at(bits, offsets[start:end] >> 3,
+                             (1 << (offsets[start:end] & 7)).astype(np.uint8))
+            self.count += int(np.unpackbits(bits).sum()) - before
+
+    def __contains__(self, node_id):
+        page = self.pages.get(node_id >> PAGE_BITS)
+        if page is None:
+            return False
+        offset = node_id & ((1 << PAGE_BITS) - 1)
+        return bool(page[offset >> 3] & (1 << (offset & 7)))
+
+    def __len__(self):
+        return self.count
+
+    def nbytes(self):
+        return len(self.pages) << (PAGE_BITS - 3)
+
+
+class UserCounts(object):
+    '''按 uid 计数：计数存放在以 uid 为下标的数组中，另外记录每个 uid 的用户名。
+
+    报告按用户名分组；同一个 uid 在改名前后的行记在 renamed 中，汇总时按名字拆开。'''
+
+    def __init__(self):
+        self.counts = array.array('I')
+        self.names = {}
+        self.renamed = collections.Counter()
+
+    def grow(self, uid):
+        if uid >= len(self.counts):
+            size = max(uid + 1, 2 * len(self.counts))
+            self.counts.frombytes(bytes(self.counts.itemsize * (size - len(self.counts))))
+
+    def add(self, uid, user):
+        if uid >= len(self.counts):
+            self.grow(uid)
+        self.counts[uid] += 1
+        name = self.names.setdefault(uid, user)
+        if name != user:
+            self.renamed[uid, user] += 1
+
+    def update(self, uids, users):
+        '''加入 uid 和用户名两列（向量化）。'''
+
+        import numpy as np
+
+        uids = np.asarray(uids, dtype=np.int64)
+        if not len(uids):
+            return
+        self.grow(int(uids.max()))
+        counts = np.frombuffer(self.counts, dtype=np.uint32)
+        counts += np.bincount(uids, minlength=len(counts)).astype(np.uint32)
+
+        users = np.asarray(users, dtype=object)
+        unique, first = np.unique(uids, return_index=True)
+        for uid, user in zip(unique.tolist(), users[first].tolist()):
+            self.names.setdefault(uid, user)
+        known = np.array([self.names[uid] for uid in unique.tolist()], dtype=object)
+        other = users != known[np.searchsorted(unique, uids)]
+        for uid, user in zip(uids[other].tolist(), users[other].tolist()):
+            self.renamed[uid, user] += 1
+
+    def by_name(self):
+        '''返回 {用户名: 行数}。'''
+
+        totals = collections.Counter()
+        for uid, name in self.names.items():
+            totals[name] += self.counts[uid]
+        for (uid, user), count in self.renamed.items():
+            totals[self.names[uid]] -= count
+            totals[user] += count
+        return totals
+
+    def __len__(self):
+        return len(self.names)
+
+
+class Summary(object):
+    '''一次统计的结果，各项统计都可以直接查询。'''
+
+    def __init__(self, nodes, tagged_nodes, ways, users, user_counts, signal_counts,
+                 way_names, quadrants, grid, cell_size, tag_counts, center=spatial.CENTER):
+        self.nodes = nodes                  # 总节点数
+        self.tagged_nodes = tagged_nodes    # 被标注的节点数
+        self.ways = ways                    # 途径数
+        self.users = users                  # 用户数（不同的 uid）
+        self.user_counts = user_counts      # {用户名: 节点和途径数}
+        self.signal_counts = signal_counts  # {途径 id: 信号灯数}
+        self.way_names = way_names          # {途径 id: [名称]}，只记录有信号灯的途径
+        self.quadrants = quadrants          # {区域: 节点数}，区域见 QUADRANTS
+        self.grid = grid                    # {(行, 列): 节点数}，与 spatial.grid_histogram 相同
+        self.cell_size = cell_size
+        self.tag_counts = tag_counts        # {(元素类型, key, value): 行数}
+        self.center = center
+
+    @property
+    def tagged_ratio(self):
+        return self.tagged_nodes / self.nodes if self.nodes else 0.0
+
+    def quadrant_ratios(self):
+        return {name: count / self.nodes if self.nodes else 0.0
+                for name, count in self.quadrants.items()}
+
+    def top_users(self, n=10):
+        '''贡献节点和途径最多的 n 个用户，[(用户名, 数量)]。'''
+
+        return sorted(self.user_counts.items(), key=lambda item: (-item[1], item[0]))[:n]
+
+    def top_signal_ways(self, n=10):
+        '''信号灯最多的 n 条途径，[(途径 id, 信号灯数, [名称])]。'''
+
+        top = sorted(self.signal_counts.items(), key=lambda item: (-item[1], item[0]))[:n]
+        return [(way_id, count, self.way_names.get(way_id, [])) for way_id, count in top]
+
+    def tag_count(self, element_type, key, value):
+        return self.tag_counts[element_type, key, value]
+
+    def to_dict(self, n=10):
+        return {
+            'nodes': self.nodes,
+            'tagged_nodes': self.tagged_nodes,
+            'tagged_ratio': self.tagged_ratio,
+            'ways': self.ways,
+            'users': self.users,
+            'top_users': self.top_users(n),
+            'top_signal_ways': self.top_signal_ways(n),
+            'center': list(self.center),
+            'quadrants': self.quadrants,
+            'quadrant_ratios': self.quadrant_ratios(),
+            'cell_size': self.cell_size,
+            'grid_cells': len(self.grid),
+            'tags': ['%s %s=%s: %d' % (t, k, v, count)
+                     for (t, k, v), count in self.tag_counts.items()],
+        }
+
+    def write(self, path, n=10):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(n), f, ensure_ascii=False, indent=2)
+
+
+class Analytics(object):
+    """Accumulate the report statistics in one streaming pass
+
+    Feed nodes with add_node and ways with add_way (nodes first, as in an
+    OSM file, so the traffic signals of each way are known when it is
+    added), or whole tables with add_columns; summary() returns a Summary.
+    """
+
+    def __init__(self, cell_size=GRID_CELL_SIZE, center=spatial.CENTER, tag_queries=TAG_QUERIES):
+        self.cell_size = cell_size
+        self.center = center
+        self.nodes = 0
+        self.ways = 0
+        self.users = UserCounts()
+        self.tagged = NodeBitmap()
+        self.signals = NodeBitmap()
+        self.signal_tags = {}       # 有多个 traffic_signals 标签的节点：id -> 标签数
+        self.signal_counts = {}
+        self.way_names = {}
+        self.quadrants = dict.fromkeys(QUADRANTS, 0)
+        self.grid = collections.Counter()
+        self.tag_counts = dict.fromkeys(tag_queries, 0)
+
+    def add_node(self, node_id, lat, lon, user, uid, tags):
+        '''tags 是节点清洗后的 (key, value) 序列；数值可以是 csv 中的字符串。'''
+
+        node_id = int(node_id)
+        lat = float(lat)
+        lon = float(lon)
+        self.nodes += 1
+        self.users.add(int(uid), user)
+
+        center_lat, center_lon = self.center
+        if lat != center_lat and lon != center_lon:
+            self.quadrants[('north' if lat > center_lat else 'south') + ' ' +
+                           ('east' if lon > center_lon else 'west')] += 1
+        self.grid[int((lat + 90) / self.cell_size), int((lon + 180) / self.cell_size)] += 1
+
+        signal_tags = 0
+        for key, value in tags:
+            if value == SIGNAL_VALUE:
+                signal_tags += 1
+            query = ('node', key, value)
+            if query in self.tag_counts:
+                self.tag_counts[query] += 1
+        if tags:
+            self.tagged.add(node_id)
+        if signal_tags:
+            # 报告中的连接按 nodes_tags 的行计数，一个节点有几个信号灯标签就算几次
+            if not self.signals.add(node_id):
+                signal_tags += self.signal_tags.get(node_id, 1)
+            if signal_tags > 1:
+                self.signal_tags[node_id] = signal_tags
+
+    def add_way(self, way_id, user, uid, node_ids, tags):
+        '''node_ids 是途径按顺序引用的节点 id，tags 是清洗后的 (key, value) 序列。'''
+
+        self.ways += 1
+        self.users.add(int(uid), user)
+
+        signals = self.signals
+        count = 0
+        for node_id in node_ids:
+            node_id = int(node_id)
+            if node_id in signals:
+                count += self.signal_tags.get(node_id, 1)
+
+        names = []
+        for key, value in tags:
+            if key == 'name':
+                names.append(value)
+            query = ('way', key, value)
+            if query in self.tag_counts:
+                self.tag_counts[query] += 1
+        if count:
+            way_id = int(way_id)
+            self.signal_counts[way_id] = self.signal_counts.get(way_id, 0) + count
+            if names:
+                self.way_names.setdefault(way_id, []).extend(names)
+
+    def add_rows(self, tag, row, children, tags):
+        '''加入 osm2csv.shape_element_rows 的一个结果。'''
+
+        if tag == 'node':
+            self.add_node(row[0], row[1], row[2], row[3], row[4],
+                          [(key, value) for _, key, value, _ in tags])
+        elif tag == 'way':
+            self.add_way(row[0], row[1], row[2], [node_id for _, node_id, _ in children],
+                         [(key, value) for _, key, value, _ in tags])
+
+    def add_shaped(self, tag, el):
+        '''加入 osm2csv.shape_element 的一个结果。'''
+
+        if tag == 'node':
+            node = el['node']
+            self.add_node(node['id'], node['lat'], node['lon'], node['user'], node['uid'],
+                          [(row['key'], row['value']) for row in el['node_tags']])
+        elif tag == 'way':
+            way = el['way']
+            self.add_way(way['id'], way['user'], way['uid'],
+                         [row['node_id'] for row in el['way_nodes']],
+                         [(row['key'], row['value']) for row in el['way_tags']])
+
+    def add_columns(self, nodes, nodes_tags, ways, ways_nodes, ways_tags):
+        """Add whole tables given as {column: numpy array} (see columnar.read_columns)
+
+        The tables are aggregated with vectorized numpy operations; the
+        result is the same as adding their rows one by one.
+        """
+
+        import numpy as np
+
+        ids = nodes['id'].astype(np.int64)
+        lat = nodes['lat'].astype(np.float64)
+        lon = nodes['lon'].astype(np.float64)
+        self.nodes += len(ids)
+        self.ways += len(ways['id'])
+        self.users.update(np.concatenate([nodes['uid'], ways['uid']]).astype(np.int64),
+                          np.concatenate([nodes['user'], ways['user']]).astype(object))
+
+        center_lat, center_lon = self.center
+        for name in QUADRANTS:
+            north, east = name.split()
+            self.quadrants[name] += int(np.count_nonzero(
+                (lat > center_lat if north == 'north' else lat < center_lat) &
+                (lon > center_lon if east == 'east' else lon < center_lon)))
+        rows = ((lat + 90) / self.cell_size).astype(np.int64)
+        cols = ((lon + 180) / self.cell_size).astype(np.int64)
+        cells, counts = np.unique(np.stack([rows, cols], axis=1), axis=0, return_counts=True)
+        for (row, col), count in zip(cells.tolist(), counts.tolist()):
+            self.grid[row, col] += count
+
+        for element_type, tags in (('node', nodes_tags), ('way', ways_tags)):
+            for query in self.tag_counts:
+                if query[0] == element_type:
+                    self.tag_counts[query] += int(np.count_nonzero(
+                        (tags['key'] == query[1]) & (tags['value'] == query[2])))
+
+        self.tagged.update(nodes_tags['id'])
+        signal_ids = nodes_tags['id'][nodes_tags['value'] == SIGNAL_VALUE].astype(np.int64)
+        self.signals.update(signal_ids)
+        unique, multiplicity = np.unique(signal_ids, return_counts=True)
+        for node_id, count in zip(unique[multiplicity > 1].tolist(),
+                                  multiplicity[multiplicity > 1].tolist()):
+            self.signal_tags[node_id] = count
+
+        # 途径引用的节点与信号灯节点连接：按节点 id 查找每一行的信号灯标签数
+        way_ids = ways_nodes['id'].astype(np.int64)
+        node_ids = ways_nodes['node_id'].astype(np.int64)
+        positions = np.searchsorted(unique, node_ids)
+        positions[positions == len(unique)] = 0
+        hits = (unique[positions] == node_ids) if len(unique) else np.zeros(len(node_ids), bool)
+        signal_ways = np.unique(way_ids[hits])
+        weights = np.bincount(np.searchsorted(signal_ways, way_ids[hits]),
+                              weights=multiplicity[positions[hits]], minlength=len(signal_ways))
+        for way_id, count in zip(signal_ways.tolist(), weights.astype(np.int64).tolist()):
+            self.signal_counts[way_id] = self.signal_counts.get(way_id, 0) + count
+
+        named = ways_tags['key'] == 'name'
+        for way_id, name in zip(ways_tags['id'][named].astype(np.int64).tolist(),
+                                ways_tags['value'][named].tolist()):
+            if way_id in self.signal_counts:
+                self.way_names.setdefault(way_id, []).append(name)
+
+    def summary(self):
+        return Summary(self.nodes, len(self.tagged), self.ways, len(self.users),
+                       dict(self.users.by_name()), dict(self.signal_counts),
+                       {k: list(v) for k, v in self.way_names.items()}, dict(self.quadrants),
+                       dict(self.grid), self.cell_size, dict(self.tag_counts), self.center)
+
+
+def summarize_map(osm_file, **options):
+    """Scan an OSM file (XML, compressed or PBF) and return its Summary
+
+    The elements are cleaned and shaped as in the conversion, without
+    writing any output.
+    """
+
+    import osm2csv
+
+    stats = Analytics(**options)
+    for element in osm2csv.get_element(osm_file, tags=('node', 'way')):
+        shaped = osm2csv.shape_element_rows(element)
+        if shaped is not None:
+            stats.add_rows(*shaped)
+    return stats.summary()
+
+
+def summarize_columns(directory='.', **options):
+    '''读取 directory 中的列式输出（osm2csv.py --format columnar），返回 Summary。'''
+
+    import columnar
+    import osm2csv
+
+    tables = []
+    for path in osm2csv.OUTPUT_PATHS[:5]:   # nodes、nodes_tags、ways、ways_nodes、ways_tags
+        path = os.path.join(directory, path)
+        if os.path.exists(columnar.columnar_path(path, 'parquet')):
+            path = columnar.columnar_path(path, 'parquet')
+        else:   # 没有 pyarrow 时写出的 .npy 目录
+            path = columnar.columnar_path(path, 'npy')
+        tables.append(columnar.read_columns(path))
+    stats = Analytics(**options)
+    stats.add_columns(*tables)
+    return stats.summary()
+
+
+def query_database(conn, cell_size=GRID_CELL_SIZE, center=spatial.CENTER, tag_queries=TAG_QUERIES):
+    '''用报告中的 SQL 查询计算同样的统计，返回 Summary，用来核对内存中的统计。'''
+
+    def scalar(query, *params):
+        return conn.execute(query, params).fetchone()[0]
+
+    center_lat, center_lon = center
+    quadrants = {}
+    for name in QUADRANTS:
+        north, east = name.split()
+        quadrants[name] = scalar('SELECT COUNT(DISTINCT id) FROM nodes WHERE lat %s ? AND lon %s ?'
+                                 % ('>' if north == 'north' else '<', '>' if east == 'east' else '<'),
+                                 center_lat, center_lon)
+    tables = {'node': 'nodes_tags', 'way': 'ways_tags'}
+    if sqlschema.is_encoded(conn):
+        # 字典编码的标签表（osm2sqlite.py --dictionary）：value 先查编号，key 与 tag_keys 连接
+        signal_filter = 'nodes_tags.value_id = (SELECT id FROM tag_values WHERE value = ?)'
+        names = ("SELECT t.id, v.value FROM tag_keys k JOIN ways_tags t ON t.key_id = k.id "
+                 "JOIN tag_values v ON v.id = t.value_id WHERE k.key = 'name'")
+        count_tags = ('SELECT COUNT(t.id) FROM tag_keys k JOIN %s t ON t.key_id = k.id '
+                      'WHERE k.key = ? AND t.value_id = (SELECT id FROM tag_values WHERE value = ?)')
+    else:
+        signal_filter = 'nodes_tags.value = ?'
+        names = "SELECT id, value FROM ways_tags WHERE key = 'name'"
+        count_tags = 'SELECT COUNT(id) FROM %s WHERE key = ? AND value = ?'
+
+    signal_counts = dict(conn.execute(
+        '''SELECT ways_nodes.id, COUNT(ways_nodes.id) FROM ways_nodes
+           JOIN nodes_tags ON ways_nodes.node_id = nodes_tags.id
+           WHERE %s GROUP BY ways_nodes.id''' % signal_filter, (SIGNAL_VALUE,)))
+    way_names = {}
+    for way_id, name in conn.execute(names):
+        if way_id in signal_counts:
+            way_names.setdefault(way_id, []).append(name)
+    tag_counts = {(t, k, v): scalar(count_tags % tables[t], k, v) for t, k, v in tag_queries}
+    return Summary(
+        scalar('SELECT COUNT(DISTINCT id) FROM nodes'),
+        scalar('SELECT COUNT(DISTINCT id) FROM nodes_tags'),
+        scalar('SELECT COUNT(*) FROM ways'),
+        scalar('SELECT COUNT(DISTINCT uid) FROM (SELECT uid FROM nodes UNION ALL '
+               'SELECT uid FROM ways)'),
+        dict(conn.execute('SELECT user, COUNT(user) FROM (SELECT user FROM nodes UNION ALL '
+                          'SELECT user FROM ways) GROUP BY user')),
+        signal_counts, way_names, quadrants, spatial.grid_histogram(conn, cell_size), cell_size,
+        tag_counts, center)
+
+
+def print_summary(summary, n=10):
+    print('nodes %d, tagged nodes %d (%.2f%%), ways %d, users %d'
+          % (summary.nodes, summary.tagged_nodes, summary.tagged_ratio * 100,
+             summary.ways, summary.users))
+    for (element_type, key, value), count in summary.tag_counts.items():
+        print('%s %s=%s: %d' % (element_type, key, value, count))
+    print('top users:')
+    for user, count in summary.top_users(n):
+        print('  %-24s %d' % (user, count))
+    print('top traffic signal ways:')
+    for way_id, count, names in summary.top_signal_ways(n):
+        print('  %-12d %4d  %s' % (way_id, count, ', '.join(names)))
+    ratios = summary.quadrant_ratios()
+    for name in QUADRANTS:
+        print('%-12s %10d %8.2f%%' % (name, summary.quadrants[name], ratios[name] * 100))
+    print('%d grid cells of %g degrees' % (len(summary.grid), summary.cell_size))
+
+
+def compare(summary, expected):
+    '''返回两个 Summary 中不同的统计项的名称。'''
+
+    fields = ('nodes', 'tagged_nodes', 'ways', 'users', 'user_counts', 'signal_counts',
+              'quadrants', 'grid', 'tag_counts')
+    differ = [field for field in fields if getattr(summary, field) != getattr(expected, field)]
+    names = {k: sorted(v) for k, v in summary.way_names.items()}
+    if names != {k: sorted(v) for k, v in expected.way_names.items()}:
+        differ.append('way_names')
+    return differ
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compute the report statistics in one pass.')
+    parser.add_argument('osm_file', nargs='?', help='OSM file to scan')
+    parser.add_argument('--columnar', metavar='DIR',
+                        help='read the columnar outputs in DIR instead of an OSM file')
+    parser.add_argument('--cell-size', type=float, default=GRID_CELL_SIZE,
+                        help='grid histogram cell size in degrees')
+    parser.add_argument('--top', type=int, default=10, help='number of top users and ways')
+    parser.add_argument('--output', help='write the summary as JSON to this file')
+    parser.add_argument('--check', metavar='DB',
+                        help='compare with the SQL queries of the report on this SQLite database')
+    args = parser.parse_args()
+    if not args.osm_file and not args.columnar:
+        parser.error('an OSM file or --columnar is required')
+
+    start = time.perf_counter()
+    if args.columnar:
+        summary = summarize_columns(args.columnar, cell_size=args.cell_size)
+    else:
+        summary = summarize_map(args.osm_file, cell_size=args.cell_size)
+    elapsed = time.perf_counter() - start
+    print_summary(summary, args.top)
+    print('computed in %.2fs' % elapsed)
+    if args.output:
+        summary.write(args.output, args.top)
+
+    if args.check:
+        import sqlite3
+        conn = sqlite3.connect(args.check)
+        start = time.perf_counter()
+        expected = query_database(conn, args.cell_size)
+        print('SQL queries took %.2fs' % (time.perf_counter() - start))
+        differ = compare(summary, expected)
+        if differ:
+            print('differ from the database: %s' % ', '.join(differ))
+            raise SystemExit(1)
+        print('same as the database')
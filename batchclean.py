@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# 批量清洗：对一整列的值（pandas Series、numpy 数组或列表）做清洗，结果与逐个调用
+# clean.update_value 完全相同。
+# 每一列先去重（pd.factorize），只清洗不同的值；常见的格式用向量化的字符串操作和 clean 中
+# 编译好的正则表达式一次处理，少见的格式逐个交给 clean 中的清洗函数。
+# 用法：clean_column('phone', df['value']) 或 clean_tags(nodes_tags)
+#       python batchclean.py nodes_tags.csv  （与逐个清洗比较耗时并检查结果是否相同）
+
+import argparse
+import functools
+import time
+
+import numpy as np
+import pandas as pd
+
+import clean
+
+
+# 只由这些字符组成、且少于17个字符的电话号码走向量化的路径（update_phone 对17个字符以上的值
+# 会尝试按分隔符拆成多个号码）；其他字符（e.g. 全角数字）交给 update_phone
+SIMPLE_PHONE = r'[0-9 +()\-]*'
+
+
+def to_series(values):
+    '''把输入的一列值转换成 object 类型的 Series，正则匹配使用 Python 的 re，与 clean 中一致。'''
+
+    if isinstance(values, pd.Series):
+        if values.dtype == object:
+            return values
+        # str、string 类型把 None 存成 NaN 或 pd.NA，转换回 None，与列表和 object 数组的输入一致
+        return values.astype(object).where(values.notna(), None)
+    return pd.Series(np.asarray(values, dtype=object), dtype=object)
+
+
+def like_input(cleaned, values):
+    '''按输入的类型返回清洗结果：Series 保留原来的索引和名称，numpy 数组返回 object 数组，其他返回列表。'''
+
+    if isinstance(values, pd.Series):
+        return pd.Series(cleaned, index=values.index, name=values.name, dtype=object)
+    if isinstance(values, np.ndarray):
+        return cleaned
+    return cleaned.tolist()
+
+
+def deduplicated(clean_unique):
+    '''装饰器：clean_unique 清洗一个不含重复值的 Series，返回 object 数组；
+    包装后的函数接收任意一列值，去重后清洗，再按原来的位置展开。缺失值（NaN、None）原样保留。'''
+
+    @functools.wraps(clean_unique)
+    def clean_values(values):
+        series = to_series(values)
+        codes, uniques = pd.factorize(series)
+        cleaned = np.asarray(clean_unique(pd.Series(uniques, dtype=object)), dtype=object)
+        result = cleaned.take(codes) if len(cleaned) else np.empty(len(codes), dtype=object)
+        missing = codes < 0
+        if missing.any():
+            result[missing] = series.to_numpy()[missing]
+        return like_input(result, values)
+
+    return clean_values
+
+
+def fallback(values, fast, result, function):
+    '''fast 为 False 的值逐个用 function 清洗，写入 result。'''
+
+    slow = np.flatnonzero(~fast)
+    if len(slow):
+        result[slow] = [function(v) for v in values.to_numpy()[slow]]
+    return result
+
+
+@deduplicated
+def clean_postcodes(values):
+    '''批量的 clean.update_postcode。'''
+
+    keep = values.str.fullmatch(clean.POSTCODE_RE).to_numpy(dtype=bool)
+    return np.where(keep, values.to_numpy(), '')
+
+
+@deduplicated
+def clean_house_numbers(values):
+    '''批量的 clean.update_house_number。'''
+
+    keep = values.str.contains(clean.DIGIT_RE).to_numpy(dtype=bool)
+    return np.where(keep, values.to_numpy(), '')
+
+
+@deduplicated
+def clean_phones(values):
+    '''批量的 clean.update_phone：单个号码按位数和开头的数字向量化地标准化。'''
+
+    fast = ((values.str.len() < 17) & values.str.fullmatch(SIMPLE_PHONE)).to_numpy(dtype=bool)
+    digits = values[fast].str.replace(r'[^0-9]', '', regex=True)
+    length = digits.str.len()
+
+    def styles(style_set, tail):
+        # (开头的数字, 位数) 的组合中任意一种；开头的长度恰好是位数减去号码本身的位数
+        mask = np.zeros(len(digits), dtype=bool)
+        for prefix, size in style_set:
+            mask |= ((length == size) & digits.str.startswith(prefix)).to_numpy(dtype=bool)
+        return mask & (length >= tail).to_numpy(dtype=bool)
+
+    fixed = styles(clean.PHONE_STYLE, 8)
+    mobile = (styles(clean.MOBILE_STYLE, 11) &
+              digits.str[-11:-8].isin(clean.MOBILE_START_NUMBER).to_numpy(dtype=bool))
+    special = styles(clean.SPECIAL_STYLE, 10)
+    styled = np.select([fixed, mobile, special],
+                       [('+86 10 ' + digits.str[-8:]).to_numpy(dtype=object),
+                        ('+86 ' + digits.str[-11:]).to_numpy(dtype=object),
+                        ('+86 ' + digits.str[-10:]).to_numpy(dtype=object)],
+                       default='')
+
+    result = np.empty(len(values), dtype=object)
+    result[fast] = styled
+    return fallback(values, fast, result, clean.update_phone)
+
+
+@deduplicated
+def clean_hours(values):
+    '''批量的 clean.update_hour：已经是统一格式的值（不含 ';'）style_hour 不会改变，原样保留。'''
+
+    fast = values.str.fullmatch(clean.HOUR_RE).to_numpy(dtype=bool)
+    result = np.empty(len(values), dtype=object)
+    result[fast] = values.to_numpy()[fast]
+    return fallback(values, fast, result, clean.update_hour)
+
+
+# 批量清洗函数注册表，与 clean.UPDATERS 的键相同
+BATCH_CLEANERS = {
+    'phone': clean_phones,
+    'postcode': clean_postcodes,
+    'housenumber': clean_house_numbers,
+    'opening_hours': clean_hours,
+}
+
+
+def clean_column(key, values):
+    """Clean a column of values of one tag key
+
+    The result equals [clean.update_value(key, v) for v in values] and has
+    the type of values: a Series (same index), an object array or a list.
+    Keys without a cleaning rule are returned unchanged.
+    """
+
+    cleaner = BATCH_CLEANERS.get(key)
+    if cleaner is None:
+        return values
+    return cleaner(values)
+
+
+def clean_tags(tags, key='key', value='value'):
+    """Return the cleaned value column of a tags DataFrame (e.g. nodes_tags)
+
+    Every value is cleaned by the rule of the key in the same row, as
+    osm2csv.shape_element does.
+    """
+
+    cleaned = tags[value].astype(object).copy()
+    for rule in BATCH_CLEANERS:
+        mask = (tags[key] == rule).to_numpy()
+        if mask.any():
+            cleaned[mask] = clean_column(rule, tags[value][mask]).to_numpy()
+    return cleaned
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Clean the values of a tags csv in batches and '
+                                                 'compare with per-value cleaning.')
+    parser.add_argument('tags_csv', help='csv with key and value columns, e.g. nodes_tags.csv')
+    parser.add_argument('--output', help='write the tags with cleaned values to this csv')
+    args = parser.parse_args()
+
+    tags = pd.read_csv(args.tags_csv, dtype=str, keep_default_na=False)
+
+    start = time.perf_counter()
+    cleaned = clean_tags(tags)
+    batch_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected = [clean.update_value(k, v) for k, v in zip(tags['key'], tags['value'])]
+    scalar_time = time.perf_counter() - start
+
+    differ = int((cleaned.to_numpy() != np.asarray(expected, dtype=object)).sum())
+    print('%d values: batch %.3fs, per value %.3fs, %d differ'
+          % (len(tags), batch_time, scalar_time, differ))
+    if args.output:
+        tags.assign(value=cleaned).to_csv(args.output, index=False)
+    if differ:
+        raise SystemExit(1)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# 基准测试：在 synthosm.py 生成的合成数据上测量
+#   1. 每个 clean.update_* 清洗函数和 is_* 判断函数的单次调用耗时（微基准），
+#      --osm 时输入值改为取自真实的 osm 文件；
+#   2. osm2csv.process_map 在不同输入规模下的端到端耗时和吞吐量。
+# 结果写成 JSON 文件，--compare 与之前保存的结果比较，变慢超过阈值时返回非零退出码。
+# 用法：python benchmark.py --output bench.json [--compare old_bench.json] [--osm sample.osm]
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import clean
+import osm2csv
+import synthosm
+
+
+# (名称, 函数, 输入值所属的清洗规则)
+MICRO_CASES = [
+    ('update_phone', clean.update_phone, 'phone'),
+    ('update_phone_number', clean.update_phone_number, 'phone'),
+    ('is_phone_standard', clean.is_phone_standard, 'phone'),
+    ('is_mobile_phone', clean.is_mobile_phone, 'phone'),
+    ('update_postcode', clean.update_postcode, 'postcode'),
+    ('is_postcode', clean.is_postcode, 'postcode'),
+    ('update_hour', clean.update_hour, 'opening_hours'),
+    ('is_hour', clean.is_hour, 'opening_hours'),
+    ('update_house_number', clean.update_house_number, 'housenumber'),
+    ('is_house_number', clean.is_house_number, 'housenumber'),
+]
+
+MICRO_VALUES = 10000       # 每个微基准的输入值个数
+
+SIZES = [10000, 100000]    # 端到端测试的节点数，途径数是节点数的1/10
+
+REGRESSION = 0.10          # 比基线慢10%以上视为变慢
+
+
+def best_time(function, repeat):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def load_values(osm_file):
+    '''读取 osm 文件中有清洗规则的tag值，返回 {清洗规则: [值]}；键按 shape_element 的方式去掉类型前缀。'''
+
+    values = {rule: [] for rule in clean.UPDATERS}
+    for element in osm2csv.get_element(osm_file, tags=('node', 'way')):
+        for tag in element.iter('tag'):
+            k = tag.attrib['k']
+            if osm2csv.LOWER_COLON.search(k.lower()):
+                k = k[k.index(':')+1:]
+            if k in values:
+                values[k].append(tag.attrib['v'])
+    return values
+
+
+def bench_micro(values=MICRO_VALUES, repeat=5, seed=1, osm_values=None):
+    """Time every MICRO_CASES function on values synthetic inputs
+
+    osm_values is a {rule: [values]} dict from load_values; with it every
+    function runs on the real values of its rule instead.
+    Return {name: {'calls': n, 'ns_per_call': best time per call}}.
+    """
+
+    results = {}
+    for name, function, rule in MICRO_CASES:
+        if osm_values is not None:
+            inputs = osm_values[rule]
+            if not inputs:
+                continue
+        else:
+            inputs = synthosm.sample_values(rule, values, seed)
+
+        def run():
+            for value in inputs:
+                function(value)
+
+        results[name] = {'calls': len(inputs),
+                         'ns_per_call': best_time(run, repeat) / len(inputs) * 1e9}
+    return results
+
+
+def bench_process_map(sizes=SIZES, repeat=3, seed=1, workers=1, validate=False, pipeline=None):
+    """Convert synthetic maps of each size with osm2csv.process_map
+
+    Every run uses a fresh temporary directory and the default cache size;
+    pipeline is passed to process_map (background writer threads).
+    Return {size: {'elements', 'input_bytes', 'seconds', 'elements_per_second'}}.
+    """
+
+    results = {}
+    cwd = os.getcwd()
+    tmp_dir = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        os.chdir(tmp_dir)
+        for size in sizes:
+            osm_file = os.path.join(tmp_dir, 'synthetic_%d.osm' % size)
+            elements = synthosm.generate(osm_file, nodes=size, seed=seed)
+
+            def run():
+                osm2csv.process_map(osm_file, validate, workers=workers, pipeline=pipeline)
+
+            seconds = best_time(run, repeat)
+            results[str(size)] = {'elements': elements,
+                                  'input_bytes': os.path.getsize(osm_file),
+                                  'seconds': seconds,
+                                  'elements_per_second': elements / seconds}
+            os.remove(osm_file)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(sizes=SIZES, micro_values=MICRO_VALUES, repeat=3, seed=1, workers=1,
+              validate=False, pipeline=None, osm_file=None):
+    """Run the micro and end-to-end benchmarks and return the results dict
+
+    With osm_file the micro benchmarks use the tag values of that file.
+    """
+
+    osm_values = load_values(osm_file) if osm_file is not None else None
+
+    return {
+        'meta': {'commit': git_commit(),
+                 'python': platform.python_version(),
+                 'platform': platform.platform(),
+                 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                 'seed': seed,
+                 'workers': workers,
+                 'validate': validate,
+                 'pipeline': pipeline,
+                 'osm_file': osm_file},
+        'micro': bench_micro(micro_values, repeat, seed, osm_values),
+        'process_map': bench_process_map(sizes, repeat, seed, workers, validate, pipeline),
+    }
+
+
+def compare(results, baseline, threshold=REGRESSION):
+    """Print the change against a baseline result and return the regressed benchmarks"""
+
+    rows = []
+    for name, stats in results['micro'].items():
+        if name in baseline.get('micro', {}):
+            rows.append(('micro ' + name, baseline['micro'][name]['ns_per_call'],
+                         stats['ns_per_call']))
+    for size, stats in results['process_map'].items():
+        if size in baseline.get('process_map', {}):
+            rows.append(('process_map %s' % size, baseline['process_map'][size]['seconds'],
+                         stats['seconds']))
+
+    regressions = []
+    print('%-32s %12s %12s %8s' % ('benchmark', 'baseline', 'current', 'change'))
+    for name, old, new in rows:
+        change = new / old - 1 if old else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  slower'
+            regressions.append(name)
+        print('%-32s %12.4g %12.4g %+7.1f%%%s' % (name, old, new, change * 100, flag))
+    return regressions
+
+
+def print_results(results):
+    print('%-24s %12s' % ('function', 'ns/call'))
+    for name, stats in results['micro'].items():
+        print('%-24s %12.0f' % (name, stats['ns_per_call']))
+    print('%-10s %10s %10s %14s' % ('nodes', 'MB', 'seconds', 'elements/s'))
+    for size, stats in results['process_map'].items():
+        print('%-10s %10.1f %10.2f %14.0f' % (size, stats['input_bytes'] / 1e6,
+                                              stats['seconds'], stats['elements_per_second']))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the cleaning and conversion paths.')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file for the results')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='JSON results of an earlier run to compare against')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help='node counts of the end-to-end runs')
+    parser.add_argument('--micro-values', type=int, default=MICRO_VALUES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--validate', action='store_true')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='write the csv files from background threads')
+    parser.add_argument('--osm', metavar='OSM_FILE',
+                        help='run the micro benchmarks on the tag values of this file')
+    parser.add_argument('--threshold', type=float, default=REGRESSION,
+                        help='relative slowdown reported as a regression')
+    args = parser.parse_args()
+
+    results = run_suite(args.sizes, args.micro_values, args.repeat, args.seed,
+                        args.workers, args.validate, {} if args.pipeline else None, args.osm)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print_results(results)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
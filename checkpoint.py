@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# 断点续传：长时间的转换按分片（与并行模式相同的、以元素边界切分的字节范围）进行，
+# 每个分片写完后把输入文件中已处理到的字节位置和各个输出文件的大小记录到检查点文件中。
+# 转换中断后加上 --resume 重新运行：输出文件被截断到检查点记录的大小（去掉最后一个分片写了一半的行），
+# 解析从记录的位置继续，新的行追加到输出文件后面，不会重复也不会遗漏。
+# 用法：python osm2csv.py beijing_china.osm --checkpoint osm2csv.checkpoint [--resume]
+#       python osm2sqlite.py beijing_china.osm --checkpoint [--resume]（检查点记录在数据库中）
+
+import json
+import os
+import time
+
+
+CHECKPOINT_PATH = 'osm2csv.checkpoint'
+
+CHECKPOINT_BYTES = 64 * 1024 * 1024   # 两次检查点之间处理的输入字节数
+
+
+def input_identity(file_in):
+    '''输入文件的标识，续传时用来确认输入没有换成别的文件或被修改过。'''
+
+    stat = os.stat(file_in)
+    return {'path': os.path.abspath(file_in), 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+def sync_file(path):
+    '''把文件已写入的内容刷到磁盘上。'''
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Checkpoint(object):
+    '''检查点文件：记录输入已处理到的字节位置和这时每个输出文件的大小。
+
+    save 在输出文件刷到磁盘之后才原子地替换检查点文件，所以检查点记录的大小总是已经写完的内容。'''
+
+    def __init__(self, path, file_in, out_paths):
+        self.path = path
+        self.input = input_identity(file_in)
+        self.out_paths = [os.path.abspath(p) for p in out_paths]
+
+    def load(self):
+        """Truncate the outputs to the checkpoint and return its input offset
+
+        Return None when there is no checkpoint file. Raise ValueError when
+        the checkpoint belongs to another input or set of outputs, or an
+        output is shorter than recorded.
+        """
+
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, encoding='utf-8') as f:
+            state = json.load(f)
+        if state['input'] != self.input:
+            raise ValueError('checkpoint %s was written for %s, which differs from the input'
+                             % (self.path, state['input']['path']))
+        if [path for path, size in state['outputs']] != self.out_paths:
+            raise ValueError('checkpoint %s was written for other output files' % self.path)
+
+        for path, size in state['outputs']:
+            if not os.path.exists(path) or os.path.getsize(path) < size:
+                raise ValueError('%s is shorter than its checkpoint, it cannot be resumed' % path)
+        # 去掉检查点之后写出的（可能不完整的）内容
+        for path, size in state['outputs']:
+            os.truncate(path, size)
+        return state['offset']
+
+    def save(self, offset):
+        """Record offset with the current output sizes, after syncing the outputs"""
+
+        for path in self.out_paths:
+            sync_file(path)
+        state = {'input': self.input,
+                 'offset': offset,
+                 'outputs': [(path, os.path.getsize(path)) for path in self.out_paths],
+                 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
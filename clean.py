@@ -3,43 +3,51 @@
 
 # Python 3.6
 
+import functools
 import re
 import xml.etree.cElementTree as ET
 
+import compressed
+import hours
+
 
 sOSMFILE = 'sample_beijing_china.osm'
 OSMFILE = 'beijing_china.osm'
 
        
 #-------- 清洗电话号码 -----------       
+
+# 所有正则表达式都在导入时编译一次，避免每次调用时查找 re 模块的缓存
+
+# 标准格式：固定电话 +86 10 xxxxxxxx，移动电话 +86 xxxxxxxxxxx，400电话 +86 400xxxxxxx
+PHONE_STANDARD_RE = re.compile(r'\+86 (?:10 \d{8}|\d{11}|400\d{7})')
+
+# 移动电话号码的前三位
+MOBILE_START_NUMBER = frozenset(['133', '153', '180', '181', '189', '177', '173', '149',
+                                 '130', '131', '132', '155', '156', '145', '185', '186',
+                                 '176', '175', '134', '135', '136', '137', '138', '139', 
+                                 '150', '151', '152', '157', '158', '159', '182', '183',
+                                 '184', '187', '188', '147', '178'])
+
+# 定义一些可能出现的号码格式
+# 以下集合中每一个元素都是数据中出现的号码格式，元组的第一个元素代表打头的数字，第二个元素代表位数
+PHONE_STYLE = frozenset([('8610',12), ('86010', 13), ('008610', 14), ('010', 11), 
+                         ('10', 10), ('86', 10), ('', 8) ])
+MOBILE_STYLE = frozenset([('86', 13), ('0086', 15), ('', 11)])
+SPECIAL_STYLE = frozenset([('86400', 12), ('400', 10)])
+
        
 def is_phone_standard(phone_number):
     '''判断电话号码是否符合标准格式。'''
 
-    phone_pattern = r'^\+86 10 \d{8}$'
-    mobile_phone_pattern = r'^\+86 \d{11}$'
-    special_pattern = r'^\+86 400\d{7}$'
-    if (re.fullmatch(phone_pattern, phone_number)  \
-        or re.fullmatch(mobile_phone_pattern, phone_number) \
-        or re.fullmatch(special_pattern, phone_number)):
-        return True
-    else:
-        return False
+    return PHONE_STANDARD_RE.fullmatch(phone_number) is not None
 
 
 def is_mobile_phone(value):
     '''判断是否是移动电话号码, 是则返回True，不是返回False。
     判断标准：位数是11位，且以特定的三位数字开头。'''
     
-    start_number = ['133', '153', '180', '181', '189', '177', '173', '149',
-                    '130', '131', '132', '155', '156', '145', '185', '186',
-                    '176', '175', '134', '135', '136', '137', '138', '139', 
-                    '150', '151', '152', '157', '158', '159', '182', '183',
-                    '184', '187', '188', '147', '178']
-    if (len(value) == 11) and (value[:3] in start_number): 
-        return True
-    else:
-        return False
+    return (len(value) == 11) and (value[:3] in MOBILE_START_NUMBER)
         
 
 def update_phone_number(phone_value):
@@ -47,25 +55,15 @@ def update_phone_number(phone_value):
     标准格式定义成：国家编号 + [区号] + 号码。'''
 
     # 去除非数字的字符
-    digit_value = ''
-    for char in phone_value:
-        if char.isdigit():
-            digit_value += char
-    
-    # 定义一些可能出现的号码格式
-    # 以下列表中每一个元素都是数据中出现的号码格式，元组的第一个元素代表打头的数字，第二个元素代表位数
-    phone_style = [('8610',12), ('86010', 13), ('008610', 14), ('010', 11), 
-                    ('10', 10), ('86', 10), ('', 8) ]
-    mobile_style = [('86', 13), ('0086', 15), ('', 11)]
-    special_style = [('86400', 12), ('400', 10)]
+    digit_value = ''.join(filter(str.isdigit, phone_value))
         
     # 按固定电话、移动电话、400电话三种形式分别进行电话号码格式的标准化    
-    if (digit_value[:-8], len(digit_value)) in phone_style:
+    if (digit_value[:-8], len(digit_value)) in PHONE_STYLE:
         styled_value = '+86 10 ' + digit_value[-8:]
-    elif ((digit_value[:-11], len(digit_value)) in mobile_style) \
+    elif ((digit_value[:-11], len(digit_value)) in MOBILE_STYLE) \
             and is_mobile_phone(digit_value[-11:]):
         styled_value = '+86 ' + digit_value[-11:]
-    elif (digit_value[:-7], len(digit_value)) in special_style:
+    elif (digit_value[:-7], len(digit_value)) in SPECIAL_STYLE:
         styled_value = '+86 ' + digit_value[-10:]
     else: 
         styled_value = ''  # 如果不能标准化，则返回空字符串
@@ -102,21 +100,18 @@ def update_phone(phone_value):
 
 
 
+def check_phone(phone_number):
+    '''审查单个电话号码，返回不符合标准的号码列表。'''
+
+    if not is_phone_standard(phone_number):  # 判断是否符合标准
+        return [phone_number]
+    return []
+
+
 def audit_phone(filename):
     '''审查文件中的电话号码是否符合标准，返回不符合标准的号码'''
     
-    osm_file = open(filename, 'r')
-    wrong_numbers = []   # 记录不符合标准的号码
-    
-    for event, elem in ET.iterparse(osm_file):
-    
-        if  elem.tag == 'tag':   # 获取tag的元素
-            if elem.attrib['k'] in ['phone', 'contact:phone']:
-                phone_number = elem.attrib['v']
-                if not is_phone_standard(phone_number):  # 判断是否符合标准
-                    wrong_numbers.append(phone_number)
-
-    return wrong_numbers
+    return audit(filename, rules=['phone'])['phone']['wrong']
 
 
 
@@ -125,13 +120,14 @@ def audit_phone(filename):
 #--------- 清洗邮政编码 ---------------  
 
 
+# 定义邮编的正则表达式，北京地区邮编以100、101、102开头，共6位数字
+POSTCODE_RE = re.compile(r'10[0-2]\d{3}')
+
+
 def is_postcode(code):
     '''判断是否符合北京邮政编码格式，是返回True，不是返回False。'''
 
-    # 定义邮编的正则表达式，北京地区邮编以100、101、102开头，共6位数字
-    postcode_parttern = r'^10[0-2]\d{3}$'
-    
-    return re.fullmatch(postcode_parttern, code)
+    return POSTCODE_RE.fullmatch(code)
     
     
     
@@ -148,20 +144,18 @@ def update_postcode(code):
     
     
     
+def check_postcode(code):
+    '''审查单个邮编，返回错误的邮编列表。'''
+
+    if not is_postcode(code):  # 是否符合邮编格式
+        return [code]
+    return []
+
+
 def audit_postcode(filename):
     '''审查数据中的邮政编码，返回值是错误的邮编。'''
 
-    wrong_list = []
-    osm_file = open(filename, 'r')
-    
-    for event, elem in ET.iterparse(osm_file):
-        if  elem.tag == 'tag':   # 获取tag的元素
-            if elem.attrib['k'] == 'addr:postcode':
-                code =  elem.attrib['v']
-                if not is_postcode(code):  # 是否符合邮编格式
-                    wrong_list.append(code)
-    
-    return wrong_list
+    return audit(filename, rules=['postcode'])['postcode']['wrong']
     
     
  
@@ -169,60 +163,69 @@ def audit_postcode(filename):
  #--------- 清洗营业时间数据-------------
     
 
+# 关于小时、星期、月份的正则表达式
+HOUR = r'\d{1,2}:\d{1,2}'  
+WEEK = r'(Mo|Tu|We|Th|Fr|Sa|Su)'
+MONTH = r'(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)'
+MONTH_DAY = MONTH + r' \d{1,2}'
+
+# 定义了营业时间的统一格式，共有10中形式
+HOUR_PATTERNS = [
+    '24/7',                                               # 表示7天24小时都营业
+    HOUR + '-' + HOUR,                                    # e.g. 06:00-23:00
+    WEEK + '-' + WEEK + ' ' + HOUR + '-' + HOUR,          # e.g. Mo-Su 06:00-23:00
+    WEEK + ' ' + HOUR + '-' + HOUR,                       # e.g. Sat 09:30-22:00
+    MONTH + '-' + MONTH + ' ' + WEEK + '-' + WEEK + ' ' + HOUR + '-' + HOUR,
+                                                          # e.g. Apr-Oct Mo-Su 05:00-24:00
+    MONTH_DAY + '-' + MONTH_DAY + ' ' + HOUR + '-' + HOUR,   # e.g. Apr 1-Oct 31 05:00-24:00
+    WEEK + '-' + WEEK + ' ' + HOUR + '-' + HOUR + ', ' + HOUR + '-' + HOUR,
+                                                          # e.g. Su-Fr 08:30-11:30, 13:30-17:00
+    HOUR + '-' + HOUR + ', ' + HOUR + '-' + HOUR,         # e.g. 08:30-11:30, 13:30-17:00
+    MONTH + '-' + MONTH + ' ' + HOUR + '-' + HOUR,        # e.g. Apr-Oct 08:00-17:00
+    HOUR + '-' + HOUR + ',' + HOUR + '-' + HOUR,
+]
+
+# 把十种格式合并成一个正则表达式，一次匹配即可判断
+HOUR_RE = re.compile('|'.join('(?:%s)' % p for p in HOUR_PATTERNS))
+
+
 def is_hour(value): 
     '''判断营业时间是否满足统一的格式'''
 
-    # 关于小时、星期、月份的正则表达式
-    h = '\d{1,2}:\d{1,2}'  
-    w = '(Mo|Tu|We|Th|Fr|Sa|Su)'
-    m = '(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)'
-    md = m +' \d{1,2}'
-    
-    # 定义了营业时间的统一格式，共有10中形式
-    p0 = '24/7'                    # 表示7天24小时都营业
-    p1 = h + '-' + h               # e.g. 06:00-23:00
-    p2 = w + '-' + w + ' ' + p1    # e.g. Mo-Su 06:00-23:00
-    p3 = w + ' ' + p1              # e.g. Sat 09:30-22:00
-    p4 = m + '-' + m + ' ' + p2    # e.g. Apr-Oct Mo-Su 05:00-24:00
-    p5 = md + '-' + md + ' ' + p1  # e.g. Apr 1-Oct 31 05:00-24:00
-    p6 = p2 + ', ' + p1            # e.g. Su-Fr 08:30-11:30, 13:30-17:00
-    p7 = p1 + ', ' + p1            # e.g. 08:30-11:30, 13:30-17:00
-    p8 = m + '-' + m + ' ' + p1    # e.g. Apr-Oct 08:00-17:00
-    p9 = p1 + ',' + p1
-
-    # 判断数据是否满足以上给出的统一格式，是则返回True，否则返回False
-    if  (re.fullmatch(p1, value) \
-        or re.fullmatch(p2, value) \
-        or re.fullmatch(p3, value) \
-        or re.fullmatch(p4, value) \
-        or re.fullmatch(p5, value) \
-        or re.fullmatch(p6, value) \
-        or re.fullmatch(p7, value) \
-        or re.fullmatch(p8, value) \
-        or re.fullmatch(p9, value) \
-        or value == p0):
-        return True
-    else:
-        return False
+    # 判断数据是否满足 HOUR_PATTERNS 中给出的统一格式，是则返回True，否则返回False
+    return HOUR_RE.fullmatch(value) is not None
                               
                 
         
                 
+# style_hour 中用到的正则表达式
+WEEK_FULL_RE = re.compile(r'(Mon|Tue|Wed|Thu|Fri|Sat|Sun)')
+WEEK_FULL = frozenset(['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'])
+HOUR_24 = frozenset(['24h', '24小时', '24/24', 'ALL'])
+TILDE_RE = re.compile(HOUR + '~' + HOUR)                     # e.g. 9:30~21:30
+DOT_HOUR_RE = re.compile(r'\d{1,2}\.\d{1,2}')                 # e.g. 10.00-24.00
+REDUNDANT_COLON_RE = re.compile(r'[A-Za-z]*: [A-Za-z]*')     # e.g. Jan-Dec: Mo-Su 11:00-23:00
+AM1_RE = re.compile(r'\d{1,2}:\d{1,2}(am|AM)')
+PM1_RE = re.compile(r'\d{1,2}:\d{1,2}(pm|PM)')
+AM2_RE = re.compile(r'\d{1,2}(am|AM)')
+PM2_RE = re.compile(r'\d{1,2}(pm|PM)')
+RANGE_AM_RE = re.compile(HOUR + '-' + HOUR + ' am')           # e.g. 06:00-10:00 am
+SPACED_RANGE_RE = re.compile(HOUR + ' - ' + HOUR)             # e.g. 9:00 - 22:00
+SPACED_COLON_RE = re.compile(r'\d{1,2}:\s\d{1,2}-\d{1,2}:\s\d{1,2}')   # e.g. 10: 00-24: 00
+
+
 def style_hour(string):
     '''统一时间格式。'''
 
     # Mon to Mo
-    w2 = '(Mon|Tue|Wed|Thu|Fri|Sat|Sun)'
-    w2_list = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
-    slist = re.split(w2, string)
+    slist = WEEK_FULL_RE.split(string)
     for i, s in enumerate(slist):
-        if s in w2_list:
+        if s in WEEK_FULL:
             slist[i] = slist[i][:-1]
     string = ''.join(slist)
     
     # 24h
-    list_24 = ['24h', '24小时', '24/24', 'ALL']
-    if string in list_24:
+    if string in HOUR_24:
         string = '24/7'
     
     
@@ -231,26 +234,21 @@ def style_hour(string):
         string = string.replace('to', '-')
     
     # fix 9:30~21:30
-    h = '\d{1,2}:\d{1,2}'
-    wp1 = h + '~' + h
-    if re.match(wp1, string):
+    if TILDE_RE.match(string):
         string = string.replace('~', '-')
 
 
     # fix 10.00-24.00
-    wp4 = '\d{1,2}\.\d{1,2}'
-    m = re.search(wp4, string)
-    if m:
+    if DOT_HOUR_RE.search(string):
         string = string.replace('.', ':')
     
     # wrong '：' e.g. 10：00-24：00
-    if re.search('：', string):
+    if '：' in string:
         string = string.replace('：', ':')
         
 
     # remove redundant ':', e.g. Jan-Dec: Mo-Su 11:00-23:00
-    wp5 = '[A-Za-z]*: [A-Za-z]*'
-    m = re.search(wp5, string)
+    m = REDUNDANT_COLON_RE.search(string)
     if m:
         s = m.start()
         e = m.end()
@@ -258,16 +256,14 @@ def style_hour(string):
         
         
     # am, pm 
-    pam1 = '\d{1,2}:\d{1,2}(am|AM)'
-    ppm1 = '\d{1,2}:\d{1,2}(pm|PM)'
-    am1 = re.search(pam1, string)
+    am1 = AM1_RE.search(string)
     if am1:
         s = am1.start()
         e = am1.end()
         ho = string[s:e-2]
         string = string[:s] + ho + string[e:]
 
-    pm1 = re.search(ppm1, string)
+    pm1 = PM1_RE.search(string)
     if pm1:
         s = pm1.start()
         e = pm1.end()
@@ -276,16 +272,14 @@ def style_hour(string):
         ho = str(int(sh[0]) + 12) + ':' + sh[1]
         string = string[:s] + ho +string[e:]
     
-    pam2 = '\d{1,2}(am|AM)'
-    ppm2 = '\d{1,2}(pm|PM)'
-    am2 = re.search(pam2, string)
+    am2 = AM2_RE.search(string)
     if am2 and (not am1):
         s = am2.start()
         e = am2.end()
         ho = string[s:e-2]
         string = string[:s] + ho + ':00'+string[e:]
 
-    pm2 = re.search(ppm2, string)
+    pm2 = PM2_RE.search(string)
     if pm2 and (not pm1):
         s = pm2.start()
         e = pm2.end()
@@ -298,8 +292,7 @@ def style_hour(string):
         string = string.replace('am', '')
         
     # fix 06:00-10:00 am
-    wp6 = h + '-' + h + ' am'
-    m = re.search(wp6, string)
+    m = RANGE_AM_RE.search(string)
     if m:
         s = m.start()
         e = m.end()
@@ -307,9 +300,7 @@ def style_hour(string):
         
         
     # drop space e.g. 9:00 - 22:00  or 10：00-24：00
-    wp2 = h + ' - ' + h
-    wp3 = '\d{1,2}:\s\d{1,2}-\d{1,2}:\s\d{1,2}'
-    if re.match(wp2, string) or re.match(wp3, string):
+    if SPACED_RANGE_RE.match(string) or SPACED_COLON_RE.match(string):
         string = ''.join(string.split(' '))         
         
     return string.strip()
@@ -319,7 +310,15 @@ def style_hour(string):
 
 def update_hour(hour):
     '''清洗营业时间数据，将之统一成标准格式。'''
-    
+
+    # 已经是统一格式的值 style_hour 不会改变；其他常见的写法由 hours 模块一次扫描完成统一，
+    # 结果与下面的正则处理链相同
+    if HOUR_RE.fullmatch(hour) is not None:
+        return hour
+    normalized = hours.normalize(hour)
+    if normalized is not None:
+        return normalized
+
     if hour.find(';') > 0: #处理用分号分隔的时间数据
         hour_list = hour.split(';')
         new_hour = ';'.join(style_hour(h) for h in hour_list)
@@ -332,28 +331,26 @@ def update_hour(hour):
     return new_hour
     
     
+def check_hour(hour):
+    '''审查单个营业时间数据，返回不符合标准格式的数据列表。'''
+
+    wrong_list = []
+    if hour.find(';') > 0: #处理用分号分隔的时间数据
+        hour_list = hour.split(';')
+        for h in hour_list:
+            if not is_hour(h.strip()):
+                wrong_list.append(h)
+    else:               
+        if not is_hour(hour):  # 判断是否符合标准
+            wrong_list.append(hour)
+
+    return wrong_list
+
+
 def audit_hour(filename):
     '''审查营业时间数据，返回不符合标准格式的数据。'''
     
-    osm_file = open(filename, 'r')
-    wrong_list = []   # 记录不符合标准的数据
-    
-    for event, elem in ET.iterparse(osm_file):
-    
-        if  elem.tag == 'tag':   # 获取tag的元素
-            if elem.attrib['k'] == 'opening_hours':
-                hour = elem.attrib['v']
-                
-                if hour.find(';') > 0: #处理用分号分隔的时间数据
-                    hour_list = hour.split(';')
-                    for h in hour_list:
-                        if not is_hour(h.strip()):
-                            wrong_list.append(h)
-                else:               
-                    if not is_hour(hour):  # 判断是否符合标准
-                        wrong_list.append(hour)
-
-    return wrong_list
+    return audit(filename, rules=['hour'])['hour']['wrong']
 
               
               
@@ -365,10 +362,13 @@ def audit_hour(filename):
  
 #---------- 清洗门牌号码 -------------
 
+DIGIT_RE = re.compile(r'\d')
+
+
 def is_house_number(value):
     '''如果输入值不包含数字，则认为是不正确的门牌，返回False；否则返回True。'''
     
-    return re.search('\d', value)  # 是否包含数字
+    return DIGIT_RE.search(value)  # 是否包含数字
         
 
 
@@ -384,35 +384,142 @@ def update_house_number(value):
 
 
      
+def check_house_number(value):
+    '''审查单个门牌号，返回错误的门牌号列表。'''
+
+    if not is_house_number(value):  
+        return [value]
+    return []
+
+
 def audit_house_number(filename):
     '''审查数据中的门牌号，返回值是错误的门牌号。'''
 
-    wrong_list = []
-    osm_file = open(filename, 'r')
-    
-    for event, elem in ET.iterparse(osm_file):
-        if  elem.tag == 'tag':   # 获取tag的元素
-            if elem.attrib['k'] == 'addr:housenumber':
-                value =  elem.attrib['v']
-                if not is_house_number(value):  
-                    wrong_list.append(value)
-    
-    return wrong_list
+    return audit(filename, rules=['house_number'])['house_number']['wrong']
  
  
 
+# ----------- 整体审查 ----------
+
+# 审查规则注册表：规则名 -> (对应的tag键, 审查函数)
+# 审查函数接收tag的值，返回其中不符合标准的数据列表（符合标准则返回空列表）
+AUDIT_RULES = {
+    'phone': (('phone', 'contact:phone'), check_phone),
+    'postcode': (('addr:postcode',), check_postcode),
+    'hour': (('opening_hours',), check_hour),
+    'house_number': (('addr:housenumber',), check_house_number),
+}
+
+
+def audit(filename, rules=None):
+    '''只解析一遍文件，同时执行多个审查规则，返回结构化的审查报告。
+
+    报告的格式为 {规则名: {'checked': 审查的数据条数, 'count': 错误数据条数,
+    'wrong': 错误数据列表, 'ids': 错误数据所在元素的id列表}}。
+    rules 为要执行的规则名列表，默认执行 AUDIT_RULES 中的全部规则。
+    filename 可以是压缩文件（.gz、.bz2、.xz、.zst），边解压边审查。'''
+
+    if rules is None:
+        rules = list(AUDIT_RULES)
+
+    # 按tag键建立分发表，一个键可以对应多个规则
+    dispatch = {}
+    report = {}
+    for name in rules:
+        keys, check = AUDIT_RULES[name]
+        for key in keys:
+            dispatch.setdefault(key, []).append((name, check))
+        report[name] = {'checked': 0, 'count': 0, 'wrong': [], 'ids': []}
+
+    osm_file = filename
+    if compressed.compression_of(filename):
+        osm_file = compressed.open_input(filename)   # 在另一个线程或进程中解压
+
+    try:
+        context = ET.iterparse(osm_file, events=('start', 'end'))
+        _, root = next(context)
+        element_id = None   # 当前tag所属的节点、途径或关系的id
+
+        for event, elem in context:
+            if event == 'start':
+                if elem.tag in ('node', 'way', 'relation'):
+                    element_id = elem.attrib.get('id')
+            elif elem.tag == 'tag':   # 获取tag的元素
+                checks = dispatch.get(elem.attrib['k'])
+                if checks:
+                    value = elem.attrib['v']
+                    for name, check in checks:
+                        result = report[name]
+                        result['checked'] += 1
+                        for wrong in check(value):
+                            result['wrong'].append(wrong)
+                            result['ids'].append(element_id)
+                        result['count'] = len(result['wrong'])
+            elif elem.tag in ('node', 'way', 'relation'):
+                root.clear()   # 释放已处理的元素，避免内存随文件大小增长
+    finally:
+        if osm_file is not filename:
+            osm_file.close()
+
+    return report
+
+
+
 # ----------- 整体清洗 ----------
 
+# 清洗函数注册表：tag键 -> 清洗函数，不在表中的键原样返回
+UPDATERS = {
+    'phone': update_phone,
+    'postcode': update_postcode,
+    'housenumber': update_house_number,
+    'opening_hours': update_hour,
+}
+
 
 def update_value(key, value):
-    if key == 'phone':
-        return update_phone(value)
-    elif key == 'postcode':
-        return update_postcode(value)
-    elif key == 'housenumber':
-        return update_house_number(value)
-    elif key == 'opening_hours':
-        return update_hour(value)
-    else:
+    updater = UPDATERS.get(key)
+    if updater is None:
         return value
+    return updater(value)
+
+
+# ----------- 清洗结果缓存 ----------
+
+# OSM数据中的值重复度很高（同样的营业时间、邮编、连锁店电话），
+# 所以在 update_value 前面加一层以 (键, 原始值) 为键的LRU缓存
+CACHE_SIZE = 100000
+
+
+def update_rule(key, value):
+    '''只对有清洗规则的键调用，供缓存层使用。'''
+    return UPDATERS[key](value)
+
+
+cached_update_rule = functools.lru_cache(maxsize=CACHE_SIZE)(update_rule)
+
+
+def set_cache_size(maxsize=CACHE_SIZE):
+    '''重新设置缓存大小，同时清空缓存和命中统计。maxsize 为0时相当于关闭缓存。'''
+
+    global cached_update_rule
+    cached_update_rule = functools.lru_cache(maxsize=maxsize)(update_rule)
+
+
+def update_value_cached(key, value):
+    '''带缓存的 update_value，结果与 update_value 完全相同。'''
+
+    if key in UPDATERS:   # 没有清洗规则的键原样返回，不占用缓存
+        return cached_update_rule(key, value)
+    return value
+
+
+def cache_info():
+    '''返回缓存的命中统计：hits、misses、hit_rate、maxsize、currsize。'''
 
+    info = cached_update_rule.cache_info()
+    total = info.hits + info.misses
+    return {'hits': info.hits,
+            'misses': info.misses,
+            'hit_rate': info.hits / total if total else 0.0,
+            'maxsize': info.maxsize,
+            'currsize': info.currsize}
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# 列式输出格式：把每张表的行缓存在有类型的列数组中，按行组（row group）写出。
+# 安装了 pyarrow 时写成 Parquet 文件（nodes.parquet），否则每列写成一个 .npy 文件（nodes/id.npy）。
+# id、uid、changeset 是 int64，lat、lon 是 float64，timestamp 是 datetime64[s]，
+# user、key、type 等重复度高的字符串用字典编码（int32 编号 + 字典）。
+# 用法：python columnar.py sample_beijing_china.osm  （与 csv 输出比较写入时间、文件大小和读取时间）
+
+import argparse
+import array
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+ROW_GROUP_SIZE = 128 * 1024   # 每个行组的行数
+
+# 每张表的列类型，列的顺序与 osm2csv 中的 csv 字段顺序一致
+# int64/int32/float64：数值；dict：字典编码的字符串；string：普通字符串；timestamp：时间
+COLUMN_TYPES = {
+    'nodes': [('id', 'int64'), ('lat', 'float64'), ('lon', 'float64'), ('user', 'dict'),
+              ('uid', 'int64'), ('version', 'int32'), ('changeset', 'int64'),
+              ('timestamp', 'timestamp')],
+    'nodes_tags': [('id', 'int64'), ('key', 'dict'), ('value', 'string'), ('type', 'dict')],
+    'ways': [('id', 'int64'), ('user', 'dict'), ('uid', 'int64'), ('version', 'int32'),
+             ('changeset', 'int64'), ('timestamp', 'timestamp')],
+    'ways_nodes': [('id', 'int64'), ('node_id', 'int64'), ('position', 'int32')],
+    'ways_tags': [('id', 'int64'), ('key', 'dict'), ('value', 'string'), ('type', 'dict')],
+    'relations': [('id', 'int64'), ('user', 'dict'), ('uid', 'int64'), ('version', 'int32'),
+                  ('changeset', 'int64'), ('timestamp', 'timestamp')],
+    'relation_members': [('id', 'int64'), ('member_id', 'int64'), ('member_type', 'dict'),
+                         ('role', 'dict'), ('position', 'int32')],
+    'relation_tags': [('id', 'int64'), ('key', 'dict'), ('value', 'string'), ('type', 'dict')],
+}
+
+# 列类型 -> (array 模块的类型码, 转换函数)
+ARRAY_TYPES = {
+    'int64': ('q', int),
+    'int32': ('i', int),
+    'float64': ('d', float),
+}
+
+
+def table_name(path):
+    '''由 csv 路径得到表名，e.g. nodes.csv -> nodes。'''
+
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def columnar_path(path, engine=None):
+    '''由 csv 路径得到列式输出的路径：Parquet 文件或存放 .npy 文件的目录。'''
+
+    engine = engine or default_engine()
+    base = os.path.splitext(path)[0]
+    return base + '.parquet' if engine == 'parquet' else base
+
+
+def default_engine():
+    return 'parquet' if pq is not None else 'npy'
+
+
+class ColumnarWriter(object):
+    '''与 csv.DictWriter 用法相同的列式写入器：writeheader()、writerow(row)、close()。'''
+
+    def __init__(self, path, columns, row_group_size=ROW_GROUP_SIZE, engine=None):
+        '''path 是输出路径（见 columnar_path），columns 是 COLUMN_TYPES 中的 [(列名, 类型)]。'''
+
+        self.path = path
+        self.columns = columns
+        self.row_group_size = row_group_size
+        self.engine = engine or default_engine()
+        if self.engine == 'parquet' and pq is None:
+            raise ImportError('pyarrow is required for the parquet engine')
+
+        self.rows = 0
+        self.buffers = {}
+        self.dictionaries = {}   # 字典编码的列：字符串 -> 编号
+        for name, ctype in columns:
+            # .npy 没有变长字符串类型，所以 npy 格式下普通字符串也用字典编码
+            if ctype == 'dict' or (ctype == 'string' and self.engine == 'npy'):
+                self.dictionaries[name] = {}
+                self.buffers[name] = array.array('i')
+            elif ctype in ARRAY_TYPES:
+                self.buffers[name] = array.array(ARRAY_TYPES[ctype][0])
+            else:
+                self.buffers[name] = []
+
+        if self.engine == 'parquet':
+            self.schema = self.arrow_schema()
+            self.parquet = pq.ParquetWriter(path, self.schema)
+        else:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.makedirs(path)
+            self.parts = {name: open(os.path.join(path, name + '.npy.part'), 'wb')
+                          for name, ctype in columns}
+            self.dtypes = {}
+
+    def arrow_schema(self):
+        fields = []
+        for name, ctype in self.columns:
+            if ctype == 'dict':
+                atype = pa.dictionary(pa.int32(), pa.string())
+            elif ctype == 'string':
+                atype = pa.string()
+            elif ctype == 'timestamp':
+                atype = pa.timestamp('s')
+            else:
+                atype = getattr(pa, ctype)()
+            fields.append(pa.field(name, atype))
+        return pa.schema(fields)
+
+    def writeheader(self):
+        pass   # 列名保存在文件的 schema 中
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def writerow(self, row):
+        for name, ctype in self.columns:
+            value = row[name]
+            if ctype in ARRAY_TYPES:
+                self.buffers[name].append(ARRAY_TYPES[ctype][1](value))
+            elif name in self.dictionaries:
+                dictionary = self.dictionaries[name]
+                code = dictionary.get(value)
+                if code is None:
+                    code = dictionary[value] = len(dictionary)
+                self.buffers[name].append(code)
+            else:
+                self.buffers[name].append(value)
+        self.rows += 1
+        if len(self.buffers[self.columns[0][0]]) >= self.row_group_size:
+            self.flush()
+
+    def column_array(self, name, ctype):
+        '''把缓存的一列转换成 numpy 数组。'''
+
+        buffer = self.buffers[name]
+        if ctype == 'timestamp':
+            return np.array([t[:-1] if t.endswith('Z') else t for t in buffer],
+                            dtype='datetime64[s]')
+        if isinstance(buffer, array.array):
+            return np.frombuffer(buffer, dtype=buffer.typecode).copy()
+        return buffer
+
+    def flush(self):
+        '''把缓存的行写成一个行组。'''
+
+        if not len(self.buffers[self.columns[0][0]]):
+            return
+        if self.engine == 'parquet':
+            arrays = []
+            for name, ctype in self.columns:
+                values = self.column_array(name, ctype)
+                if ctype == 'dict':
+                    dictionary = pa.array(list(self.dictionaries[name]), pa.string())
+                    arrays.append(pa.DictionaryArray.from_arrays(pa.array(values), dictionary))
+                else:
+                    arrays.append(pa.array(values))
+            self.parquet.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        else:
+            for name, ctype in self.columns:
+                values = self.column_array(name, ctype)
+                self.dtypes[name] = values.dtype
+                self.parts[name].write(values.tobytes())
+
+        for name, ctype in self.columns:
+            if isinstance(self.buffers[name], array.array):
+                self.buffers[name] = array.array(self.buffers[name].typecode)
+            else:
+                self.buffers[name] = []
+
+    def close(self):
+        self.flush()
+        if self.engine == 'parquet':
+            self.parquet.close()
+            return
+
+        # 数据已经按行组追加到 .part 文件中，这里补上 .npy 文件头
+        for name, ctype in self.columns:
+            part = self.parts[name]
+            part.close()
+            dtype = self.dtypes.get(name)
+            if dtype is None:   # 空表
+                dtype = np.dtype('datetime64[s]') if ctype == 'timestamp' else \
+                        np.dtype(ARRAY_TYPES.get(ctype, ('i',))[0])
+            with open(os.path.join(self.path, name + '.npy'), 'wb') as f, \
+                 open(part.name, 'rb') as data:
+                np.lib.format.write_array_header_1_0(
+                    f, {'descr': np.lib.format.dtype_to_descr(dtype),
+                        'fortran_order': False,
+                        'shape': (self.rows,)})
+                shutil.copyfileobj(data, f)
+            os.remove(part.name)
+            if name in self.dictionaries:
+                with open(os.path.join(self.path, name + '.dict.json'), 'w', encoding='utf-8') as f:
+                    json.dump(list(self.dictionaries[name]), f, ensure_ascii=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_columns(path):
+    '''读取列式输出，返回 {列名: numpy 数组}，字典编码的列还原成字符串数组。'''
+
+    if path.endswith('.parquet'):
+        table = pq.read_table(path)
+        return {name: table.column(name).to_numpy() for name in table.column_names}
+
+    columns = {}
+    names = sorted(f[:-4] for f in os.listdir(path) if f.endswith('.npy'))
+    order = [name for name, ctype in COLUMN_TYPES.get(table_name(path), [])]
+    if sorted(order) == names:   # 按 csv 字段顺序排列
+        names = order
+    for name in names:
+        values = np.load(os.path.join(path, name + '.npy'))
+        dict_path = os.path.join(path, name + '.dict.json')
+        if os.path.exists(dict_path):
+            with open(dict_path, encoding='utf-8') as f:
+                values = np.array(json.load(f), dtype=object)[values]
+        columns[name] = values
+    return columns
+
+
+def read_table(path):
+    '''读取列式输出为 pandas DataFrame。'''
+
+    import pandas as pd
+
+    if path.endswith('.parquet'):
+        return pq.read_table(path).to_pandas()
+    return pd.DataFrame(read_columns(path))
+
+
+def directory_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+def benchmark(osm_file):
+    '''在临时目录中分别以 csv 和列式格式转换 osm_file，比较写入时间、大小和读取时间。'''
+
+    import pandas as pd
+    import osm2csv
+
+    osm_file = os.path.abspath(osm_file)
+    cwd = os.getcwd()
+    tmp_dir = tempfile.mkdtemp(prefix='columnar_')
+    try:
+        os.chdir(tmp_dir)
+        results = {}
+        for output_format in ('csv', 'columnar'):
+            start = time.perf_counter()
+            osm2csv.process_map(osm_file, validate=False, output_format=output_format)
+            write_time = time.perf_counter() - start
+
+            size = 0
+            start = time.perf_counter()
+            for path in osm2csv.OUTPUT_PATHS:
+                if output_format == 'csv':
+                    pd.read_csv(path)
+                else:
+                    path = columnar_path(path)
+                    read_table(path)
+                size += directory_size(path)
+            read_time = time.perf_counter() - start
+            results[output_format] = (write_time, size, read_time)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print('%-10s %12s %12s %12s' % ('format', 'write s', 'size MB', 'reload s'))
+    for output_format, (write_time, size, read_time) in results.items():
+        name = output_format if output_format == 'csv' else default_engine()
+        print('%-10s %12.2f %12.2f %12.2f' % (name, write_time, size / 1e6, read_time))
+    return results
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compare the csv and columnar outputs.')
+    parser.add_argument('osm_file')
+    args = parser.parse_args()
+    benchmark(args.osm_file)
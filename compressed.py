@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# 压缩文件的流式读写：按扩展名（.gz、.bz2、.xz、.zst）透明地解压输入和压缩输出，不需要先把文件解压到磁盘上。
+# 解压不在解析线程中进行：优先交给外部程序（lbzip2、pbzip2、pigz 是多线程的并行解压程序），
+# 找不到时在后台线程中用 Python 的解压模块解压（bz2、zlib、lzma 解压时会释放 GIL），
+# 解压后的数据通过有界队列交给 ET.iterparse。
+# zstd 需要安装 zstandard 模块或 zstd 命令行程序。
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import queue
+import shutil
+import subprocess
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESSIONS = ('gz', 'bz2', 'xz', 'zst')
+
+SUFFIXES = {'.gz': 'gz', '.bz2': 'bz2', '.xz': 'xz', '.zst': 'zst'}
+
+# 外部解压程序，按优先顺序排列，前面的是并行解压程序
+DECOMPRESSORS = {
+    'bz2': [['lbzip2', '-dc'], ['pbzip2', '-dc'], ['bzip2', '-dc']],
+    'gz': [['pigz', '-dc'], ['gzip', '-dc']],
+    'xz': [['xz', '-dc', '-T0']],
+    'zst': [['zstd', '-dcq']],
+}
+
+CHUNK_SIZE = 1 << 20      # 解压线程每次读取的字节数
+QUEUE_SIZE = 8            # 解压线程最多领先解析的块数
+
+GZIP_LEVEL = 6            # gzip 默认的9级压缩很慢，6级的压缩率几乎一样
+
+
+def compression_of(path):
+    '''根据扩展名返回压缩格式（'gz'、'bz2'、'xz'、'zst'），不是压缩文件时返回 None。'''
+
+    if not isinstance(path, str):
+        return None
+    return SUFFIXES.get(os.path.splitext(path)[1].lower())
+
+
+def compressed_path(path, compression):
+    '''给输出路径加上压缩格式的扩展名，e.g. nodes.csv -> nodes.csv.gz。'''
+
+    if compression is None:
+        return path
+    if compression not in COMPRESSIONS:
+        raise ValueError('unknown compression: %r' % compression)
+    return path + '.' + compression
+
+
+def find_decompressor(compression):
+    for command in DECOMPRESSORS[compression]:
+        if shutil.which(command[0]):
+            return command
+    return None
+
+
+class ProcessReader(io.RawIOBase):
+    '''从外部解压程序的标准输出读取解压后的数据。'''
+
+    def __init__(self, command, path):
+        self.command = command
+        self.process = subprocess.Popen(command + [path], stdout=subprocess.PIPE)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self.process.stdout.readinto(buffer)
+
+    def close(self):
+        if self.closed:
+            return
+        finished = self.process.poll() is not None
+        self.process.stdout.close()
+        if not finished:
+            self.process.terminate()   # 没有读完就关闭（e.g. 解析出错）
+        returncode = self.process.wait()
+        super().close()
+        if finished and returncode != 0:
+            raise IOError('%s exited with status %d' % (self.command[0], returncode))
+
+
+class ThreadedReader(io.RawIOBase):
+    '''在后台线程中从 source（解压文件对象）读取数据，通过有界队列交给读者。'''
+
+    def __init__(self, source, chunk_size=CHUNK_SIZE, queue_size=QUEUE_SIZE):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stopped = False
+        self.chunk = memoryview(b'')
+        self.eof = False
+        self.thread = threading.Thread(target=self.run, name='decompress', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            while not self.stopped:
+                data = self.source.read(self.chunk_size)
+                self.queue.put(data)
+                if not data:
+                    return
+        except Exception as e:
+            self.queue.put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self.chunk:
+            if self.eof:
+                return 0
+            data = self.queue.get()
+            if isinstance(data, Exception):
+                self.eof = True
+                raise data
+            if not data:
+                self.eof = True
+                return 0
+            self.chunk = memoryview(data)
+        n = min(len(buffer), len(self.chunk))
+        buffer[:n] = self.chunk[:n]
+        self.chunk = self.chunk[n:]
+        return n
+
+    def close(self):
+        if self.closed:
+            return
+        self.stopped = True
+        while self.thread.is_alive():   # 取出队列中的数据，让解压线程能结束
+            try:
+                self.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self.source.close()
+        super().close()
+
+
+def open_module(compression, path, mode):
+    '''用 Python 模块打开压缩文件（mode 为 'rb'、'wb' 或 'ab'）。'''
+
+    if compression == 'gz':
+        if mode in ('wb', 'ab'):
+            return gzip.open(path, mode, compresslevel=GZIP_LEVEL)
+        return gzip.open(path, mode)
+    if compression == 'bz2':
+        return bz2.open(path, mode)
+    if compression == 'xz':
+        return lzma.open(path, mode)
+    if zstandard is None:
+        raise ImportError('zstandard is required for .zst files without the zstd program')
+    if mode in ('wb', 'ab'):
+        return zstandard.ZstdCompressor().stream_writer(open(path, mode), closefd=True)
+    return zstandard.ZstdDecompressor().stream_reader(open(path, mode), read_across_frames=True,
+                                                      closefd=True)
+
+
+def open_input(path, external=True):
+    """Open an OSM file for binary reading, decompressing by its extension
+
+    Compressed files are decoded outside the caller's thread: by an external
+    (parallel when available) decompressor when external is True and one is
+    installed, otherwise by a Python decompressor in a background thread.
+    """
+
+    compression = compression_of(path)
+    if compression is None:
+        return open(path, 'rb')
+
+    command = find_decompressor(compression) if external else None
+    if command is not None:
+        return io.BufferedReader(ProcessReader(command, path), CHUNK_SIZE)
+    return io.BufferedReader(ThreadedReader(open_module(compression, path, 'rb')), CHUNK_SIZE)
+
+
+class ProcessWriter(io.RawIOBase):
+    '''把数据写到外部压缩程序的标准输入，压缩结果写入 path。'''
+
+    def __init__(self, command, path, mode='wb'):
+        self.command = command
+        self.file = open(path, mode)
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=self.file)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.process.stdin.write(data)
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.process.stdin.close()
+        returncode = self.process.wait()
+        self.file.close()
+        super().close()
+        if returncode != 0:
+            raise IOError('%s exited with status %d' % (self.command[0], returncode))
+
+
+def open_output(path, text=True, buffer_size=-1, append=False):
+    """Open an output file for writing, compressing by its extension
+
+    text=True gives a utf-8 text file as open(path, 'w', encoding='utf-8')
+    does, otherwise a binary file. append=True appends to the file; appended
+    compressed data is a new stream that the decompressors read on from the
+    previous one.
+    """
+
+    mode = 'a' if append else 'w'
+    compression = compression_of(path)
+    if compression is None:
+        if text:
+            return open(path, mode, encoding='utf-8', buffering=buffer_size)
+        return open(path, mode + 'b', buffering=buffer_size)
+
+    if compression == 'zst' and zstandard is None and shutil.which('zstd'):
+        binary = io.BufferedWriter(ProcessWriter(['zstd', '-q', '-c'], path, mode + 'b'),
+                                   buffer_size if buffer_size > 0 else io.DEFAULT_BUFFER_SIZE)
+    else:
+        binary = open_module(compression, path, mode + 'b')
+    if text:
+        return io.TextIOWrapper(binary, encoding='utf-8')
+    return binary
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# 外存排序与归并连接：不需要 SQLite，也不需要把 ways_nodes 整张表放进内存，
+# 算出每条途径引用的信号灯数和被标注的节点数（报告中 ways_nodes JOIN nodes_tags 的查询）。
+# 1. ways_nodes 的 (node_id, way_id) 按内存上限分批排序，每批写成临时目录中的一个有序文件（run）；
+#    nodes_tags 同样按 node_id 外排序，并按节点去重合并成 (node_id, 信号灯标签数)。
+# 2. 两个有序的流按 node_id 归并连接，每个匹配输出 (way_id, 信号灯数)，再按 way_id 外排序后分组求和。
+# run 太多时先分组归并成较少的 run（每次最多同时打开 fan_in 个文件）。
+# 用法：python extsort.py nodes_tags.csv ways_nodes.csv --memory-mb 256 --temp-dir /data/tmp
+#       python extsort.py --osm beijing_china.osm  （直接扫描 osm 文件，不经过 csv）
+
+import argparse
+import array
+import csv
+import heapq
+import io
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import compressed
+import tagdict
+
+
+MEMORY_BYTES = 256 * 1024 * 1024   # 排序时缓存的记录占用的内存上限
+
+FAN_IN = 64   # 一次归并最多打开的 run 文件数
+
+BLOCK_RECORDS = 64 * 1024   # 归并时从每个 run 一次读取的记录数的上限
+
+# 缓存中每条记录 16 字节，排序时还要 argsort 的下标和排好序的副本，所以按 40 字节估算
+BYTES_PER_RECORD = 40
+
+RECORD = np.dtype([('key', '<i8'), ('value', '<i8')])
+
+WAYS_AGGREGATES_PATH = 'ways_aggregates.csv'
+WAYS_AGGREGATES_FIELDS = ['id', 'signals', 'tagged_nodes']
+
+SIGNAL_VALUE = 'traffic_signals'
+
+
+class ExternalSorter(object):
+    '''(key, value) 整数记录的外存排序器：add 加入记录，超过内存上限时把缓存排序后写成一个 run，
+    records() 按 key 的顺序（key 相同时按加入的顺序）返回全部记录。
+
+    作为上下文管理器使用，退出时删除临时文件。'''
+
+    def __init__(self, memory_bytes=MEMORY_BYTES, temp_dir=None, fan_in=FAN_IN):
+        self.memory_bytes = memory_bytes
+        self.run_records = max(1024, memory_bytes // BYTES_PER_RECORD)
+        self.fan_in = max(2, fan_in)
+        self.temp_dir = tempfile.mkdtemp(prefix='extsort_', dir=temp_dir)
+        self.keys = array.array('q')
+        self.values = array.array('q')
+        self.runs = []
+        self.run_index = 0
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def add(self, key, value):
+        self.keys.append(key)
+        self.values.append(value)
+        if len(self.keys) >= self.run_records:
+            self.spill()
+
+    def extend(self, keys, values):
+        '''加入两个等长的整数序列。'''
+
+        self.keys.extend(keys)
+        self.values.extend(values)
+        if len(self.keys) >= self.run_records:
+            self.spill()
+
+    def sorted_buffer(self):
+        '''把缓存中的记录按 key 稳定排序，返回 RECORD 数组并清空缓存。'''
+
+        records = np.empty(len(self.keys), dtype=RECORD)
+        keys = np.frombuffer(self.keys, dtype=np.int64)
+        order = np.argsort(keys, kind='stable')
+        records['key'] = keys[order]
+        records['value'] = np.frombuffer(self.values, dtype=np.int64)[order]
+        del keys, order
+        self.count += len(records)
+        self.keys = array.array('q')
+        self.values = array.array('q')
+        return records
+
+    def new_run_path(self):
+        self.run_index += 1
+        return os.path.join(self.temp_dir, 'run_%06d.bin' % self.run_index)
+
+    def spill(self):
+        if not self.keys:
+            return
+        path = self.new_run_path()
+        self.sorted_buffer().tofile(path)
+        self.runs.append(path)
+
+    def read_run(self, path, block_records):
+        with open(path, 'rb') as f:
+            while True:
+                block = np.fromfile(f, dtype=RECORD, count=block_records)
+                if not len(block):
+                    break
+                yield from zip(block['key'].tolist(), block['value'].tolist())
+
+    def merge(self, paths):
+        '''归并几个 run；每个 run 用 (key, run 序号, value) 排序，key 相同时保持加入的顺序。'''
+
+        block_records = max(1024, min(BLOCK_RECORDS, self.run_records // len(paths)))
+
+        def tagged(index, path):
+            for key, value in self.read_run(path, block_records):
+                yield key, index, value
+
+        for key, index, value in heapq.merge(*[tagged(i, p) for i, p in enumerate(paths)]):
+            yield key, value
+
+    def write_run(self, records):
+        '''把一个有序的 (key, value) 流写成一个新的 run。'''
+
+        path = self.new_run_path()
+        keys = array.array('q')
+        values = array.array('q')
+        with open(path, 'wb') as f:
+            for key, value in records:
+                keys.append(key)
+                values.append(value)
+                if len(keys) >= BLOCK_RECORDS:
+                    write_block(f, keys, values)
+                    keys = array.array('q')
+                    values = array.array('q')
+            write_block(f, keys, values)
+        return path
+
+    def records(self):
+        """Yield every (key, value) record in key order
+
+        Without a spilled run the records are sorted in memory; otherwise the
+        runs are merged, in several passes when there are more than fan_in.
+        """
+
+        if not self.runs:
+            records = self.sorted_buffer()
+            yield from zip(records['key'].tolist(), records['value'].tolist())
+            return
+
+        self.spill()
+        runs = self.runs
+        while len(runs) > self.fan_in:
+            merged = []
+            for i in range(0, len(runs), self.fan_in):
+                group = runs[i:i + self.fan_in]
+                if len(group) == 1:
+                    merged.append(group[0])
+                    continue
+                merged.append(self.write_run(self.merge(group)))
+                for path in group:
+                    os.remove(path)
+            runs = merged
+        self.runs = runs
+        yield from self.merge(runs)
+
+
+def write_block(f, keys, values):
+    block = np.empty(len(keys), dtype=RECORD)
+    block['key'] = np.frombuffer(keys, dtype=np.int64)
+    block['value'] = np.frombuffer(values, dtype=np.int64)
+    block.tofile(f)
+
+
+def group_sum(records):
+    '''把按 key 排好序的 (key, value) 流按 key 分组求和，返回 (key, 和, 记录数) 的流（去重）。'''
+
+    current = None
+    total = count = 0
+    for key, value in records:
+        if key != current:
+            if current is not None:
+                yield current, total, count
+            current = key
+            total = count = 0
+        total += value
+        count += 1
+    if current is not None:
+        yield current, total, count
+
+
+def merge_join(way_nodes, tagged_nodes):
+    """Join two node_id ordered streams and yield (way_id, signals) per match
+
+    way_nodes yields (node_id, way_id), one per way node reference;
+    tagged_nodes yields (node_id, signal tag count), one per tagged node.
+    """
+
+    tagged = iter(tagged_nodes)
+    tagged_id, signals = next(tagged, (None, 0))
+    for node_id, way_id in way_nodes:
+        while tagged_id is not None and tagged_id < node_id:
+            tagged_id, signals = next(tagged, (None, 0))
+        if tagged_id is None:
+            break
+        if tagged_id == node_id:
+            yield way_id, signals
+
+
+class WayNodeJoin(object):
+    """Join ways_nodes with the tagged nodes in bounded memory
+
+    Feed the tag rows with add_node_tag and the way node references with
+    add_way_nodes, in any order, then call aggregates() for
+    (way_id, signals, tagged_nodes) in way id order, counted as the
+    report's SQL join counts them: signals is the number of matched
+    traffic_signals tag rows, tagged_nodes the number of way node
+    references to a node with at least one tag.
+    """
+
+    def __init__(self, memory_bytes=MEMORY_BYTES, temp_dir=None, fan_in=FAN_IN,
+                 signal_value=SIGNAL_VALUE):
+        self.memory_bytes = memory_bytes
+        self.temp_dir = temp_dir
+        self.fan_in = fan_in
+        self.signal_value = signal_value
+        # 两个排序器同时缓存，各用一半内存
+        self.way_nodes = ExternalSorter(memory_bytes // 2, temp_dir, fan_in)
+        self.node_tags = ExternalSorter(memory_bytes // 2, temp_dir, fan_in)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.way_nodes.close()
+        self.node_tags.close()
+
+    def add_node_tag(self, node_id, value):
+        self.node_tags.add(int(node_id), value == self.signal_value)
+
+    def add_way_node(self, way_id, node_id):
+        self.way_nodes.add(int(node_id), int(way_id))
+
+    def add_way_nodes(self, way_id, node_ids):
+        way_id = int(way_id)
+        node_ids = [int(node_id) for node_id in node_ids]
+        self.way_nodes.extend(node_ids, [way_id] * len(node_ids))
+
+    def aggregates(self):
+        tagged_nodes = ((node_id, signals)
+                        for node_id, signals, tags in group_sum(self.node_tags.records()))
+        with ExternalSorter(self.memory_bytes, self.temp_dir, self.fan_in) as matches:
+            for way_id, signals in merge_join(self.way_nodes.records(), tagged_nodes):
+                matches.add(way_id, signals)
+            # 排好序后就不再需要前两个排序器的临时文件
+            self.close()
+            yield from group_sum(matches.records())
+
+
+def open_csv(path):
+    '''读取（可能是压缩的）csv 文件。'''
+
+    return io.TextIOWrapper(compressed.open_input(path), encoding='utf-8', newline='')
+
+
+def signal_value_id(values_path, signal_value=SIGNAL_VALUE):
+    '''字典编码的输出中信号灯的 value 编号，没有时返回 None（见 tagdict.py）。'''
+
+    with open_csv(values_path) as f:
+        for row in csv.DictReader(f):
+            if row['value'] == signal_value:
+                return row['id']
+    return None
+
+
+def join_csv(join, nodes_tags_path, ways_nodes_path, values_path=None):
+    """Feed the nodes_tags and ways_nodes csv(s) written by osm2csv.py into join
+
+    Dictionary encoded tags (osm2csv.py --dictionary) are read with the
+    tag_values table at values_path.
+    """
+
+    with open_csv(nodes_tags_path) as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        id_index = header.index('id')
+        if 'value_id' in header:
+            if values_path is None:
+                values_path = os.path.join(os.path.dirname(nodes_tags_path), tagdict.TAG_VALUES_PATH)
+            signal_id = signal_value_id(values_path, join.signal_value)
+            value_index = header.index('value_id')
+            for row in reader:
+                join.add_node_tag(row[id_index],
+                                  join.signal_value if row[value_index] == signal_id else None)
+        else:
+            value_index = header.index('value')
+            for row in reader:
+                join.add_node_tag(row[id_index], row[value_index])
+
+    with open_csv(ways_nodes_path) as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        id_index, node_index = header.index('id'), header.index('node_id')
+        for row in reader:
+            join.add_way_node(row[id_index], row[node_index])
+
+
+def join_map(join, osm_file):
+    '''扫描 osm 文件，把清洗后的节点标签和途径引用的节点交给 join。'''
+
+    import osm2csv
+
+    for element in osm2csv.get_element(osm_file, tags=('node', 'way')):
+        shaped = osm2csv.shape_element_rows(element)
+        if shaped is None:
+            continue
+        tag, row, children, tags = shaped
+        for node_id, key, value, ttype in (tags if tag == 'node' else ()):
+            join.add_node_tag(node_id, value)
+        if tag == 'way':
+            join.add_way_nodes(row[0], [node_id for _, node_id, _ in children])
+
+
+def write_aggregates(aggregates, path=WAYS_AGGREGATES_PATH):
+    """Write (way_id, signals, tagged_nodes) rows to a csv and return the top signal ways"""
+
+    top = []
+    count = 0
+    with compressed.open_output(path) as f:
+        writer = csv.writer(f)
+        writer.writerow(WAYS_AGGREGATES_FIELDS)
+        for way_id, signals, tagged_nodes in aggregates:
+            writer.writerow((way_id, signals, tagged_nodes))
+            count += 1
+            if signals:
+                heapq.heappush(top, (signals, -way_id))
+                if len(top) > 10:
+                    heapq.heappop(top)
+    return count, [(-way_id, signals) for signals, way_id in sorted(top, reverse=True)]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Count the traffic signals and tagged nodes of '
+                                                 'every way with an external sort/merge join.')
+    parser.add_argument('nodes_tags', nargs='?', default='nodes_tags.csv')
+    parser.add_argument('ways_nodes', nargs='?', default='ways_nodes.csv')
+    parser.add_argument('--osm', metavar='OSM_FILE',
+                        help='scan an OSM file instead of the csv(s)')
+    parser.add_argument('--output', default=WAYS_AGGREGATES_PATH,
+                        help='csv of (id, signals, tagged_nodes) per way')
+    parser.add_argument('--memory-mb', type=int, default=MEMORY_BYTES // 2 ** 20,
+                        help='memory used to sort each run')
+    parser.add_argument('--temp-dir', help='directory of the sorted runs (default: system temp)')
+    parser.add_argument('--fan-in', type=int, default=FAN_IN,
+                        help='runs merged at once')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with WayNodeJoin(args.memory_mb * 2 ** 20, args.temp_dir, args.fan_in) as join:
+        if args.osm:
+            join_map(join, args.osm)
+        else:
+            join_csv(join, args.nodes_tags, args.ways_nodes)
+        runs = len(join.way_nodes.runs) + len(join.node_tags.runs)
+        count, top = write_aggregates(join.aggregates(), args.output)
+    print('%d ways with tagged nodes written to %s in %.2fs (%d sorted runs)'
+          % (count, args.output, time.perf_counter() - start, runs))
+    for way_id, signals in top:
+        print('%-12d %d' % (way_id, signals))
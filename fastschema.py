@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# 不依赖 cerberus 的快速校验：启动时把 schema.py 中的规则编译成每种元素专用的检查函数
+# （生成并编译专用的 Python 代码），校验每个元素时只做字段查找、类型转换（coerce）和类型检查；
+# 只有出错的元素才再逐个字段检查一遍，生成可读的错误报告。
+# 支持 schema.py 用到的规则：type（dict/list/integer/float/string）、schema、required、coerce。
+# 与 cerberus 一样，不在 schema 中的字段视为错误。
+
+import schema
+
+
+TYPES = {
+    'integer': int,
+    'float': float,
+    'string': str,
+    'dict': dict,
+    'list': list,
+}
+
+
+class ValidationError(Exception):
+    pass
+
+
+def compile_rules(rules):
+    """Return a checker(value, path, errors) for one field's rules
+
+    The checker returns the coerced value and appends (path, message) to
+    errors for every rule the value breaks.
+    """
+
+    coerce = rules.get('coerce')
+    expected = TYPES[rules['type']] if 'type' in rules else None
+    sub_schema = rules.get('schema')
+
+    if expected is dict and sub_schema is not None:
+        check_items = compile_dict(sub_schema)
+    elif expected is list and sub_schema is not None:
+        check_item = compile_rules(sub_schema)
+
+        def check_items(value, path, errors):
+            return [check_item(item, '%s[%d]' % (path, i), errors)
+                    for i, item in enumerate(value)]
+    else:
+        check_items = None
+
+    def check(value, path, errors):
+        if coerce is not None:
+            try:
+                value = coerce(value)
+            except (TypeError, ValueError):
+                errors.append((path, 'cannot coerce %r with %s()' % (value, coerce.__name__)))
+                return value
+        if expected is not None and not isinstance(value, expected):
+            errors.append((path, 'must be of %s type, got %r' % (rules['type'], value)))
+            return value
+        if check_items is not None:
+            value = check_items(value, path, errors)
+        return value
+
+    return check
+
+
+def compile_dict(fields):
+    """Return a checker for a dict with the given field schema"""
+
+    checkers = [(name, rules.get('required', False), compile_rules(rules))
+                for name, rules in fields.items()]
+    known = frozenset(fields)
+
+    def check(document, path, errors):
+        result = {}
+        for name, required, checker in checkers:
+            if name in document:
+                result[name] = checker(document[name], path + '.' + name if path else name, errors)
+            elif required:
+                errors.append((path + '.' + name if path else name, 'required field'))
+        if len(document) > len(result) or not known.issuperset(document):
+            for name in document:
+                if name not in known:
+                    errors.append((path + '.' + name if path else name, 'unknown field'))
+        return result
+
+    return check
+
+
+def generate_check(rules, expr, lines, consts, indent):
+    """Append Python source lines that return False if expr breaks rules"""
+
+    pad = ' ' * indent
+    coerce = rules.get('coerce')
+    expected = TYPES[rules['type']] if 'type' in rules else None
+    sub_schema = rules.get('schema')
+
+    def const(value):
+        consts['C%d' % len(consts)] = value
+        return 'C%d' % (len(consts) - 1)
+
+    if coerce is not None:
+        var = 'v%d' % len(lines)
+        lines.append('%s%s = %s(%s)' % (pad, var, const(coerce), expr))
+        expr = var
+    if expected is not None and expected is not coerce:
+        lines.append('%sif not isinstance(%s, %s): return False' % (pad, expr, expected.__name__))
+
+    if expected is dict and sub_schema is not None:
+        var = 'd%d' % len(lines)
+        lines.append('%s%s = %s' % (pad, var, expr))
+        lines.append('%sif not %s.issuperset(%s): return False'
+                     % (pad, const(frozenset(sub_schema)), var))
+        for name, field_rules in sub_schema.items():
+            if field_rules.get('required', False):
+                # 必填字段缺失时抛出 KeyError，由外层捕获
+                generate_check(field_rules, '%s[%r]' % (var, name), lines, consts, indent)
+            else:
+                lines.append('%sif %r in %s:' % (pad, name, var))
+                generate_check(field_rules, '%s[%r]' % (var, name), lines, consts, indent + 4)
+                lines.append('%s    pass' % pad)
+    elif expected is list and sub_schema is not None:
+        var = 'i%d' % len(lines)
+        lines.append('%sfor %s in %s:' % (pad, var, expr))
+        generate_check(sub_schema, var, lines, consts, indent + 4)
+        lines.append('%s    pass' % pad)
+
+
+def compile_fast(fields):
+    """Generate a function that only tells whether a document is valid
+
+    The function is straight-line Python specialised for the given field
+    schema, so valid elements cost a few dict lookups and coerce calls.
+    """
+
+    lines = []
+    consts = {}
+    generate_check({'type': 'dict', 'schema': fields}, 'document', lines, consts, 8)
+    source = ('def check(document):\n'
+              '    try:\n%s\n'
+              '    except (KeyError, TypeError, ValueError):\n'
+              '        return False\n'
+              '    return True\n') % '\n'.join(lines)
+    namespace = dict(consts)
+    exec(compile(source, '<fastschema>', 'exec'), namespace)
+    return namespace['check']
+
+
+def compile_schema(osm_schema=schema.schema):
+    """Compile the schema into one checker per element type
+
+    Return {'node': checker, 'way': checker, 'relation': checker}; each checker takes a shaped
+    element from osm2csv.shape_element and returns a list of (path, message)
+    errors, empty when the element is valid.
+    """
+
+    element_fields = {
+        'node': ('node', 'node_tags'),
+        'way': ('way', 'way_nodes', 'way_tags'),
+        'relation': ('relation', 'relation_members', 'relation_tags'),
+    }
+
+    def make(fields):
+        # 每种元素只检查它用到的那几张表的规则
+        fields = {name: osm_schema[name] for name in fields}
+        fast = compile_fast(fields)
+        detailed = compile_dict(fields)
+
+        def check_element(element):
+            if fast(element):
+                return []
+            # 只有出错的元素才逐个字段检查，生成可读的错误报告
+            errors = []
+            detailed(element, '', errors)
+            return errors
+        return check_element
+
+    return {tag: make(fields) for tag, fields in element_fields.items()}
+
+
+def format_errors(errors):
+    """Format (path, message) pairs as one readable line each"""
+
+    return '\n'.join('  %s: %s' % (path, message) for path, message in errors)
+
+
+def validate(element, checkers):
+    """Raise ValidationError listing every error if element does not match the schema"""
+
+    tag = next(tag for tag in ('node', 'way', 'relation') if tag in element)
+    errors = checkers[tag](element)
+    if errors:
+        message_string = "\nElement of type '{0}' has the following errors:\n{1}"
+        raise ValidationError(message_string.format(tag, format_errors(errors)))
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# 声明式的元素过滤：按元素类型、tag 键、键/值模式和经纬度范围（bbox）选择要转换的元素。
+# 过滤在流式解析时进行，在 shape_element 构造字典和清洗之前，被过滤掉的元素只花一次判断的时间。
+# tag 规则的写法：
+#   amenity 或 amenity=*       有这个键
+#   highway=primary|secondary  值是其中之一
+#   name~^北京                 值匹配正则表达式
+# 途径按它引用的节点判断是否在 bbox 内（任何一个节点在范围内即可），
+# way_refs='inside' 时途径只保留范围内的节点引用。
+# 过滤条件也可以写成 JSON 文件：{"types": ["node"], "include": ["amenity", "shop"], "bbox": [...]}
+
+import json
+import re
+
+
+ELEMENT_TYPES = ('node', 'way', 'relation')
+
+WAY_REFS = ('all', 'inside')
+
+TAG_RULE = re.compile(r'^(?P<key>[^=~]+)(?:(?P<op>[=~])(?P<value>.*))?$')
+
+
+class TagRule(object):
+    """One tag rule compiled into a predicate over a {key: value} dict
+
+    A class rather than a closure so that filters can be sent to the worker
+    processes of the parallel mode.
+    """
+
+    def __init__(self, rule):
+        m = TAG_RULE.match(rule)
+        if m is None:
+            raise ValueError('invalid tag rule: %r' % rule)
+        self.rule = rule
+        self.key, op, value = m.group('key', 'op', 'value')
+        self.pattern = None
+        self.values = None
+        if op == '~':
+            self.pattern = re.compile(value)
+        elif op == '=' and value != '*':
+            self.values = frozenset(value.split('|'))
+
+    def __call__(self, tags):
+        if self.values is not None:
+            return tags.get(self.key) in self.values
+        if self.key not in tags:
+            return False
+        return self.pattern is None or self.pattern.search(tags[self.key]) is not None
+
+    def __repr__(self):
+        return 'TagRule(%r)' % self.rule
+
+
+class ElementFilter(object):
+    '''元素过滤器：keep(element) 判断是否保留 iterparse 得到的元素，apply(elements) 过滤元素流。
+
+    节点和途径的 bbox 判断依赖于文件中节点在途径之前（osm 文件的标准顺序），
+    所以同一个过滤器要按文件顺序使用，带 bbox 的途径过滤也不能分片并行。'''
+
+    def __init__(self, types=ELEMENT_TYPES, include=(), exclude=(), bbox=None, way_refs='all'):
+        '''include/exclude 是 tag 规则的列表：有 include 时至少满足一条，满足任何一条 exclude 的被过滤掉。
+        bbox 是 (min_lat, min_lon, max_lat, max_lon)。带 bbox 过滤途径或关系时，
+        范围内的节点（过滤关系时还有途径和关系）的 id 都保存在内存中，范围越大占用越多。'''
+
+        unknown = set(types) - set(ELEMENT_TYPES)
+        if unknown:
+            raise ValueError('unknown element types: %s' % ', '.join(sorted(unknown)))
+        if way_refs not in WAY_REFS:
+            raise ValueError('way_refs must be one of %s' % ', '.join(WAY_REFS))
+
+        self.types = frozenset(types)
+        self.include = [TagRule(rule) for rule in include]
+        self.exclude = [TagRule(rule) for rule in exclude]
+        self.bbox = tuple(float(x) for x in bbox) if bbox is not None else None
+        self.way_refs = way_refs
+        # bbox 内元素的整数 id（包括被类型和 tag 条件过滤掉的），途径和关系的判断要用到；
+        # 只记录后面用得到的类型，但内存仍然随 bbox 内的元素数增长
+        self.inside_nodes = set()
+        self.inside_ways = set()
+        self.inside_relations = set()
+        self.inside = {'node': self.inside_nodes, 'way': self.inside_ways,
+                       'relation': self.inside_relations}
+        self.recorded = set()
+        if self.types & {'way', 'relation'}:
+            self.recorded.add('node')
+        if 'relation' in self.types:
+            self.recorded.update(('way', 'relation'))
+
+    @classmethod
+    def from_dict(cls, options):
+        return cls(types=options.get('types', ELEMENT_TYPES),
+                   include=options.get('include', ()),
+                   exclude=options.get('exclude', ()),
+                   bbox=options.get('bbox'),
+                   way_refs=options.get('way_refs', 'all'))
+
+    @classmethod
+    def from_json(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+    @property
+    def is_sequential(self):
+        '''是否必须按文件顺序处理整个文件（bbox 过滤途径或关系时需要之前节点的信息）。'''
+
+        return self.bbox is not None and bool(self.types & {'way', 'relation'})
+
+    def in_bbox(self, element):
+        tag = element.tag
+        if tag == 'node':
+            min_lat, min_lon, max_lat, max_lon = self.bbox
+            inside = (min_lat <= float(element.attrib['lat']) <= max_lat and
+                      min_lon <= float(element.attrib['lon']) <= max_lon)
+        elif tag == 'way':
+            nds = element.findall('nd')
+            inside = [nd for nd in nds if int(nd.attrib['ref']) in self.inside_nodes]
+            if inside and self.way_refs == 'inside' and len(inside) < len(nds):
+                # 去掉范围外的节点引用，shape_element 会重新编号 position
+                for nd in nds:
+                    if int(nd.attrib['ref']) not in self.inside_nodes:
+                        element.remove(nd)
+            inside = bool(inside)
+        else:
+            # 关系：有任何一个成员在范围内，不论成员本身是否被保留
+            inside = any(int(member.attrib['ref']) in self.inside.get(member.attrib['type'], ())
+                         for member in element.iter('member'))
+        if inside and tag in self.recorded:
+            self.inside[tag].add(int(element.attrib['id']))
+        return inside
+
+    def keep(self, element):
+        """Return True if the element should be shaped and written"""
+
+        tag = element.tag
+        if self.bbox is not None:
+            # 类型不需要的节点和途径也要记录是否在范围内，途径和关系的判断要用到
+            if tag not in self.types and tag not in self.recorded:
+                return False
+            if not self.in_bbox(element) or tag not in self.types:
+                return False
+        elif tag not in self.types:
+            return False
+
+        if self.include or self.exclude:
+            tags = {t.attrib['k']: t.attrib['v'] for t in element.iter('tag')}
+            if self.include and not any(rule(tags) for rule in self.include):
+                return False
+            if any(rule(tags) for rule in self.exclude):
+                return False
+
+        return True
+
+    def apply(self, elements):
+        """Yield the elements that pass the filter"""
+
+        keep = self.keep
+        for element in elements:
+            if keep(element):
+                yield element
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# 途径（way）的几何信息：在转换的同时把节点坐标存入紧凑的数组（按 id 排序的 int64 id 数组
+# 和定点数 int32 坐标数组，每个节点16字节），然后把每条途径的节点引用解析成坐标序列，
+# 计算长度、外接矩形和中心点，写入 ways_geometry.csv。
+# 指定 store_dir 时坐标数组存放在磁盘上并通过内存映射读取，内存占用与节点数无关。
+
+import array
+import csv
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+WAYS_GEOMETRY_PATH = "ways_geometry.csv"
+
+WAYS_GEOMETRY_FIELDS = ['id', 'nodes', 'missing', 'length', 'min_lat', 'min_lon',
+                        'max_lat', 'max_lon', 'centroid_lat', 'centroid_lon']
+
+EARTH_RADIUS = 6371008.8   # 地球平均半径，单位米
+
+SCALE = 10 ** 7   # 坐标以 1e-7 度为单位存成 int32，与 OSM 本身的精度相同
+
+BATCH_SIZE = 10000   # 每次批量解析的途径数
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    '''向量化的球面距离（米），参数为以度为单位的 numpy 数组。'''
+
+    lat1 = np.radians(lat1)
+    lat2 = np.radians(lat2)
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin(np.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+class NodeStore(object):
+    '''节点 id -> (lat, lon) 的紧凑存储。
+
+    节点按到达顺序追加；osm 文件中的节点通常按 id 升序排列，此时不需要再排序。
+    查询前调用 finalize()（lookup 会自动调用）得到按 id 排序的数组，用二分查找解析引用。'''
+
+    def __init__(self, store_dir=None, buffer_size=1 << 20):
+        '''store_dir 为 None 时数组放在内存中，否则写到该目录下的文件并以内存映射方式读取。'''
+
+        self.store_dir = store_dir
+        self.buffer_size = buffer_size
+        self.ids = array.array('q')
+        self.lats = array.array('i')
+        self.lons = array.array('i')
+        self.chunks = []         # 内存模式下已写出的 (ids, lats, lons) 数组
+        self.count = 0
+        self.is_sorted = True
+        self.last_id = None
+        self.table = None        # finalize() 之后的 (ids, lats, lons)
+        if store_dir is not None:
+            os.makedirs(store_dir, exist_ok=True)
+            self.files = [open(os.path.join(store_dir, name), 'wb')
+                          for name in ('ids.bin', 'lats.bin', 'lons.bin')]
+
+    def add(self, node_id, lat, lon):
+        node_id = int(node_id)
+        if self.last_id is not None and node_id <= self.last_id:
+            self.is_sorted = False
+        self.last_id = node_id
+        self.ids.append(node_id)
+        self.lats.append(int(round(float(lat) * SCALE)))
+        self.lons.append(int(round(float(lon) * SCALE)))
+        if len(self.ids) >= self.buffer_size:
+            self.flush()
+        self.table = None
+
+    def flush(self):
+        if not self.ids:
+            return
+        if self.store_dir is None:
+            self.chunks.append(tuple(np.frombuffer(a, dtype=a.typecode).copy()
+                                     for a in (self.ids, self.lats, self.lons)))
+        else:
+            for f, a in zip(self.files, (self.ids, self.lats, self.lons)):
+                a.tofile(f)
+        self.count += len(self.ids)
+        self.ids = array.array('q')
+        self.lats = array.array('i')
+        self.lons = array.array('i')
+
+    def finalize(self):
+        '''返回按 id 排序的 (ids, lats, lons) 数组。'''
+
+        if self.table is not None:
+            return self.table
+        self.flush()
+        if self.store_dir is None:
+            if self.chunks:
+                table = tuple(np.concatenate(c) for c in zip(*self.chunks))
+            else:
+                table = (np.zeros(0, 'q'), np.zeros(0, 'i'), np.zeros(0, 'i'))
+            self.chunks = [table]
+        else:
+            for f in self.files:
+                f.flush()
+            table = tuple(np.memmap(f.name, dtype=dtype, mode='r', shape=(self.count,))
+                          if self.count else np.zeros(0, dtype)
+                          for f, dtype in zip(self.files, ('q', 'i', 'i')))
+        if not self.is_sorted:
+            # 输入没有按 id 排序时才需要排序（排序需要把 id 数组读入内存）
+            order = np.argsort(table[0], kind='stable')
+            table = tuple(np.asarray(a)[order] for a in table)
+        self.table = table
+        return table
+
+    def lookup(self, refs):
+        '''解析节点引用，返回 (lat 数组, lon 数组, 是否找到的布尔数组)。'''
+
+        ids, lats, lons = self.finalize()
+        refs = np.asarray(refs, dtype='q')
+        if not len(ids):
+            empty = np.zeros(len(refs))
+            return empty, empty, np.zeros(len(refs), dtype=bool)
+        pos = np.searchsorted(ids, refs)
+        pos = np.minimum(pos, len(ids) - 1)
+        found = np.asarray(ids[pos]) == refs
+        return (np.asarray(lats[pos], dtype='d') / SCALE,
+                np.asarray(lons[pos], dtype='d') / SCALE,
+                found)
+
+    def close(self):
+        self.table = None
+        self.chunks = []
+        if self.store_dir is not None:
+            for f in self.files:
+                f.close()
+
+
+def way_metrics(way_ids, refs_list, store):
+    '''批量计算途径的几何信息，返回与 WAYS_GEOMETRY_FIELDS 对应的行（字典）列表。
+
+    长度是相邻节点球面距离之和；中心点是各节点坐标的平均值，
+    闭合途径（首尾是同一个节点）的最后一个节点不重复计算。找不到的节点被跳过。'''
+
+    n = len(way_ids)
+    counts = np.array([len(refs) for refs in refs_list], dtype='q')
+    way_index = np.repeat(np.arange(n), counts)
+    refs = np.fromiter((int(r) for refs in refs_list for r in refs), dtype='q',
+                       count=int(counts.sum()))
+    all_lat, all_lon, found = store.lookup(refs)
+
+    # 闭合途径的最后一个节点不参与中心点的计算
+    ends = np.cumsum(counts) - 1
+    closed = np.array([len(r) > 2 and r[0] == r[-1] for r in refs_list], dtype=bool)
+    for_centroid = found.copy()
+    for_centroid[ends[closed]] = False
+
+    missing = np.bincount(way_index[~found], minlength=n)
+    c_index = way_index[for_centroid]
+    c_count = np.bincount(c_index, minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        c_lat = np.bincount(c_index, weights=all_lat[for_centroid], minlength=n) / c_count
+        c_lon = np.bincount(c_index, weights=all_lon[for_centroid], minlength=n) / c_count
+
+    way_index = way_index[found]
+    lat = all_lat[found]
+    lon = all_lon[found]
+
+    same = way_index[1:] == way_index[:-1]
+    seg = haversine(lat[:-1][same], lon[:-1][same], lat[1:][same], lon[1:][same])
+    length = np.bincount(way_index[:-1][same], weights=seg, minlength=n)
+
+    # 外接矩形：way_index 非递减，按分组的起点做 reduceat
+    present = np.unique(way_index)
+    starts = np.searchsorted(way_index, present)
+    bbox = np.full((4, n), np.nan)
+    if len(present):
+        bbox[0, present] = np.minimum.reduceat(lat, starts)
+        bbox[1, present] = np.minimum.reduceat(lon, starts)
+        bbox[2, present] = np.maximum.reduceat(lat, starts)
+        bbox[3, present] = np.maximum.reduceat(lon, starts)
+
+    rows = []
+    has_nodes = np.zeros(n, dtype=bool)
+    has_nodes[present] = True
+    for i in range(n):
+        row = {'id': way_ids[i], 'nodes': int(counts[i]), 'missing': int(missing[i])}
+        if has_nodes[i]:
+            row.update({'length': round(float(length[i]), 2),
+                        'min_lat': float(bbox[0, i]), 'min_lon': float(bbox[1, i]),
+                        'max_lat': float(bbox[2, i]), 'max_lon': float(bbox[3, i]),
+                        'centroid_lat': round(float(c_lat[i]), 7),
+                        'centroid_lon': round(float(c_lon[i]), 7)})
+        else:
+            row.update({field: '' for field in WAYS_GEOMETRY_FIELDS[3:]})
+        rows.append(row)
+    return rows
+
+
+class WayGeometry(object):
+    '''转换流程中的途径几何阶段：add_node() 收集节点坐标，add_way() 缓存途径，
+    每 batch_size 条途径批量解析一次并写入 csv。'''
+
+    def __init__(self, path=WAYS_GEOMETRY_PATH, store_dir=None, batch_size=BATCH_SIZE):
+        '''store_dir 为 'temp' 时在系统临时目录中建立磁盘存储，结束后删除。'''
+
+        self.tmp_dir = None
+        if store_dir == 'temp':
+            store_dir = self.tmp_dir = tempfile.mkdtemp(prefix='nodestore_')
+        self.store = NodeStore(store_dir)
+        self.batch_size = batch_size
+        self.way_ids = []
+        self.refs = []
+        self.file = open(path, 'w', encoding='utf-8')
+        self.writer = csv.DictWriter(self.file, WAYS_GEOMETRY_FIELDS)
+        self.writer.writeheader()
+
+    def add_node(self, node):
+        '''node 是 shape_element 输出的节点字典。'''
+        self.store.add(node['id'], node['lat'], node['lon'])
+
+    def add_way(self, way, way_nodes):
+        '''way、way_nodes 是 shape_element 输出的途径字典和 ways_nodes 行。'''
+
+        self.way_ids.append(way['id'])
+        self.refs.append([row['node_id'] for row in way_nodes])
+        if len(self.way_ids) >= self.batch_size:
+            self.resolve()
+
+    def resolve(self):
+        if self.way_ids:
+            self.writer.writerows(way_metrics(self.way_ids, self.refs, self.store))
+        self.way_ids = []
+        self.refs = []
+
+    def close(self):
+        self.resolve()
+        self.file.close()
+        self.store.close()
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
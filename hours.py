@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# 营业时间（opening_hours）的单遍解析，取代 clean.style_hour 中逐步替换、重建字符串的正则处理链。
+# 分词时每个词对应一个类别字符（n 数字、w 星期、m 月份、a/p 上午/下午、t 'to' 以及标点），
+# 星期和月份的全称、am/pm、'to'、'~'、'.'、全角冒号在这一步就统一成了类别，
+# 语法是类别字符串上的一个正则语言（PART_RE），一次匹配就得到各部分的位置。
+# 输出统一格式的字符串和结构化的表示：每条规则是 (起始日期, 结束日期, 星期掩码, 开始分钟, 结束分钟)，
+# 星期掩码的第0位到第6位是周一到周日，"某个时刻是否营业"只需几次整数比较和一次按位与。
+# normalize 的结果与 style_hour 的处理链完全相同；不在支持范围内的写法返回 None，
+# 由 clean.update_hour 交给原来的处理链。
+# 用法：python hours.py beijing_china.osm --at 2017-06-03T21:30
+
+import argparse
+import datetime
+import re
+import xml.etree.cElementTree as ET
+
+
+WEEKDAYS = ('Mo', 'Tu', 'We', 'Th', 'Fr', 'Sa', 'Su')
+WEEKDAY_FULL = {'Mon': 'Mo', 'Tue': 'Tu', 'Wed': 'We', 'Thu': 'Th', 'Fri': 'Fr',
+                'Sat': 'Sa', 'Sun': 'Su'}
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+ALL_WEEK = 0x7f
+WHOLE_YEAR = (101, 1231)    # 日期用 月*100+日 表示
+DAY_MINUTES = 24 * 60
+ALWAYS = [WHOLE_YEAR + (ALL_WEEK, 0, DAY_MINUTES)]
+
+# 与 clean.HOUR_24 相同，整个值等于其中之一时表示全天营业
+HOUR_24 = frozenset(['24h', '24小时', '24/24', 'ALL'])
+
+# 词的类别，不在表中的词（包括三位以上的数字）不支持
+TOKEN_CLASSES = {':': ':', '：': ':', '.': '.', '-': '-', '~': '~', ',': ',', ' ': ' ',
+                 'to': 't', 'am': 'a', 'AM': 'a', 'pm': 'p', 'PM': 'p'}
+TOKEN_CLASSES.update((name, 'w') for name in WEEKDAYS + tuple(WEEKDAY_FULL))
+TOKEN_CLASSES.update((name, 'm') for name in MONTHS)
+TOKEN_CLASSES.update((str(i), 'n') for i in range(100))
+TOKEN_CLASSES.update(('0%d' % i, 'n') for i in range(10))
+
+TOKEN_RE = re.compile(r'[0-9]+|[A-Za-z]+|[\s\S]')
+
+# 时间：数字[分隔符 数字][am/pm]，没有分钟时必须有 am/pm；范围的分隔符是 -、~、to，两边可以各有一个空格
+TIME = r'n(?:[:.]n[ap]?|[ap])'
+RANGE = TIME + r'(?:[-~t]| [-t] )' + TIME
+# 1 月份或月日范围，2 多余的冒号，3 星期或星期范围，4 多余的冒号，5 第一个时间范围，6 逗号，7 第二个时间范围
+PART_RE = re.compile(r'(?:(m-m|m n-m n)(:?) )?(?:(w(?:-w)?)(:?) )?(%s)(?:(, ?)(%s))?'
+                     % (RANGE, RANGE))
+
+
+class Reject(Exception):
+    '''不在支持范围内的写法。'''
+
+
+def tokenize(text):
+    '''把字符串切分成词，返回 (词的列表, 类别字符串)；有不支持的词时返回 (词的列表, None)。'''
+
+    tokens = TOKEN_RE.findall(text)
+    try:
+        return tokens, ''.join([TOKEN_CLASSES[token] for token in tokens])
+    except KeyError:
+        return tokens, None
+
+
+def read_time(tokens, classes, i):
+    '''从第 i 个词开始读一个时间，返回 ((时, 分, 分隔符, am/pm), 下一个词的位置)。'''
+
+    hour = tokens[i]
+    minute = colon = suffix = None
+    i += 1
+    if classes[i] in ':.':
+        colon = tokens[i]
+        minute = tokens[i + 1]
+        i += 2
+    if i < len(classes) and classes[i] in 'ap':
+        suffix = tokens[i]
+        i += 1
+    return (hour, minute, colon, suffix), i
+
+
+def read_range(tokens, classes, start, end):
+    '''读一个时间范围，返回 (开始时间, 分隔符, 两边是否有空格, 结束时间)。'''
+
+    first, i = read_time(tokens, classes, start)
+    spaced = classes[i] == ' '
+    if spaced:
+        i += 1
+    separator = tokens[i]
+    second, i = read_time(tokens, classes, i + 2 if spaced else i + 1)
+    return first, separator, spaced, second
+
+
+def time_text(time):
+    '''统一格式的时间，与 style_hour 对 am/pm 的处理相同：pm 的小时加12，没有分钟的补上 :00。'''
+
+    hour, minute, colon, suffix = time
+    if suffix in ('pm', 'PM'):
+        hour = str(int(hour) + 12)
+    return hour + ':' + (minute if minute is not None else '00')
+
+
+def time_minutes(time):
+    hour, minute, colon, suffix = time
+    hour = int(hour) + (12 if suffix in ('pm', 'PM') else 0)
+    minute = int(minute) if minute is not None else 0
+    if hour > 24 or minute > 59 or (hour == 24 and minute):
+        raise Reject('time out of range')
+    return hour * 60 + minute
+
+
+def parse_part(text):
+    """Parse one ';' separated part into (canonical text, rules)
+
+    Raise Reject when the part is not in the unified formats or style_hour
+    may treat it differently.
+    """
+
+    if text in HOUR_24:
+        return '24/7', ALWAYS
+    stripped = text.strip()
+    if stripped == '24/7':
+        return '24/7', ALWAYS
+    if not stripped:
+        return '', []
+
+    tokens, classes = tokenize(stripped)
+    m = PART_RE.fullmatch(classes) if classes is not None else None
+    if m is None:
+        raise Reject('not in the unified formats')
+    months, month_colon, weekdays, week_colon, first, comma, second = m.group(1, 2, 3, 4, 5, 6, 7)
+
+    # 只接受 clean.HOUR_PATTERNS 中的组合
+    if months is not None:
+        allowed = second is None and (weekdays is None if len(months) > 3 else
+                                      weekdays is None or len(weekdays) == 3)
+    elif weekdays is not None:
+        allowed = second is None or (len(weekdays) == 3 and comma == ', ')
+    else:
+        allowed = True
+    # 多余的冒号只去掉第一个（REDUNDANT_COLON_RE）
+    if not allowed or (month_colon and week_colon):
+        raise Reject('not one of the unified formats')
+
+    ranges = [read_range(tokens, classes, *m.span(5))]
+    if second is not None:
+        ranges.append(read_range(tokens, classes, *m.span(7)))
+
+    # style_hour 对 '~' 和 ' - ' 的处理是锚定在字符串开头的：只有以时间范围开头时才生效
+    starts_with_time = m.start(5) == 0 and not text[:1].isspace()
+    (first_start, first_separator, first_spaced, first_end) = ranges[0]
+    separators = [separator for start, separator, spaced, end in ranges]
+    if '~' in separators:
+        if not (first_separator == '~' and starts_with_time and not first_spaced
+                and first_start[2] == ':' and first_end[2] == ':' and first_start[3] is None):
+            raise Reject('~ is only replaced after a leading time range')
+        if any(spaced and separator == '~' for start, separator, spaced, end in ranges):
+            raise Reject('spaced ~')
+    if first_spaced and not starts_with_time:
+        raise Reject('spaced range after a selector')
+    if not first_spaced and any(spaced for start, separator, spaced, end in ranges):
+        raise Reject('spaced range after the first one')
+
+    # style_hour 只转换第一个 am 和第一个 pm
+    suffixes = [t[3] for start, separator, spaced, end in ranges for t in (start, end)]
+    if suffixes.count('am') + suffixes.count('AM') > 1 or \
+            suffixes.count('pm') + suffixes.count('PM') > 1:
+        raise Reject('more than one am or pm')
+
+    # 统一格式的字符串和规则
+    words = []
+    dates = WHOLE_YEAR
+    if months is not None:
+        i = m.start(1)
+        if len(months) == 3:
+            words.append(tokens[i] + '-' + tokens[i + 2])
+            dates = ((MONTHS.index(tokens[i]) + 1) * 100 + 1,
+                     (MONTHS.index(tokens[i + 2]) + 1) * 100 + 31)
+        else:
+            first_day, last_day = tokens[i + 2], tokens[i + 6]
+            if not (0 < int(first_day) <= 31 and 0 < int(last_day) <= 31):
+                raise Reject('day out of range')
+            words.append('%s %s-%s %s' % (tokens[i], first_day, tokens[i + 4], last_day))
+            dates = ((MONTHS.index(tokens[i]) + 1) * 100 + int(first_day),
+                     (MONTHS.index(tokens[i + 4]) + 1) * 100 + int(last_day))
+    days = ALL_WEEK
+    if weekdays is not None:
+        i = m.start(3)
+        first_day = WEEKDAY_FULL.get(tokens[i], tokens[i])
+        last_day = WEEKDAY_FULL.get(tokens[i + 2], tokens[i + 2]) if len(weekdays) == 3 \
+            else first_day
+        words.append(first_day if len(weekdays) == 1 else first_day + '-' + last_day)
+        first_index, last_index = WEEKDAYS.index(first_day), WEEKDAYS.index(last_day)
+        days = 0
+        for k in range((last_index - first_index) % 7 + 1):
+            days |= 1 << ((first_index + k) % 7)
+
+    times = time_text(first_start) + '-' + time_text(first_end)
+    if second is not None:
+        start, separator, spaced, end = ranges[1]
+        times += comma + time_text(start) + '-' + time_text(end)
+    words.append(times)
+    canonical = ' '.join(words)
+    if first_spaced:
+        # SPACED_RANGE_RE 匹配时 style_hour 去掉所有空格
+        canonical = canonical.replace(' ', '')
+
+    rules = []
+    for start, separator, spaced, end in ranges:
+        start_minute, end_minute = time_minutes(start), time_minutes(end)
+        if start_minute >= DAY_MINUTES:
+            raise Reject('range starts at 24:00')
+        if end_minute > start_minute:
+            rules.append(dates + (days, start_minute, end_minute))
+        else:
+            # 跨过午夜（e.g. 22:00-02:00）：后半段算在第二天
+            rules.append(dates + (days, start_minute, DAY_MINUTES))
+            if end_minute:
+                next_days = ((days << 1) | (days >> 6)) & ALL_WEEK
+                rules.append(dates + (next_days, 0, end_minute))
+    return canonical, rules
+
+
+class OpeningHours(object):
+    '''解析后的营业时间：text 是统一格式的字符串，rules 是 (起始日期, 结束日期, 星期掩码, 开始分钟, 结束分钟) 的元组。'''
+
+    __slots__ = ('text', 'rules')
+
+    def __init__(self, text, rules):
+        self.text = text
+        self.rules = tuple(rules)
+
+    def is_open(self, when):
+        """Return True if open at the datetime when"""
+
+        date = when.month * 100 + when.day
+        day = 1 << when.weekday()
+        minute = when.hour * 60 + when.minute
+        for start_date, end_date, days, start, end in self.rules:
+            if (days & day and start <= minute < end and
+                    (start_date <= date <= end_date if start_date <= end_date
+                     else date >= start_date or date <= end_date)):
+                return True
+        return False
+
+    def __repr__(self):
+        return 'OpeningHours(%r)' % self.text
+
+
+def parse(value):
+    """Parse an opening_hours value into OpeningHours, or return None
+
+    Parts separated by ';' are parsed separately; a later part replaces
+    the earlier ones on the weekdays it names, as in the OSM syntax.
+    None means the value is not in a format this parser handles.
+    """
+
+    if value.find(';') > 0:
+        parts = value.split(';')
+    else:
+        parts = [value]
+    texts = []
+    rules = []
+    try:
+        for part in parts:
+            text, part_rules = parse_part(part)
+            texts.append(text)
+            replaced = 0
+            for rule in part_rules:
+                replaced |= rule[2]
+            rules = [rule[:2] + (rule[2] & ~replaced,) + rule[3:] for rule in rules
+                     if rule[2] & ~replaced] + part_rules
+    except Reject:
+        return None
+    if len(parts) == 1 and not texts[0]:
+        return None   # 空字符串不是合法的营业时间
+    return OpeningHours(';'.join(texts), rules)
+
+
+def normalize(value):
+    """Return the unified opening_hours string, or None if unsupported
+
+    For every value where it is not None, the result equals
+    clean.update_hour(value) computed by the style_hour regex chain.
+    """
+
+    parsed = parse(value)
+    return parsed.text if parsed is not None else None
+
+
+class HoursIndex(object):
+    """Opening hours of many places in flat numpy arrays for vectorized queries
+
+    values is a sequence of opening_hours strings; open_at(when) returns a
+    boolean array over them. Values that cannot be parsed are never open.
+    """
+
+    def __init__(self, values):
+        import numpy as np   # 只在建立索引时需要 numpy
+
+        owners, rows = [], []
+        self.parsed = 0
+        self.size = 0
+        for i, value in enumerate(values):
+            self.size = i + 1
+            hours = parse(value) if isinstance(value, str) else None
+            if hours is None:
+                continue
+            self.parsed += 1
+            for rule in hours.rules:
+                owners.append(i)
+                rows.append(rule)
+        rows = np.array(rows, dtype=np.int32).reshape(-1, 5)
+        self.owner = np.array(owners, dtype=np.int64)
+        self.start_date, self.end_date, self.days, self.start, self.end = rows.T
+        self.np = np
+
+    def open_at(self, when):
+        np = self.np
+        date = when.month * 100 + when.day
+        minute = when.hour * 60 + when.minute
+        in_dates = np.where(self.start_date <= self.end_date,
+                            (self.start_date <= date) & (date <= self.end_date),
+                            (date >= self.start_date) | (date <= self.end_date))
+        match = (in_dates & ((self.days & (1 << when.weekday())) != 0) &
+                 (self.start <= minute) & (minute < self.end))
+        result = np.zeros(self.size, dtype=bool)
+        result[self.owner[match]] = True
+        return result
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Parse the opening_hours tags of an OSM file '
+                                                 'and count the places open at a time.')
+    parser.add_argument('osm_file')
+    parser.add_argument('--at', default=None,
+                        help='ISO date and time, e.g. 2017-06-03T21:30 (default: now)')
+    args = parser.parse_args()
+
+    when = datetime.datetime.fromisoformat(args.at) if args.at else datetime.datetime.now()
+    values = [elem.attrib['v'] for event, elem in ET.iterparse(args.osm_file)
+              if elem.tag == 'tag' and elem.attrib['k'] == 'opening_hours']
+    index = HoursIndex(values)
+    print('%d opening_hours values, %d parsed, %d open at %s'
+          % (len(values), index.parsed, index.open_at(when).sum(), when.isoformat(' ')))
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# 转换流程的性能统计（可选）：各阶段（解析、shape_element、校验、写出）的累计耗时，
+# 每秒处理的元素数和tag数，每个清洗函数的调用次数和耗时分布（按2的幂微秒分桶的直方图），
+# 以及进程的峰值内存（RSS）。运行中定期打印进度，结束后写出 JSON 报告。
+# 不开启时 osm2csv 不创建 Profiler，主循环中没有任何计时代码。
+# 用法：python osm2csv.py sample_beijing_china.osm --profile report.json
+
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:   # Windows 上没有 resource 模块，不统计峰值内存
+    resource = None
+
+import clean
+
+
+STAGES = ('parse', 'shape', 'validate', 'write')
+
+HISTOGRAM_BUCKETS = 24   # 第 i 个桶是 [2^(i-1), 2^i) 微秒，最后一个桶包含更慢的调用
+
+PROGRESS_INTERVAL = 10.0   # 打印进度的间隔，单位秒
+
+
+def peak_rss():
+    '''返回本进程和已结束的子进程的峰值 RSS（字节），无法统计时返回 None。'''
+
+    if resource is None:
+        return None
+    scale = 1 if sys.platform == 'darwin' else 1024   # Linux 上 ru_maxrss 的单位是KB
+    return {'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale}
+
+
+class Profiler(object):
+    '''一次转换的统计数据。各个 wrap_* 方法返回带计时的替代对象，由 osm2csv 在开启统计时使用。'''
+
+    def __init__(self, progress_interval=PROGRESS_INTERVAL, stream=sys.stderr):
+        self.progress_interval = progress_interval
+        self.stream = stream
+        self.stage_time = dict.fromkeys(STAGES, 0.0)
+        self.elements = {}    # 元素类型 -> 个数
+        self.tags = 0
+        self.cleaners = {}    # 清洗规则的键 -> {'calls', 'time', 'histogram'}
+        self.start = time.perf_counter()
+        self.last_progress = self.start
+        self.elapsed = None
+        self.saved_updaters = None
+        self.shaper = None    # osm2csv 实际使用的 shaper（'dict' 或 'tuple'）
+
+    # ---------- 计时的替代对象 ---------- #
+
+    def wrap_elements(self, elements):
+        '''逐个产出 elements，统计解析时间和元素个数，并定期打印进度。'''
+
+        clock = time.perf_counter
+        stage_time = self.stage_time
+        counts = self.elements
+        iterator = iter(elements)
+        while True:
+            start = clock()
+            try:
+                element = next(iterator)
+            except StopIteration:
+                stage_time['parse'] += clock() - start
+                return
+            now = clock()
+            stage_time['parse'] += now - start
+            counts[element.tag] = counts.get(element.tag, 0) + 1
+            if now - self.last_progress >= self.progress_interval:
+                self.last_progress = now
+                self.progress()
+            yield element
+
+    def wrap_shape(self, shape):
+        '''带计时的 shape_element，同时统计tag数（清洗耗时包含在 shape 阶段中）。'''
+
+        clock = time.perf_counter
+        stage_time = self.stage_time
+
+        def timed_shape(element):
+            start = clock()
+            el = shape(element)
+            stage_time['shape'] += clock() - start
+            if el:
+                for name, rows in el.items():
+                    if name.endswith('_tags'):
+                        self.tags += len(rows)
+            return el
+        return timed_shape
+
+    def wrap_shape_rows(self, shape):
+        '''带计时的 shape_element_rows，同时统计tag数，用于 write_rows 的元组路径。'''
+
+        clock = time.perf_counter
+        stage_time = self.stage_time
+
+        def timed_shape(element):
+            start = clock()
+            shaped = shape(element)
+            stage_time['shape'] += clock() - start
+            if shaped is not None:
+                self.tags += len(shaped[3])
+            return shaped
+        return timed_shape
+
+    def wrap_stage(self, stage, function):
+        clock = time.perf_counter
+        stage_time = self.stage_time
+
+        def timed(*args):
+            start = clock()
+            result = function(*args)
+            stage_time[stage] += clock() - start
+            return result
+        return timed
+
+    def wrap_writer(self, writer):
+        '''带计时的行写入器，writerow 的耗时计入 write 阶段。'''
+
+        return TimedWriter(writer, self.stage_time)
+
+    def wrap_cleaner(self, key, updater):
+        clock = time.perf_counter
+        stats = self.cleaners.setdefault(
+            key, {'calls': 0, 'time': 0.0, 'histogram': [0] * HISTOGRAM_BUCKETS})
+        histogram = stats['histogram']
+        last = HISTOGRAM_BUCKETS - 1
+
+        def timed_updater(value):
+            start = clock()
+            result = updater(value)
+            elapsed = clock() - start
+            stats['calls'] += 1
+            stats['time'] += elapsed
+            histogram[min(int(elapsed * 1e6).bit_length(), last)] += 1
+            return result
+        return timed_updater
+
+    def instrument_cleaners(self):
+        '''把 clean.UPDATERS 中的清洗函数换成计时版本；有缓存时只有未命中的值才会调用它们。'''
+
+        self.saved_updaters = dict(clean.UPDATERS)
+        for key, updater in self.saved_updaters.items():
+            clean.UPDATERS[key] = self.wrap_cleaner(key, updater)
+
+    def restore_cleaners(self):
+        if self.saved_updaters is not None:
+            clean.UPDATERS.update(self.saved_updaters)
+            self.saved_updaters = None
+
+    def __enter__(self):
+        self.instrument_cleaners()
+        return self
+
+    def __exit__(self, *exc):
+        self.restore_cleaners()
+        self.elapsed = time.perf_counter() - self.start
+
+    # ---------- 汇总 ---------- #
+
+    def state(self):
+        '''可以跨进程传递的统计数据，见 merge()。'''
+
+        return {'stage_time': self.stage_time, 'elements': self.elements,
+                'tags': self.tags, 'cleaners': self.cleaners}
+
+    def merge(self, state):
+        '''把另一个进程的 state() 加到本对象上（并行模式下合并各个分片的统计）。'''
+
+        for stage, seconds in state['stage_time'].items():
+            self.stage_time[stage] = self.stage_time.get(stage, 0.0) + seconds
+        for tag, count in state['elements'].items():
+            self.elements[tag] = self.elements.get(tag, 0) + count
+        self.tags += state['tags']
+        for key, other in state['cleaners'].items():
+            stats = self.cleaners.setdefault(
+                key, {'calls': 0, 'time': 0.0, 'histogram': [0] * HISTOGRAM_BUCKETS})
+            stats['calls'] += other['calls']
+            stats['time'] += other['time']
+            stats['histogram'] = [a + b for a, b in zip(stats['histogram'], other['histogram'])]
+
+    def progress(self):
+        elapsed = time.perf_counter() - self.start
+        total = sum(self.elements.values())
+        self.stream.write('%8.1fs %10d elements %9.0f elements/s %10d tags\n'
+                          % (elapsed, total, total / elapsed if elapsed else 0.0, self.tags))
+        self.stream.flush()
+
+    def report(self, cache=None):
+        '''返回统计报告（字典）；cache 是 clean.cache_info() 的结果。'''
+
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self.start
+        total = sum(self.elements.values())
+        cleaners = {}
+        for key, stats in sorted(self.cleaners.items()):
+            cleaners[key] = {
+                'calls': stats['calls'],
+                'seconds': stats['time'],
+                'mean_us': stats['time'] / stats['calls'] * 1e6 if stats['calls'] else 0.0,
+                # 直方图的键是每个桶的上限（微秒）
+                'histogram_us': {'<%d' % (1 << i): count
+                                 for i, count in enumerate(stats['histogram']) if count},
+            }
+        return {
+            'shaper': self.shaper,
+            'elapsed_seconds': elapsed,
+            'elements': dict(self.elements, total=total),
+            'tags': self.tags,
+            'elements_per_second': total / elapsed if elapsed else 0.0,
+            'tags_per_second': self.tags / elapsed if elapsed else 0.0,
+            'stage_seconds': dict(self.stage_time),
+            'cleaners': cleaners,
+            'cache': cache,
+            'peak_rss_bytes': peak_rss(),
+        }
+
+    def write_report(self, path, cache=None):
+        report = self.report(cache)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        return report
+
+
+class TimedWriter(object):
+    '''包装 csv.DictWriter / ColumnarWriter，统计写出耗时。'''
+
+    def __init__(self, writer, stage_time):
+        self.writer = writer
+        self.stage_time = stage_time
+
+    def writeheader(self):
+        self.writer.writeheader()
+
+    def writerow(self, row):
+        start = time.perf_counter()
+        self.writer.writerow(row)
+        self.stage_time['write'] += time.perf_counter() - start
+
+
+def print_report(report, stream=sys.stdout):
+    '''以表格形式打印 report() 的主要内容。'''
+
+    elapsed = report['elapsed_seconds']
+    stream.write('%d elements, %d tags in %.2fs (%.0f elements/s, %.0f tags/s), %s shaper\n'
+                 % (report['elements']['total'], report['tags'], elapsed,
+                    report['elements_per_second'], report['tags_per_second'],
+                    report.get('shaper')))
+    for stage, seconds in report['stage_seconds'].items():
+        stream.write('  %-10s %8.2fs %6.1f%%\n'
+                     % (stage, seconds, 100 * seconds / elapsed if elapsed else 0.0))
+    for key, stats in report['cleaners'].items():
+        stream.write('  clean %-14s %8d calls %8.2f us/call\n'
+                     % (key, stats['calls'], stats['mean_us']))
+    rss = report['peak_rss_bytes']
+    if rss is not None:
+        stream.write('  peak rss   %8.1f MB\n' % (max(rss.values()) / 2 ** 20))
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# 多边形关系（type=multipolygon / boundary）的成员解析：osm 文件中关系排在最后，
+# 所以分两遍流式读取。第一遍只看关系，记下需要的途径 id 和角色（outer/inner）；
+# 第二遍把节点坐标存入 geometry.NodeStore，只保留需要的途径的节点引用。
+# 然后按端点把途径拼接成环，把每个内环分配给包含它的最小外环，写入 multipolygons.csv（WKT 格式）。
+# 用法：python multipolygon.py sample_beijing_china.osm [--node-store DIR]
+
+import argparse
+import csv
+import shutil
+import tempfile
+
+import numpy as np
+
+import geometry
+import osm2csv
+
+
+MULTIPOLYGONS_PATH = "multipolygons.csv"
+
+MULTIPOLYGONS_FIELDS = ['id', 'type', 'outer', 'inner', 'open', 'incomplete', 'wkt']
+
+MULTIPOLYGON_TYPES = ('multipolygon', 'boundary')
+
+
+def get_relations(osm_file, types=MULTIPOLYGON_TYPES):
+    """First pass: return {relation id: (type, [(way id, role), ...])}
+
+    Only relations whose type tag is in types are kept; members without a
+    role count as outer, as in older OSM data.
+    """
+
+    relations = {}
+    for element in osm2csv.get_element(osm_file, tags=('relation',)):
+        tags = {tag.attrib['k']: tag.attrib['v'] for tag in element.iter('tag')}
+        if tags.get('type') not in types:
+            continue
+        members = [(int(m.attrib['ref']), m.attrib['role'] or 'outer')
+                   for m in element.iter('member') if m.attrib['type'] == 'way']
+        relations[int(element.attrib['id'])] = (tags['type'], members)
+    return relations
+
+
+def get_member_ways(osm_file, way_ids, store):
+    """Second pass: add every node to store and return {way id: [node ids]} for way_ids"""
+
+    ways = {}
+    for element in osm2csv.get_element(osm_file, tags=('node', 'way')):
+        if element.tag == 'node':
+            store.add(element.attrib['id'], element.attrib['lat'], element.attrib['lon'])
+        else:
+            way_id = int(element.attrib['id'])
+            if way_id in way_ids:
+                ways[way_id] = [int(nd.attrib['ref']) for nd in element.iter('nd')]
+    return ways
+
+
+def build_rings(way_refs):
+    """Join node lists that share end points into rings
+
+    Return (closed, open): lists of node id lists. A closed ring starts and
+    ends with the same node; what cannot be closed is returned as open.
+    """
+
+    pending = [refs for refs in way_refs if refs]
+    closed = []
+    open_rings = []
+    while pending:
+        ring = list(pending.pop())
+        while ring[0] != ring[-1] or len(ring) < 4:
+            for i, refs in enumerate(pending):
+                if refs[0] == ring[-1]:
+                    ring.extend(refs[1:])
+                elif refs[-1] == ring[-1]:
+                    ring.extend(reversed(refs[:-1]))
+                else:
+                    continue
+                del pending[i]
+                break
+            else:
+                break
+        if ring[0] == ring[-1] and len(ring) >= 4:
+            closed.append(ring)
+        else:
+            open_rings.append(ring)
+    return closed, open_rings
+
+
+def ring_area(lat, lon):
+    '''环的面积（平方度，鞋带公式），只用来比较大小。'''
+
+    return abs(np.dot(lon[:-1], lat[1:]) - np.dot(lon[1:], lat[:-1])) / 2
+
+
+def point_in_ring(lat, lon, ring_lat, ring_lon):
+    '''射线法判断点是否在环内。'''
+
+    lat1, lon1 = ring_lat[:-1], ring_lon[:-1]
+    lat2, lon2 = ring_lat[1:], ring_lon[1:]
+    crosses = (lat1 > lat) != (lat2 > lat)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x = lon1 + (lat - lat1) * (lon2 - lon1) / (lat2 - lat1)
+    return bool(np.count_nonzero(crosses & (lon < x)) % 2)
+
+
+def ring_wkt(lat, lon):
+    return '(%s)' % ', '.join('%.7f %.7f' % point for point in zip(lon, lat))
+
+
+def assemble(relation_id, relation_type, members, ways, store):
+    """Build the multipolygons.csv row of one relation"""
+
+    rings = {'outer': [], 'inner': []}
+    open_count = 0
+    incomplete = 0
+    for role in rings:
+        way_refs = [ways[way_id] for way_id, member_role in members
+                    if member_role == role and way_id in ways]
+        incomplete += sum(1 for way_id, member_role in members
+                          if member_role == role and way_id not in ways)
+        closed, open_rings = build_rings(way_refs)
+        open_count += len(open_rings)
+        for ring in closed:
+            lat, lon, found = store.lookup(ring)
+            if found.all():
+                rings[role].append((lat, lon))
+            else:
+                incomplete += 1
+
+    # 每个内环归入包含它的面积最小的外环
+    areas = [ring_area(lat, lon) for lat, lon in rings['outer']]
+    holes = [[] for _ in rings['outer']]
+    for lat, lon in rings['inner']:
+        owners = [i for i, (outer_lat, outer_lon) in enumerate(rings['outer'])
+                  if point_in_ring(lat[0], lon[0], outer_lat, outer_lon)]
+        if owners:
+            holes[min(owners, key=areas.__getitem__)].append((lat, lon))
+        else:
+            incomplete += 1
+
+    polygons = ['(%s)' % ', '.join(ring_wkt(*ring) for ring in [outer] + inner)
+                for outer, inner in zip(rings['outer'], holes)]
+    return {'id': relation_id, 'type': relation_type,
+            'outer': len(rings['outer']), 'inner': len(rings['inner']),
+            'open': open_count, 'incomplete': incomplete,
+            'wkt': 'MULTIPOLYGON(%s)' % ', '.join(polygons) if polygons else ''}
+
+
+def process_multipolygons(osm_file, file_out=MULTIPOLYGONS_PATH, store_dir=None,
+                          types=MULTIPOLYGON_TYPES):
+    """Resolve multipolygon relations of osm_file in two streaming passes
+
+    store_dir is passed to geometry.NodeStore ('temp' for a temporary
+    on-disk store). Return the number of relations written.
+    """
+
+    tmp_dir = None
+    if store_dir == 'temp':
+        store_dir = tmp_dir = tempfile.mkdtemp(prefix='nodestore_')
+    try:
+        relations = get_relations(osm_file, types)
+        way_ids = {way_id for _, members in relations.values() for way_id, _ in members}
+
+        store = geometry.NodeStore(store_dir)
+        try:
+            ways = get_member_ways(osm_file, way_ids, store)
+            with open(file_out, 'w', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, MULTIPOLYGONS_FIELDS)
+                writer.writeheader()
+                for relation_id, (relation_type, members) in relations.items():
+                    writer.writerow(assemble(relation_id, relation_type, members, ways, store))
+        finally:
+            store.close()
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return len(relations)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Assemble multipolygon relations into WKT.')
+    parser.add_argument('osm_file', nargs='?', default=osm2csv.OSM_PATH)
+    parser.add_argument('--output', default=MULTIPOLYGONS_PATH)
+    parser.add_argument('--node-store', metavar='DIR',
+                        help="keep node coordinates on disk in DIR, or 'temp' for a "
+                             "temporary one; by default they are kept in memory")
+    args = parser.parse_args()
+
+    count = process_multipolygons(args.osm_file, args.output, store_dir=args.node_store)
+    print('%d relations written to %s' % (count, args.output))
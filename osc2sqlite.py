@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# 增量更新：读取 OSM 变更文件（osmChange，.osc 或压缩的 .osc.gz 等），只更新数据库中受影响的行，
+# 不用每次都重新转换整个地图。新增和修改的元素同样经过 shape_element 和 clean 的清洗。
+# 已应用的最新序列号记录在 replication_state 表中，重复应用同一个变更文件会被跳过。
+# 用法：python osc2sqlite.py 000/004/123.osc.gz [更多变更文件...] --db openstreet.sqlite
+
+import argparse
+import os
+import re
+import sqlite3
+import xml.etree.cElementTree as ET
+
+import compressed
+import osm2csv
+import osm2sqlite
+import sqlschema
+import tagdict
+
+
+STATE_TABLE = ('CREATE TABLE IF NOT EXISTS replication_state '
+               '(key VARCHAR PRIMARY KEY, value VARCHAR)')
+
+# 每种元素涉及的表，删除元素时要从这些表中删除对应 id 的行
+ELEMENT_TABLES = {
+    'node': ['nodes', 'nodes_tags'],
+    'way': ['ways', 'ways_nodes', 'ways_tags'],
+    'relation': ['relations', 'relation_members', 'relation_tags'],
+}
+
+# 复制服务器上的变更文件路径形如 000/004/123.osc.gz，对应序列号 4123；也可以是其他压缩格式
+SEQUENCE_PATH = re.compile(r'(\d{3})[/\\](\d{3})[/\\](\d{3})\.osc(?:%s)?$'
+                           % '|'.join(re.escape(suffix) for suffix in compressed.SUFFIXES))
+
+
+def sequence_from_path(path):
+    """Return the replication sequence number encoded in a change file path"""
+
+    m = SEQUENCE_PATH.search(path)
+    if m:
+        return int(''.join(m.group(1, 2, 3)))
+    name = os.path.basename(path).split('.')[0]
+    if name.isdigit():
+        return int(name)
+    return None
+
+
+def get_state(conn, key, default=None):
+    conn.execute(STATE_TABLE)
+    row = conn.execute('SELECT value FROM replication_state WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else default
+
+
+def set_state(conn, key, value):
+    conn.execute(STATE_TABLE)
+    conn.execute('INSERT OR REPLACE INTO replication_state (key, value) VALUES (?, ?)',
+                 (key, str(value)))
+
+
+def get_change(osc_file):
+    """Yield (action, element) for each node, way and relation of an osmChange file"""
+
+    with compressed.open_input(osc_file) as f:
+        context = ET.iterparse(f, events=('start', 'end'))
+        _, root = next(context)
+        action = block = None
+        for event, elem in context:
+            if event == 'start':
+                if elem.tag in ('create', 'modify', 'delete'):
+                    action, block = elem.tag, elem
+            elif elem.tag in ELEMENT_TABLES:
+                yield action, elem
+                # 动作块从 root 删除后 iterparse 仍向它添加元素，所以处理过的元素要从块中删除
+                block.clear()
+                root.clear()
+
+
+def delete_element(conn, tag, element_id, rtree):
+    for table in ELEMENT_TABLES[tag]:
+        conn.execute('DELETE FROM %s WHERE id = ?' % table, (element_id,))
+    if tag == 'node' and rtree:
+        conn.execute('DELETE FROM nodes_rtree WHERE id = ?', (element_id,))
+
+
+def insert_rows(conn, table, rows, table_fields=osm2sqlite.TABLE_FIELDS):
+    fields = table_fields[table]
+    conn.executemany(osm2sqlite.insert_statement(table, fields),
+                     [tuple(row[field] for field in fields) for row in rows])
+
+
+def apply_change(conn, osc_file, sequence=None):
+    """Apply one osmChange file to the database in a single transaction
+
+    Created and modified elements replace all rows of that id, deleted ones
+    are removed. On a dictionary encoded database (osm2sqlite.py
+    --dictionary) the tags are encoded with the tag_keys and tag_values
+    lookup tables, new strings are added to them. Return the number of created, modified and deleted elements,
+    or None if the sequence number was already applied.
+    """
+
+    last = get_state(conn, 'sequence_number')
+    if sequence is not None and last is not None and sequence <= int(last):
+        return None
+
+    rtree = conn.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE name='nodes_rtree'").fetchone()[0] > 0
+    counts = {'create': 0, 'modify': 0, 'delete': 0}
+
+    dictionary = None
+    encode = lambda rows: rows
+    table_fields = osm2sqlite.TABLE_FIELDS
+    if sqlschema.is_encoded(conn):
+        dictionary = tagdict.TagDictionary.from_rows(
+            conn.execute('SELECT id, key, type FROM tag_keys'),
+            conn.execute('SELECT id, value FROM tag_values'))
+        encode = dictionary.encode_dicts
+        table_fields = dict(osm2sqlite.TABLE_FIELDS, **osm2sqlite.ENCODED_FIELDS)
+
+    def insert(table, rows):
+        insert_rows(conn, table, rows, table_fields)
+
+    with conn:
+        for action, element in get_change(osc_file):
+            element_id = int(element.attrib['id'])
+            delete_element(conn, element.tag, element_id, rtree)
+            counts[action] += 1
+            if action == 'delete':
+                continue
+
+            el = osm2csv.shape_element(element)
+            if element.tag == 'node':
+                insert('nodes', [el['node']])
+                insert('nodes_tags', encode(el['node_tags']))
+                if rtree:
+                    lat = float(el['node']['lat'])
+                    lon = float(el['node']['lon'])
+                    conn.execute('INSERT INTO nodes_rtree VALUES (?, ?, ?, ?, ?)',
+                                 (element_id, lat, lat, lon, lon))
+            elif element.tag == 'way':
+                insert('ways', [el['way']])
+                insert('ways_nodes', el['way_nodes'])
+                insert('ways_tags', encode(el['way_tags']))
+            else:
+                insert('relations', [el['relation']])
+                insert('relation_members', el['relation_members'])
+                insert('relation_tags', encode(el['relation_tags']))
+
+        if dictionary is not None:
+            # 新的字符串与使用它们的行在同一个事务中写入
+            new_keys, new_values = dictionary.take_new()
+            conn.executemany('INSERT INTO tag_keys VALUES (?, ?, ?)', new_keys)
+            conn.executemany('INSERT INTO tag_values VALUES (?, ?)', new_values)
+        if sequence is not None:
+            set_state(conn, 'sequence_number', sequence)
+
+    return counts
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Apply OSM change files to the SQLite database.')
+    parser.add_argument('osc_files', nargs='+', help='osmChange files, in sequence order')
+    parser.add_argument('--db', default=osm2sqlite.DB_PATH, help='path of the SQLite database')
+    parser.add_argument('--sequence', type=int,
+                        help='sequence number of a single change file, '
+                             'by default read from the file path')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    for osc_file in args.osc_files:
+        sequence = args.sequence if args.sequence is not None else sequence_from_path(osc_file)
+        counts = apply_change(conn, osc_file, sequence)
+        if counts is None:
+            print('%s: sequence %s already applied, skipped' % (osc_file, sequence))
+        else:
+            print('%s: %d created, %d modified, %d deleted'
+                  % (osc_file, counts['create'], counts['modify'], counts['delete']))
+    conn.close()
@@ -1,17 +1,31 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import argparse
 import csv
 import codecs
+import contextlib
+import functools
+import json
+import multiprocessing
+import operator
+import os
 import pprint
 import re
+import shutil
+import tempfile
 import xml.etree.cElementTree as ET
 
 import cerberus
 
+import fastschema
+import pbf
 import schema
 
+import checkpoint
 import clean   # 导入清洗模块
+import compressed
+import tagdict
 
 OSM_PATH = "sample_beijing_china.osm"
 
@@ -20,28 +34,61 @@ NODE_TAGS_PATH = "nodes_tags.csv"
 WAYS_PATH = "ways.csv"
 WAY_NODES_PATH = "ways_nodes.csv"
 WAY_TAGS_PATH = "ways_tags.csv"
+RELATIONS_PATH = "relations.csv"
+RELATION_MEMBERS_PATH = "relation_members.csv"
+RELATION_TAGS_PATH = "relation_tags.csv"
+
+OUTPUT_PATHS = [NODES_PATH, NODE_TAGS_PATH, WAYS_PATH, WAY_NODES_PATH, WAY_TAGS_PATH,
+                RELATIONS_PATH, RELATION_MEMBERS_PATH, RELATION_TAGS_PATH]
+
+OUTPUT_FORMATS = ('csv', 'columnar')
 
 LOWER_COLON = re.compile(r'^([a-z]|_)+:([a-z]|_)+')
 PROBLEMCHARS = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
 
 SCHEMA = schema.schema
 
+# 启动时把 schema 编译成每种元素专用的检查函数，见 fastschema.py
+FAST_SCHEMA = fastschema.compile_schema(SCHEMA)
+
+# 校验方式：'fast' 使用编译后的检查函数，'cerberus' 是作为参照的原始实现
+VALIDATORS = ('fast', 'cerberus')
+
 # Make sure the fields order in the csvs matches the column order in the sql table schema
 NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
 NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
 WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
 WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+RELATION_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+RELATION_MEMBERS_FIELDS = ['id', 'member_id', 'member_type', 'role', 'position']
+RELATION_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+
+OUTPUT_FIELDS = [NODE_FIELDS, NODE_TAGS_FIELDS, WAY_FIELDS, WAY_NODES_FIELDS, WAY_TAGS_FIELDS,
+                 RELATION_FIELDS, RELATION_MEMBERS_FIELDS, RELATION_TAGS_FIELDS]
+
+# 字典编码时标签表的字段换成 (id, key_id, value_id)，见 tagdict.py
+ENCODED_OUTPUT_FIELDS = [tagdict.ENCODED_TAGS_FIELDS if fields is NODE_TAGS_FIELDS or
+                         fields is WAY_TAGS_FIELDS or fields is RELATION_TAGS_FIELDS else fields
+                         for fields in OUTPUT_FIELDS]
+
+ELEMENT_TAGS = ('node', 'way', 'relation')
+
+SHAPERS = ('auto', 'dict', 'tuple')
+
+WRITE_BATCH_SIZE = 10000   # tuple 写出方式每处理这么多个元素调用一次 writerows
 
 
 def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
                   problem_chars=PROBLEMCHARS, default_tag_type='regular'):
-    """Clean and shape node or way XML element to Python dict"""
+    """Clean and shape node, way or relation XML element to Python dict"""
 
     node_attribs = {}
     way_attribs = {}
     way_nodes = []
-    tags = []  # Handle secondary tags the same way for both node and way elements
+    relation_attribs = {}
+    relation_members = []
+    tags = []  # Handle secondary tags the same way for all element types
 
     for tag in element.iter('tag'):            
         m = LOWER_COLON.search(tag.attrib['k'].lower())
@@ -54,7 +101,7 @@ def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIE
             ttype = 'regular'     
             tkey = tag.attrib['k']
             
-        value = clean.update_value(tkey, tag.attrib['v'])    # 清洗value值
+        value = clean.update_value_cached(tkey, tag.attrib['v'])    # 清洗value值（带缓存）
         if value != '' :    # 如果清洗后value为空字符，则说明原数据错误，将不被记录
             tags.append({'id': element.attrib['id'],
                         'key': tkey,
@@ -80,26 +127,104 @@ def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIE
          
         return {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
 
+    elif element.tag == 'relation':
+        for field in RELATION_FIELDS:
+            relation_attribs[field] = element.attrib[field]
+
+        position = 0
+        for member in element.iter('member'):
+            relation_members.append({'id': element.attrib['id'],
+                                     'member_id': member.attrib['ref'],
+                                     'member_type': member.attrib['type'],
+                                     'role': member.attrib['role'],
+                                     'position': position})
+            position += 1
+
+        return {'relation': relation_attribs, 'relation_members': relation_members,
+                'relation_tags': tags}
+
+
+@functools.lru_cache(maxsize=None)
+def split_tag_key(k):
+    """Return the (type, key) split of a tag key, cached per distinct key"""
+
+    if LOWER_COLON.search(k.lower()):
+        index = k.index(':')
+        return k[:index], k[index+1:]
+    return 'regular', k
+
+
+# 按 csv 字段顺序取出属性值的元组
+NODE_ROW = operator.itemgetter(*NODE_FIELDS)
+WAY_ROW = operator.itemgetter(*WAY_FIELDS)
+RELATION_ROW = operator.itemgetter(*RELATION_FIELDS)
+
+
+def shape_element_rows(element):
+    """Clean and shape an element into field-ordered tuples
+
+    The low-allocation twin of shape_element: return (tag, row, children,
+    tags) where row is the element's own csv row, children the way node or
+    relation member rows (None for nodes) and tags the tag rows, all tuples
+    in OUTPUT_FIELDS order.
+    """
+
+    attrib = element.attrib
+    element_id = attrib['id']
+    update_value = clean.update_value_cached
+
+    tags = []
+    for tag in element.iter('tag'):
+        ttype, tkey = split_tag_key(tag.attrib['k'])
+        value = update_value(tkey, tag.attrib['v'])
+        if value != '':
+            tags.append((element_id, tkey, value, ttype))
+
+    if element.tag == 'node':
+        return 'node', NODE_ROW(attrib), None, tags
+
+    elif element.tag == 'way':
+        way_nodes = [(element_id, nd.attrib['ref'], position)
+                     for position, nd in enumerate(element.iter('nd'))]
+        return 'way', WAY_ROW(attrib), way_nodes, tags
+
+    elif element.tag == 'relation':
+        members = [(element_id, m.attrib['ref'], m.attrib['type'], m.attrib['role'], position)
+                   for position, m in enumerate(element.iter('member'))]
+        return 'relation', RELATION_ROW(attrib), members, tags
+
 
 # ================================================== #
 #               Helper Functions                     #
 # ================================================== #
             
-def get_element(osm_file, tags=('node', 'way', 'relation')):
-    """Yield element if it is the right type of tag"""
+def get_element(osm_file, tags=('node', 'way', 'relation'), workers=1):
+    """Yield element if it is the right type of tag
 
-    context = ET.iterparse(osm_file, events=('start', 'end'))
-    _, root = next(context)
-    for event, elem in context:
-        if event == 'end' and elem.tag in tags:
-            yield elem
-            root.clear()
+    Compressed files (.gz, .bz2, .xz, .zst) are decompressed on the fly in
+    another thread or process, see compressed.open_input. PBF files (.pbf)
+    are decoded by pbf.py, in workers processes.
+    """
+
+    if pbf.is_pbf(osm_file):
+        yield from pbf.get_element(osm_file, tags, workers)
+        return
+
+    with contextlib.ExitStack() as stack:
+        if compressed.compression_of(osm_file):
+            osm_file = stack.enter_context(compressed.open_input(osm_file))
+        context = ET.iterparse(osm_file, events=('start', 'end'))
+        _, root = next(context)
+        for event, elem in context:
+            if event == 'end' and elem.tag in tags:
+                yield elem
+                root.clear()
 
 
 def validate_element(element, validator, schema=SCHEMA):
     """Raise ValidationError if element does not match schema"""
     if validator.validate(element, schema) is not True:
-        field, errors = next(validator.errors.iteritems())
+        field, errors = next(iter(validator.errors.items()))
         message_string = "\nElement of type '{0}' has the following errors:\n{1}"
         error_string = pprint.pformat(errors)
         
@@ -108,56 +233,672 @@ def validate_element(element, validator, schema=SCHEMA):
 
 
 
+# ================================================== #
+#               Parallel Helpers                     #
+# ================================================== #
+
+# 顶层元素的起始标记。属性值中的 '<' 会被转义，nd/tag/member 也不会与之混淆，
+# 所以文件中任何匹配的位置都是一个 node、way 或 relation 元素的开头
+ELEMENT_START = re.compile(rb'<(?:node|way|relation)[\s/>]')
+
+CHUNK_SIZE = 32 * 1024 * 1024   # 并行模式下每个分片的大致字节数
+
+
+def find_element_start(osm_file, offset, limit, block_size=1024 * 1024):
+    """Return the offset of the first top-level element at or after offset"""
+
+    while offset < limit:
+        osm_file.seek(offset)
+        block = osm_file.read(block_size)
+        m = ELEMENT_START.search(block)
+        if m:
+            return min(offset + m.start(), limit)
+        if len(block) < block_size:
+            break
+        offset += len(block) - 16   # 留出重叠，防止起始标记被块边界截断
+    return limit
+
+
+def split_map(file_in, chunk_size=CHUNK_SIZE, start=0):
+    """Split file_in into byte ranges that each hold whole top-level elements
+
+    The ranges begin at the first element at or after start.
+    """
+
+    with open(file_in, 'rb') as osm_file:
+        osm_file.seek(0, 2)
+        size = osm_file.tell()
+        osm_file.seek(max(0, size - 4096))
+        tail = osm_file.read()
+        end = size - len(tail) + tail.rfind(b'</osm>')
+        if end < size - len(tail):
+            end = size
+
+        start = find_element_start(osm_file, start, end)
+        bounds = [start]
+        while bounds[-1] < end:
+            bounds.append(find_element_start(osm_file, bounds[-1] + chunk_size, end))
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class ChunkReader(object):
+    """File-like reader over one byte range, wrapped in an <osm> root element"""
+
+    def __init__(self, file_in, start, end):
+        self.osm_file = open(file_in, 'rb')
+        self.osm_file.seek(start)
+        self.remaining = end - start
+        self.head = b'<osm>'
+        self.tail = b'</osm>'
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.remaining + len(self.head) + len(self.tail)
+        data = self.head[:size]
+        self.head = self.head[len(data):]
+        if len(data) < size and self.remaining > 0:
+            body = self.osm_file.read(min(size - len(data), self.remaining))
+            self.remaining -= len(body)
+            if not body:
+                self.remaining = 0
+            data += body
+        if len(data) < size and self.remaining == 0:
+            end = self.tail[:size - len(data)]
+            self.tail = self.tail[len(end):]
+            data += end
+        return data
+
+    def close(self):
+        self.osm_file.close()
+
+
+def process_chunk(args):
+    """Shape one byte range of the map into headerless part csv(s)"""
+
+    (file_in, start, end, out_paths, validate, validator_name, profile, element_filter,
+     shaper, pipeline) = args
+    before = clean.cache_info()
+    reader = ChunkReader(file_in, start, end)
+    with contextlib.ExitStack() as stack:
+        stack.callback(reader.close)
+        profiler = None
+        if profile:
+            import instrument
+            # 进度由主进程在每个分片完成后打印
+            profiler = stack.enter_context(instrument.Profiler(progress_interval=float('inf')))
+        elements = get_element(reader, tags=ELEMENT_TAGS)
+        if element_filter is not None:
+            elements = element_filter.apply(elements)
+        if shaper == 'tuple':
+            write_rows(elements, out_paths, header=False, pipeline=pipeline, profiler=profiler)
+        else:
+            write_elements(elements, out_paths, validate, header=False,
+                           validator_name=validator_name, profiler=profiler,
+                           pipeline=pipeline)
+    after = clean.cache_info()
+    return (out_paths, after['hits'] - before['hits'], after['misses'] - before['misses'],
+            profiler.state() if profiler is not None else None)
+
+
+def process_map_parallel(file_in, validate, workers, chunk_size=CHUNK_SIZE,
+                         cache_size=clean.CACHE_SIZE, validator_name='fast', profiler=None,
+                         element_filter=None, shaper='dict', pipeline=None,
+                         out_paths=OUTPUT_PATHS, checkpoint_path=None, resume=False):
+    """Process the map in a process pool and merge the parts in element order
+
+    Return the cleaning cache statistics summed over all workers. The stage
+    and cleaner statistics of every worker are merged into profiler, so its
+    stage times add up the time spent in all processes. Compressed outputs
+    are merged as concatenated streams, which gzip, bz2, xz and zstd read
+    as one file. With checkpoint_path a checkpoint is saved after each part
+    is merged; resume continues from it (see checkpoint.py).
+    """
+
+    state = None
+    offset = None
+    if checkpoint_path is not None:
+        state = checkpoint.Checkpoint(checkpoint_path, file_in, out_paths)
+        if resume:
+            offset = state.load()
+        else:
+            state.remove()
+
+    tmp_dir = tempfile.mkdtemp(prefix='osm2csv_', dir=os.path.dirname(os.path.abspath(NODES_PATH)))
+    try:
+        jobs = []
+        for index, (start, end) in enumerate(split_map(file_in, chunk_size, offset or 0)):
+            part_paths = [os.path.join(tmp_dir, '%06d_%s' % (index, os.path.basename(path)))
+                          for path in out_paths]
+            jobs.append((file_in, start, end, part_paths, validate, validator_name,
+                         profiler is not None, element_filter, shaper, pipeline))
+
+        # 先写表头，再按分片顺序追加各个进程的输出
+        if offset is None:
+            write_elements([], out_paths, validate)
+        hits = misses = 0
+        with multiprocessing.Pool(workers, clean.set_cache_size, (cache_size,)) as pool:
+            outputs = [open(path, 'ab') for path in out_paths]
+            try:
+                for job, (part_paths, chunk_hits, chunk_misses, chunk_profile) in \
+                        zip(jobs, pool.imap(process_chunk, jobs)):
+                    hits += chunk_hits
+                    misses += chunk_misses
+                    if profiler is not None:
+                        profiler.merge(chunk_profile)
+                        profiler.progress()
+                    for output, part_path in zip(outputs, part_paths):
+                        with open(part_path, 'rb') as part:
+                            shutil.copyfileobj(part, output)
+                        os.remove(part_path)
+                    if state is not None:
+                        for output in outputs:
+                            output.flush()
+                        state.save(job[2])
+            finally:
+                for output in outputs:
+                    output.close()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return {'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+            'maxsize': cache_size,
+            'currsize': None}
+
+
 # ================================================== #
 #               Main Function                        #
 # ================================================== #
-def process_map(file_in, validate):
-    """Iteratively process each XML element and write to csv(s)"""
-
-    with open(NODES_PATH, 'w', encoding='utf-8') as nodes_file, \
-         open(NODE_TAGS_PATH, 'w', encoding='utf-8') as nodes_tags_file, \
-         open(WAYS_PATH, 'w', encoding='utf-8') as ways_file, \
-         open(WAY_NODES_PATH, 'w', encoding='utf-8') as way_nodes_file, \
-         open(WAY_TAGS_PATH, 'w', encoding='utf-8') as way_tags_file:
-
-        nodes_writer = csv.DictWriter(nodes_file, NODE_FIELDS)
-        node_tags_writer = csv.DictWriter(nodes_tags_file, NODE_TAGS_FIELDS)
-        ways_writer = csv.DictWriter(ways_file, WAY_FIELDS)
-        way_nodes_writer = csv.DictWriter(way_nodes_file, WAY_NODES_FIELDS)
-        way_tags_writer = csv.DictWriter(way_tags_file, WAY_TAGS_FIELDS)
-
-        nodes_writer.writeheader()
-        node_tags_writer.writeheader()
-        ways_writer.writeheader()
-        way_nodes_writer.writeheader()
-        way_tags_writer.writeheader()
-
-        validator = cerberus.Validator()
-
-        for element in get_element(file_in, tags=('node', 'way')):
-            el = shape_element(element)
+def pipeline_writer(path, fields, dict_rows, options, append=False):
+    import pipeline   # 只在使用后台写出线程时导入
+    return pipeline.ThreadedWriter(path, fields, dict_rows=dict_rows, append=append, **options)
+
+
+def open_writers(stack, out_paths, output_format='csv', pipeline=None, append=False,
+                 output_fields=OUTPUT_FIELDS):
+    """Open one row writer per output path, registering the files on stack
+
+    'csv' gives csv.DictWriter(s); 'columnar' gives columnar.ColumnarWriter(s)
+    writing Parquet (or .npy without pyarrow) next to the csv paths.
+    pipeline is None or a dict of pipeline.ThreadedWriter options; with it
+    csv rows are written by one background thread per file. append=True
+    appends to existing csv files. output_fields are the csv fields of
+    each output (ENCODED_OUTPUT_FIELDS for dictionary encoded tags).
+    """
+
+    if output_format == 'csv':
+        if pipeline is not None:
+            return [stack.enter_context(pipeline_writer(path, fields, True, pipeline, append))
+                    for path, fields in zip(out_paths, output_fields)]
+        return [csv.DictWriter(stack.enter_context(compressed.open_output(path, append=append)),
+                               fields)
+                for path, fields in zip(out_paths, output_fields)]
+
+    elif output_format == 'columnar':
+        import columnar   # 需要 numpy，只在使用列式输出时导入
+        return [stack.enter_context(columnar.ColumnarWriter(
+                    columnar.columnar_path(path), columnar.COLUMN_TYPES[columnar.table_name(path)]))
+                for path in out_paths]
+
+    raise ValueError('unknown output format: %r' % output_format)
+
+
+def write_elements(elements, out_paths, validate, header=True, output_format='csv',
+                   validator_name='fast', geometry=None, profiler=None, pipeline=None,
+                   append=False, analytics=None, dictionary=None):
+    """Shape each XML element and write it to the csv(s) in out_paths
+
+    geometry is an optional geometry.WayGeometry stage fed with every node
+    and way. profiler is an optional instrument.Profiler; without it the loop
+    runs with no timing code at all. pipeline and append are passed to
+    open_writers. analytics is an optional analytics.Analytics fed with
+    every shaped element. dictionary is an optional tagdict.TagDictionary;
+    with it the tag rows are written as (id, key_id, value_id).
+    """
+
+    with contextlib.ExitStack() as stack:
+
+        if dictionary is not None:
+            encode = dictionary.encode_dicts
+            writers = open_writers(stack, out_paths, output_format, pipeline, append,
+                                   ENCODED_OUTPUT_FIELDS)
+        else:
+            encode = lambda rows: rows
+            writers = open_writers(stack, out_paths, output_format, pipeline, append)
+        if profiler is not None:
+            writers = [profiler.wrap_writer(writer) for writer in writers]
+        (nodes_writer, node_tags_writer, ways_writer, way_nodes_writer, way_tags_writer,
+         relations_writer, relation_members_writer, relation_tags_writer) = writers
+
+        if header:
+            nodes_writer.writeheader()
+            node_tags_writer.writeheader()
+            ways_writer.writeheader()
+            way_nodes_writer.writeheader()
+            way_tags_writer.writeheader()
+            relations_writer.writeheader()
+            relation_members_writer.writeheader()
+            relation_tags_writer.writeheader()
+
+        if validator_name == 'cerberus':
+            check = functools.partial(validate_element, validator=cerberus.Validator())
+        else:
+            check = functools.partial(fastschema.validate, checkers=FAST_SCHEMA)
+
+        shape = shape_element
+        if profiler is not None:
+            elements = profiler.wrap_elements(elements)
+            shape = profiler.wrap_shape(shape)
+            check = profiler.wrap_stage('validate', check)
+
+        for element in elements:
+            el = shape(element)
             if el:
                 
                 if validate is True:
-                    validate_element(el, validator)
+                    check(el)
+                if analytics is not None:
+                    analytics.add_shaped(element.tag, el)
 
                 if element.tag == 'node':
                     nodes_writer.writerow(el['node'])
-                    for row in el['node_tags']:  
+                    for row in encode(el['node_tags']):
                         node_tags_writer.writerow(row)
+                    if geometry is not None:
+                        geometry.add_node(el['node'])
                         
                 elif element.tag == 'way':
                     ways_writer.writerow(el['way'])
                     for row in el['way_nodes']:                    
                        way_nodes_writer.writerow(row)
-                    for row in el['way_tags']:
+                    for row in encode(el['way_tags']):
                         way_tags_writer.writerow(row)
+                    if geometry is not None:
+                        geometry.add_way(el['way'], el['way_nodes'])
+
+                elif element.tag == 'relation':
+                    relations_writer.writerow(el['relation'])
+                    for row in el['relation_members']:
+                        relation_members_writer.writerow(row)
+                    for row in encode(el['relation_tags']):
+                        relation_tags_writer.writerow(row)
+
+
+# tuple 写出方式中每种元素的 (自身的行, 子行, tag 行) 对应的输出序号
+ROW_OUTPUTS = {'node': (0, None, 1), 'way': (2, 3, 4), 'relation': (5, 6, 7)}
+
+
+def write_rows(elements, out_paths, header=True, batch_size=WRITE_BATCH_SIZE, pipeline=None,
+               append=False, analytics=None, dictionary=None, profiler=None):
+    """Shape each XML element into tuples and write them with csv.writer
+
+    Rows are buffered per output and written with writerows every
+    batch_size elements; the files are byte-identical to write_elements
+    with csv output. pipeline is None or a dict of ThreadedWriter options;
+    append=True appends to existing files. analytics is an optional
+    analytics.Analytics fed with every shaped element. dictionary is an
+    optional tagdict.TagDictionary encoding the tag rows. profiler is an
+    optional instrument.Profiler; the batched writes count as its write stage.
+    """
+
+    output_fields = OUTPUT_FIELDS if dictionary is None else ENCODED_OUTPUT_FIELDS
+    with contextlib.ExitStack() as stack:
+        if pipeline is not None:
+            writers = [stack.enter_context(pipeline_writer(path, fields, False, pipeline, append))
+                       for path, fields in zip(out_paths, output_fields)]
+        else:
+            writers = [csv.writer(stack.enter_context(compressed.open_output(path, append=append)))
+                       for path in out_paths]
+        if header:
+            for writer, fields in zip(writers, output_fields):
+                writer.writerow(fields)
+
+        buffers = [[] for _ in out_paths]
+
+        def flush():
+            for writer, buffer in zip(writers, buffers):
+                if buffer:
+                    writer.writerows(buffer)
+                    del buffer[:]
+
+        shape = shape_element_rows
+        if profiler is not None:
+            elements = profiler.wrap_elements(elements)
+            shape = profiler.wrap_shape_rows(shape)
+            flush = profiler.wrap_stage('write', flush)
+
+        pending = 0
+        for element in elements:
+            shaped = shape(element)
+            if shaped is None:
+                continue
+            tag, row, children, tags = shaped
+            if analytics is not None:
+                analytics.add_rows(tag, row, children, tags)
+            row_index, children_index, tags_index = ROW_OUTPUTS[tag]
+            buffers[row_index].append(row)
+            if children:
+                buffers[children_index].extend(children)
+            if tags:
+                if dictionary is not None:
+                    tags = dictionary.encode_rows(tags)
+                buffers[tags_index].extend(tags)
+            pending += 1
+            if pending >= batch_size:
+                flush()
+                pending = 0
+        flush()
+
+
+def write_checkpointed(file_in, out_paths, write, checkpoint_path, resume=False,
+                       checkpoint_bytes=checkpoint.CHECKPOINT_BYTES):
+    """Write the map segment by segment, saving a checkpoint after each one
+
+    write(elements, header, append) shapes and writes a stream of elements.
+    The segments are byte ranges of about checkpoint_bytes split at element
+    boundaries; with resume the outputs are truncated to the last
+    checkpoint and the map is continued from its offset (see checkpoint.py).
+    """
+
+    state = checkpoint.Checkpoint(checkpoint_path, file_in, out_paths)
+    offset = state.load() if resume else None
+    if offset is None:
+        state.remove()
+        write([], header=True, append=False)   # 新建输出文件，写表头
+
+    for start, end in split_map(file_in, checkpoint_bytes, offset or 0):
+        reader = ChunkReader(file_in, start, end)
+        try:
+            write(get_element(reader, tags=ELEMENT_TAGS), header=False, append=True)
+        finally:
+            reader.close()
+        state.save(end)
+
+
+def choose_shaper(shaper, output_format='csv', validate=False, geometry=False):
+    """Resolve the shaper option to 'dict' or 'tuple'
+
+    The tuple path only writes csv and has no validation or geometry
+    hooks; 'auto' uses it whenever neither is needed. Both paths can be
+    profiled, the report names the shaper that ran.
+    """
+
+    if shaper not in SHAPERS:
+        raise ValueError('unknown shaper: %r' % shaper)
+    plain = output_format == 'csv' and not validate and not geometry
+    if shaper == 'auto':
+        return 'tuple' if plain else 'dict'
+    if shaper == 'tuple' and not plain:
+        raise ValueError('the tuple shaper only writes csv without validation or geometry')
+    return shaper
+
+
+def process_map(file_in, validate, workers=1, cache_size=clean.CACHE_SIZE,
+                output_format='csv', validator_name='fast', geometry=False, node_store=None,
+                profiler=None, element_filter=None, shaper='auto', pipeline=None,
+                compression=None, checkpoint_path=None, resume=False,
+                checkpoint_bytes=checkpoint.CHECKPOINT_BYTES, analytics=None,
+                encode_tags=False):
+    """Iteratively process each XML element and write to csv(s)
+
+    With workers > 1 the map is split at element boundaries and shaped in a
+    process pool; the output is identical to the single process run.
+    Cleaned values are memoized in an LRU cache of cache_size entries
+    (0 disables it); the cache hit/miss statistics are returned.
+    output_format is 'csv' or 'columnar' (see columnar.py). validator_name
+    picks the compiled 'fast' validation or the 'cerberus' reference;
+    validation needs the dict shaper and makes the run 20% to 70% slower.
+    With geometry=True the length, bbox and centroid of every way are written
+    to ways_geometry.csv; node_store is a directory for the on-disk node
+    coordinate store ('temp' for a temporary one), None keeps it in memory.
+    profiler is an optional instrument.Profiler collecting stage timings,
+    cleaner latencies and progress (see instrument.py).
+    element_filter is an optional filters.ElementFilter; rejected elements
+    are skipped before they are shaped or cleaned. shaper picks the dict
+    based shape_element path or the tuple path of write_rows (see
+    choose_shaper); both write the same bytes. pipeline is None or a dict of
+    pipeline.ThreadedWriter options (batch_size, queue_size, buffer_size);
+    with it the csv files are written by background threads.
+    file_in may be compressed (.gz, .bz2, .xz, .zst); compression is None or
+    one of compressed.COMPRESSIONS and compresses the csv outputs, e.g.
+    nodes.csv.gz. A PBF file_in is decoded with workers processes and
+    shaped in this process.
+    With checkpoint_path the map is converted in segments of about
+    checkpoint_bytes (the parts of the parallel mode) and a
+    checkpoint is saved after each; resume=True continues an interrupted
+    run from its checkpoint, appending to the csv(s) without duplicating
+    or losing rows.
+    analytics is an optional analytics.Analytics that computes the report
+    statistics from the shaped elements during the conversion; call its
+    summary() afterwards.
+    With encode_tags=True the tag csv(s) hold (id, key_id, value_id) and
+    the strings are written once to the tag_keys and tag_values lookup
+    tables (see tagdict.py).
+    """
+
+    shaper = choose_shaper(shaper, output_format, validate, geometry)
+    if profiler is not None:
+        profiler.shaper = shaper
+    if compression is not None and output_format != 'csv':
+        raise ValueError('only csv output can be compressed')
+    out_paths = [compressed.compressed_path(path, compression) for path in OUTPUT_PATHS]
+
+    if checkpoint_path is not None:
+        if output_format != 'csv':
+            raise ValueError('checkpoints are only supported for csv output')
+        if compressed.compression_of(file_in) or pbf.is_pbf(file_in):
+            raise ValueError('checkpoints record byte offsets, they need an uncompressed '
+                             'XML input')
+        if geometry:
+            raise ValueError('way geometry needs all nodes, it cannot be resumed')
+        if element_filter is not None and element_filter.is_sequential:
+            raise ValueError('bbox filtering of ways and relations cannot be resumed')
+
+    if analytics is not None:
+        # 途径的信号灯数要用到前面所有节点的标签，需要按文件顺序处理全部元素
+        if workers > 1 and not pbf.is_pbf(file_in):
+            raise ValueError('analytics need the elements in file order, use a single process')
+        if checkpoint_path is not None:
+            raise ValueError('analytics of the converted segments are not saved, '
+                             'they cannot be resumed')
+
+    dictionary = None
+    if encode_tags:
+        if output_format != 'csv':
+            raise ValueError('the columnar output already dictionary encodes the tag strings')
+        # 编号由一个字典按元素顺序分配，各个进程、各次续传之间无法共享
+        if workers > 1 and not pbf.is_pbf(file_in):
+            raise ValueError('dictionary encoding assigns ids in file order, use a single process')
+        if checkpoint_path is not None:
+            raise ValueError('the tag dictionary is not saved in checkpoints, it cannot be resumed')
+        dictionary = tagdict.TagDictionary()
+
+    if workers > 1 and not pbf.is_pbf(file_in):
+        if output_format != 'csv':
+            raise ValueError('parallel mode only writes csv output')
+        if compressed.compression_of(file_in):
+            raise ValueError('parallel mode splits the file by byte offsets, '
+                             'it needs an uncompressed input')
+        if geometry:
+            raise ValueError('way geometry needs all nodes, use a single process')
+        if element_filter is not None and element_filter.is_sequential:
+            raise ValueError('bbox filtering of ways and relations needs a single process')
+        with contextlib.ExitStack() as stack:
+            if profiler is not None:
+                stack.enter_context(profiler)
+            chunk_size = CHUNK_SIZE if checkpoint_path is None else checkpoint_bytes
+            return process_map_parallel(file_in, validate, workers, chunk_size, cache_size,
+                                        validator_name=validator_name, profiler=profiler,
+                                        element_filter=element_filter, shaper=shaper,
+                                        pipeline=pipeline, out_paths=out_paths,
+                                        checkpoint_path=checkpoint_path, resume=resume)
+
+    clean.set_cache_size(cache_size)
+    with contextlib.ExitStack() as stack:
+        if profiler is not None:
+            stack.enter_context(profiler)
+        stage = None
+        if geometry:
+            import geometry as way_geometry   # 需要 numpy，只在计算几何信息时导入
+            stage = stack.enter_context(way_geometry.WayGeometry(store_dir=node_store))
+
+        def write(elements, header=True, append=False):
+            if element_filter is not None:
+                elements = element_filter.apply(elements)
+            if shaper == 'tuple':
+                write_rows(elements, out_paths, header=header, pipeline=pipeline, append=append,
+                           analytics=analytics, dictionary=dictionary, profiler=profiler)
+            else:
+                write_elements(elements, out_paths, validate, header=header,
+                               output_format=output_format, validator_name=validator_name,
+                               geometry=stage, profiler=profiler, pipeline=pipeline,
+                               append=append, analytics=analytics, dictionary=dictionary)
+
+        if checkpoint_path is not None:
+            write_checkpointed(file_in, out_paths, write, checkpoint_path, resume,
+                               checkpoint_bytes)
+        else:
+            write(get_element(file_in, tags=ELEMENT_TAGS, workers=workers))
+        if dictionary is not None:
+            dictionary.write(compressed.compressed_path(tagdict.TAG_KEYS_PATH, compression),
+                             compressed.compressed_path(tagdict.TAG_VALUES_PATH, compression))
+    return clean.cache_info()
 
 
 
 if __name__ == '__main__':
 
-    # Note: Validation is ~ 10X slower. For the project consider using a small
-    # sample of the map when validating.
-    process_map(OSM_PATH, validate=False)
-
+    parser = argparse.ArgumentParser(description='Clean an OSM file and convert it to csv(s).')
+    parser.add_argument('osm_file', nargs='?', default=OSM_PATH)
+    parser.add_argument('--validate', action='store_true',
+                        help='validate every element against schema.py (slower, it needs the '
+                             'dict shaper)')
+    parser.add_argument('--validator', choices=VALIDATORS, default='fast',
+                        help='compiled schema checks, or the slower cerberus reference')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes used to shape the map (to decode a .pbf map)')
+    parser.add_argument('--cache-size', type=int, default=clean.CACHE_SIZE,
+                        help='entries of the cleaned value LRU cache, 0 to disable')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='csv',
+                        help='csv, or typed columns in Parquet/.npy files')
+    parser.add_argument('--geometry', action='store_true',
+                        help='write length, bbox and centroid of each way to ways_geometry.csv')
+    parser.add_argument('--shaper', choices=SHAPERS, default='auto',
+                        help="'tuple' writes field-ordered tuples in batches (csv without "
+                             "validation only), 'auto' uses it when possible")
+    parser.add_argument('--pipeline', action='store_true',
+                        help='write each csv file from a background thread')
+    parser.add_argument('--write-batch', type=int, default=5000,
+                        help='rows per batch handed to a writer thread')
+    parser.add_argument('--write-queue', type=int, default=16,
+                        help='batches queued per writer thread before parsing blocks')
+    parser.add_argument('--compress', choices=compressed.COMPRESSIONS,
+                        help='compress the csv outputs, e.g. nodes.csv.gz')
+    parser.add_argument('--checkpoint', metavar='PATH', nargs='?',
+                        const=checkpoint.CHECKPOINT_PATH,
+                        help='save a checkpoint after every segment of the map to PATH')
+    parser.add_argument('--checkpoint-mb', type=int, default=checkpoint.CHECKPOINT_BYTES // 2 ** 20,
+                        help='input MB converted between checkpoints')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue an interrupted --checkpoint run, appending to the csv(s)')
+    parser.add_argument('--profile', metavar='REPORT',
+                        help='collect stage/cleaner timings of the shaper that runs and write a '
+                             'JSON report to REPORT')
+    parser.add_argument('--progress-interval', type=float, default=10.0,
+                        help='seconds between progress lines when profiling')
+    parser.add_argument('--filter', metavar='JSON',
+                        help='JSON file with filter options (types, include, exclude, bbox, way_refs)')
+    parser.add_argument('--types', nargs='+', choices=('node', 'way', 'relation'),
+                        help='only convert these element types')
+    parser.add_argument('--include', nargs='+', metavar='RULE',
+                        help="keep elements matching a tag rule: key, key=v1|v2 or key~regex")
+    parser.add_argument('--exclude', nargs='+', metavar='RULE',
+                        help='drop elements matching a tag rule')
+    parser.add_argument('--bbox', nargs=4, type=float,
+                        metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'),
+                        help='only convert nodes inside the box and ways touching it')
+    parser.add_argument('--way-refs', choices=('all', 'inside'),
+                        help="with --bbox, 'inside' drops way node refs outside the box")
+    parser.add_argument('--multipolygons', action='store_true',
+                        help='assemble multipolygon rings into multipolygons.csv (second pass)')
+    parser.add_argument('--node-store',
+                        help="directory of the on-disk node coordinate store, 'temp' for a "
+                             "temporary one; by default it is kept in memory")
+    parser.add_argument('--analytics', metavar='REPORT',
+                        help='compute the report statistics during the conversion and write '
+                             'them as JSON to REPORT')
+    parser.add_argument('--dictionary', action='store_true',
+                        help='write tag keys and values once to tag_keys.csv and tag_values.csv '
+                             'and reference them by id in the tag csv(s)')
+    parser.add_argument('--way-aggregates', action='store_true',
+                        help='count the traffic signals and tagged nodes of every way into '
+                             'ways_aggregates.csv with an external sort/merge join (second pass, '
+                             '--format csv only)')
+    parser.add_argument('--sort-memory-mb', type=int, default=256,
+                        help='memory of the external sort of --way-aggregates')
+    parser.add_argument('--sort-temp-dir',
+                        help='directory of the sorted runs of --way-aggregates')
+    args = parser.parse_args()
+    if args.way_aggregates and args.format != 'csv':
+        parser.error('--way-aggregates reads the csv outputs, it needs --format csv')
+
+    # Note: Validation with --validator cerberus is ~ 10X slower. The default
+    # compiled validation is not free either: on a 19 MB extract --validate took
+    # 3.3s against 2.7s with --shaper dict (~20% for the checks and coercion)
+    # and 1.9s with the default tuple shaper, which validation cannot use.
+    element_filter = None
+    filter_options = {}
+    if args.filter:
+        with open(args.filter, encoding='utf-8') as f:
+            filter_options = json.load(f)
+    for option in ('types', 'include', 'exclude', 'bbox', 'way_refs'):
+        if getattr(args, option) is not None:
+            filter_options[option] = getattr(args, option)
+    if filter_options:
+        import filters
+        element_filter = filters.ElementFilter.from_dict(filter_options)
+
+    profiler = None
+    if args.profile:
+        import instrument
+        profiler = instrument.Profiler(progress_interval=args.progress_interval)
+
+    pipeline = None
+    if args.pipeline:
+        pipeline = {'batch_size': args.write_batch, 'queue_size': args.write_queue}
+
+    stats_collector = None
+    if args.analytics:
+        import analytics
+        stats_collector = analytics.Analytics()
+
+    stats = process_map(args.osm_file, validate=args.validate, workers=args.workers,
+                        cache_size=args.cache_size, output_format=args.format,
+                        validator_name=args.validator, geometry=args.geometry,
+                        node_store=args.node_store, profiler=profiler,
+                        element_filter=element_filter, shaper=args.shaper,
+                        pipeline=pipeline, compression=args.compress,
+                        checkpoint_path=args.checkpoint, resume=args.resume,
+                        checkpoint_bytes=args.checkpoint_mb * 2 ** 20,
+                        analytics=stats_collector, encode_tags=args.dictionary)
+    print('clean cache: {hits} hits, {misses} misses, hit rate {hit_rate:.1%}'.format(**stats))
+    if profiler is not None:
+        instrument.print_report(profiler.write_report(args.profile, cache=stats))
+    if stats_collector is not None:
+        summary = stats_collector.summary()
+        summary.write(args.analytics)
+        analytics.print_summary(summary)
+    if args.multipolygons:
+        import multipolygon   # 需要 numpy，只在组装多边形时导入
+        count = multipolygon.process_multipolygons(args.osm_file, store_dir=args.node_store)
+        print('%d multipolygon relations written to %s' % (count, multipolygon.MULTIPOLYGONS_PATH))
+    if args.way_aggregates:
+        import extsort   # 需要 numpy，只在连接 ways_nodes 时导入
+        with extsort.WayNodeJoin(args.sort_memory_mb * 2 ** 20, args.sort_temp_dir) as join:
+            extsort.join_csv(join, compressed.compressed_path(NODE_TAGS_PATH, args.compress),
+                             compressed.compressed_path(WAY_NODES_PATH, args.compress),
+                             compressed.compressed_path(tagdict.TAG_VALUES_PATH, args.compress))
+            count, top = extsort.write_aggregates(join.aggregates())
+        print('%d ways with tagged nodes written to %s' % (count, extsort.WAYS_AGGREGATES_PATH))
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# 将 osm 文件清洗后直接批量导入 SQLite 数据库，不再经过 csv 文件和 pandas。
+# --checkpoint 时按分片导入，每个分片与记录导入位置的检查点在同一个事务中提交，
+# 中断后用 --resume 从最后提交的分片之后继续。
+
+import argparse
+import sqlite3
+
+import checkpoint
+import clean
+import compressed
+import fastschema
+import filters
+import osm2csv
+import pbf
+import spatial
+import sqlschema
+import tagdict
+
+DB_PATH = "openstreet.sqlite"
+
+BATCH_SIZE = 50000   # 每次 executemany 插入的行数
+
+# 每张表对应的字段顺序
+TABLE_FIELDS = {
+    'nodes': osm2csv.NODE_FIELDS,
+    'nodes_tags': osm2csv.NODE_TAGS_FIELDS,
+    'ways': osm2csv.WAY_FIELDS,
+    'ways_nodes': osm2csv.WAY_NODES_FIELDS,
+    'ways_tags': osm2csv.WAY_TAGS_FIELDS,
+    'relations': osm2csv.RELATION_FIELDS,
+    'relation_members': osm2csv.RELATION_MEMBERS_FIELDS,
+    'relation_tags': osm2csv.RELATION_TAGS_FIELDS,
+}
+
+# 批量导入时的设置：不写回滚日志、不等待磁盘同步、加大页缓存（单位KB）
+BULK_PRAGMAS = [
+    'PRAGMA journal_mode = OFF',
+    'PRAGMA synchronous = OFF',
+    'PRAGMA cache_size = -262144',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA locking_mode = EXCLUSIVE',
+]
+
+# 字典编码时标签表的字段
+ENCODED_FIELDS = {table: tagdict.ENCODED_TAGS_FIELDS
+                  for table in ('nodes_tags', 'ways_tags', 'relation_tags')}
+
+# 可续传的导入：中断后数据库必须仍然完整，所以用 WAL 日志代替关闭日志
+RESUMABLE_PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -262144',
+    'PRAGMA temp_store = MEMORY',
+]
+
+# 已导入到的输入位置，与导入的行在同一个事务中更新
+CHECKPOINT_TABLE = ('CREATE TABLE IF NOT EXISTS load_checkpoint '
+                    '(path VARCHAR, size INTEGER, mtime INTEGER, offset INTEGER)')
+
+# 导入完成后恢复成常规设置
+NORMAL_PRAGMAS = [
+    'PRAGMA journal_mode = DELETE',
+    'PRAGMA synchronous = FULL',
+    'PRAGMA locking_mode = NORMAL',
+]
+
+
+def insert_statement(table, fields):
+    """Return the INSERT statement of a table for rows in fields order"""
+
+    columns = ', '.join('"%s"' % field for field in fields)
+    marks = ', '.join('?' * len(fields))
+    return 'INSERT INTO %s (%s) VALUES (%s)' % (table, columns, marks)
+
+
+def load_checkpoint(conn, file_in):
+    """Return the input offset recorded in the database, None without one
+
+    Raise ValueError when the checkpoint was recorded for another input.
+    """
+
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' "
+                          "AND name='load_checkpoint'").fetchone()
+    if exists is None:
+        return None
+    row = conn.execute('SELECT path, size, mtime, offset FROM load_checkpoint').fetchone()
+    if row is None:
+        return None
+    identity = checkpoint.input_identity(file_in)
+    if list(row[:3]) != [identity['path'], identity['size'], identity['mtime']]:
+        raise ValueError('the database checkpoint was recorded for %s, which differs '
+                         'from the input' % row[0])
+    return row[3]
+
+
+def save_checkpoint(conn, file_in, offset):
+    identity = checkpoint.input_identity(file_in)
+    conn.execute('DELETE FROM load_checkpoint')
+    conn.execute('INSERT INTO load_checkpoint VALUES (?, ?, ?, ?)',
+                 (identity['path'], identity['size'], identity['mtime'], offset))
+
+
+def load_map(file_in, db_path=DB_PATH, validate=False, batch_size=BATCH_SIZE,
+             cache_size=clean.CACHE_SIZE, rtree=True, element_filter=None,
+             resumable=False, resume=False, checkpoint_bytes=checkpoint.CHECKPOINT_BYTES,
+             encode_tags=False):
+    """Clean each XML element and bulk insert it into the SQLite database
+
+    Rows are buffered per table and written with executemany inside one
+    transaction; indexes (and the node R-tree when rtree is True) are built
+    after the load. element_filter is an optional filters.ElementFilter.
+    With resumable=True the map is loaded in segments of about
+    checkpoint_bytes, each committed together with its input offset in the
+    load_checkpoint table; resume=True continues an interrupted load from
+    there instead of recreating the tables.
+    With encode_tags=True the tag tables store key and value ids of the
+    tag_keys and tag_values lookup tables (see tagdict.py); the new
+    strings are inserted with the rows that first use them.
+    Return the row count of each table loaded by this run.
+    """
+
+    resumable = resumable or resume
+    if resumable and (compressed.compression_of(file_in) or pbf.is_pbf(file_in)):
+        raise ValueError('checkpoints record byte offsets, they need an uncompressed XML input')
+    if resumable and element_filter is not None and element_filter.is_sequential:
+        raise ValueError('bbox filtering of ways and relations cannot be resumed')
+
+    table_fields = dict(TABLE_FIELDS, **ENCODED_FIELDS) if encode_tags else TABLE_FIELDS
+    statements = {table: insert_statement(table, fields)
+                  for table, fields in table_fields.items()}
+    buffers = {table: [] for table in TABLE_FIELDS}
+    counts = {table: 0 for table in TABLE_FIELDS}
+
+    def flush(table):
+        conn.executemany(statements[table], buffers[table])
+        counts[table] += len(buffers[table])
+        del buffers[table][:]
+
+    def add(table, rows):
+        fields = table_fields[table]
+        buffer = buffers[table]
+        for row in rows:
+            buffer.append(tuple(row[field] for field in fields))
+        if len(buffer) >= batch_size:
+            flush(table)
+
+    clean.set_cache_size(cache_size)
+    dictionary = None
+    encode = lambda rows: rows
+
+    def load(elements):
+        if element_filter is not None:
+            elements = element_filter.apply(elements)
+        for element in elements:
+            el = osm2csv.shape_element(element)
+            if el:
+                if validate is True:
+                    fastschema.validate(el, osm2csv.FAST_SCHEMA)
+
+                if element.tag == 'node':
+                    add('nodes', [el['node']])
+                    add('nodes_tags', encode(el['node_tags']))
+                elif element.tag == 'way':
+                    add('ways', [el['way']])
+                    add('ways_nodes', el['way_nodes'])
+                    add('ways_tags', encode(el['way_tags']))
+                elif element.tag == 'relation':
+                    add('relations', [el['relation']])
+                    add('relation_members', el['relation_members'])
+                    add('relation_tags', encode(el['relation_tags']))
+
+        for table in TABLE_FIELDS:
+            flush(table)
+        if dictionary is not None:
+            new_keys, new_values = dictionary.take_new()
+            conn.executemany('INSERT INTO tag_keys VALUES (?, ?, ?)', new_keys)
+            conn.executemany('INSERT INTO tag_values VALUES (?, ?)', new_values)
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        offset = load_checkpoint(conn, file_in) if resume else None
+        for pragma in (RESUMABLE_PRAGMAS if resumable else BULK_PRAGMAS):
+            conn.execute(pragma)
+
+        conn.execute('BEGIN')
+        if offset is None:
+            sqlschema.create_tables(conn, encoded=encode_tags)
+            conn.execute('DROP TABLE IF EXISTS load_checkpoint')
+        elif sqlschema.is_encoded(conn) != encode_tags:
+            raise ValueError('the interrupted load was %s dictionary encoding'
+                             % ('with' if sqlschema.is_encoded(conn) else 'without'))
+        if encode_tags:
+            if offset is None:
+                dictionary = tagdict.TagDictionary()
+            else:
+                dictionary = tagdict.TagDictionary.from_rows(
+                    conn.execute('SELECT id, key, type FROM tag_keys'),
+                    conn.execute('SELECT id, value FROM tag_values'))
+            encode = dictionary.encode_dicts
+
+        if resumable:
+            conn.execute(CHECKPOINT_TABLE)
+            for start, end in osm2csv.split_map(file_in, checkpoint_bytes, offset or 0):
+                reader = osm2csv.ChunkReader(file_in, start, end)
+                try:
+                    load(osm2csv.get_element(reader, tags=osm2csv.ELEMENT_TAGS))
+                finally:
+                    reader.close()
+                # 分片的行和检查点一起提交，中断时两者要么都在、要么都不在
+                save_checkpoint(conn, file_in, end)
+                conn.execute('COMMIT')
+                conn.execute('BEGIN')
+        else:
+            load(osm2csv.get_element(file_in, tags=osm2csv.ELEMENT_TAGS))
+        conn.execute('COMMIT')
+
+        # 数据全部导入后再建索引，比边插入边维护索引快得多
+        conn.execute('BEGIN')
+        sqlschema.create_indexes(conn)
+        if rtree:
+            spatial.create_rtree(conn)
+        conn.execute('COMMIT')
+
+        for pragma in NORMAL_PRAGMAS:
+            conn.execute(pragma)
+    finally:
+        conn.close()
+
+    return counts
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Clean an OSM file and load it into SQLite.')
+    parser.add_argument('osm_file', nargs='?', default=osm2csv.OSM_PATH)
+    parser.add_argument('--db', default=DB_PATH, help='path of the SQLite database')
+    parser.add_argument('--validate', action='store_true',
+                        help='validate every element against schema.py')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='rows per executemany call')
+    parser.add_argument('--no-rtree', action='store_true',
+                        help='do not build the nodes_rtree spatial index')
+    parser.add_argument('--filter', metavar='JSON',
+                        help='JSON file with filter options (see filters.py)')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='commit the load in segments with a checkpoint, so it can be resumed')
+    parser.add_argument('--checkpoint-mb', type=int,
+                        default=checkpoint.CHECKPOINT_BYTES // 2 ** 20,
+                        help='input MB loaded between checkpoints')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue an interrupted --checkpoint load')
+    parser.add_argument('--dictionary', action='store_true',
+                        help='store tag keys and values once in tag_keys and tag_values and '
+                             'reference them by id in the tag tables')
+    args = parser.parse_args()
+
+    element_filter = filters.ElementFilter.from_json(args.filter) if args.filter else None
+    counts = load_map(args.osm_file, args.db, validate=args.validate,
+                      batch_size=args.batch_size, rtree=not args.no_rtree,
+                      element_filter=element_filter, resumable=args.checkpoint,
+                      resume=args.resume, checkpoint_bytes=args.checkpoint_mb * 2 ** 20,
+                      encode_tags=args.dictionary)
+    for table, count in counts.items():
+        print('%-16s %d rows' % (table, count))
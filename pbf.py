@@ -0,0 +1,668 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# 纯 Python 的 PBF（.osm.pbf）读取：手工解析 protobuf 的编码格式，用 zlib 解压数据块，
+# 支持 DenseNodes 和 id、坐标、元数据的差分编码。数据块（blob）相互独立，可以在进程池中并行解码。
+# 解码结果是与 ET.iterparse 得到的元素相同结构的 Element（tag、attrib、子元素 tag/nd/member），
+# osm2csv.shape_element 和 clean 的清洗函数不用做任何修改。
+# 另外提供把 osm XML 写成 PBF 的函数和比较两种输入转换结果的工具：
+# 用法：python pbf.py sample_beijing_china.osm --to-pbf sample.osm.pbf
+#       python pbf.py sample_beijing_china.osm --compare [sample.osm.pbf]
+
+import argparse
+import collections
+import csv
+import functools
+import itertools
+import multiprocessing
+import os
+import shutil
+import struct
+import tempfile
+import time
+import xml.etree.cElementTree as ET
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# 支持的 HeaderBlock.required_features
+SUPPORTED_FEATURES = frozenset(['OsmSchema-V0.6', 'DenseNodes', 'HistoricalInformation'])
+
+MEMBER_TYPES = ('node', 'way', 'relation')
+
+BLOCK_SIZE = 8000            # 写 PBF 时每个数据块的元素数
+MAX_BLOB_SIZE = 32 * 2 ** 20  # 规范规定的数据块大小上限
+
+# PBF 中没有元数据（e.g. 用 --omit-metadata 导出）时填入的属性值
+MISSING_INFO = {'version': '0', 'timestamp': '', 'changeset': '0', 'uid': '0', 'user': ''}
+
+
+def is_pbf(path):
+    return isinstance(path, str) and path.lower().endswith('.pbf')
+
+
+# ================================================== #
+#               Protobuf wire format                 #
+# ================================================== #
+
+def read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def iter_fields(buf):
+    """Yield (field number, wire type, value) for each field of a message
+
+    Varints are returned as unsigned ints, length-delimited fields as
+    memoryview slices of buf.
+    """
+
+    buf = memoryview(buf)
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        wire = key & 7
+        if wire == 0:
+            value, pos = read_varint(buf, pos)
+        elif wire == 2:
+            length, pos = read_varint(buf, pos)
+            value = buf[pos:pos + length]
+            pos += length
+        elif wire == 1:
+            value = struct.unpack_from('<q', buf, pos)[0]
+            pos += 8
+        elif wire == 5:
+            value = struct.unpack_from('<i', buf, pos)[0]
+            pos += 4
+        else:
+            raise ValueError('unsupported protobuf wire type %d' % wire)
+        yield key >> 3, wire, value
+
+
+def unpack_varints(data):
+    '''解码 packed 编码的一串 varint。'''
+
+    values = []
+    append = values.append
+    result = shift = 0
+    for b in data:
+        if b < 0x80:
+            append(result | (b << shift))
+            result = shift = 0
+        else:
+            result |= (b & 0x7f) << shift
+            shift += 7
+    return values
+
+
+def varints(wire, value):
+    '''repeated 数值字段：packed（wire type 2）或单个值（wire type 0）。'''
+
+    return unpack_varints(value) if wire == 2 else [value]
+
+
+def signed(n):
+    '''int32/int64 字段中的负数以64位补码编码。'''
+
+    return n - (1 << 64) if n >= 1 << 63 else n
+
+
+def zigzag(n):
+    '''sint32/sint64 字段的 zigzag 解码。'''
+
+    return (n >> 1) ^ -(n & 1)
+
+
+def delta(values):
+    '''差分编码的 sint 序列 -> 原始值。'''
+
+    return list(itertools.accumulate([(v >> 1) ^ -(v & 1) for v in values]))
+
+
+def to_str(value):
+    return bytes(value).decode('utf-8')
+
+
+# ================================================== #
+#               Decoding                             #
+# ================================================== #
+
+def read_blobs(pbf_file):
+    """Yield (type, blob bytes) for each blob of a PBF file, in file order"""
+
+    with open(pbf_file, 'rb') as f:
+        while True:
+            size = f.read(4)
+            if not size:
+                return
+            if len(size) < 4:
+                raise ValueError('truncated PBF file')
+            header = f.read(struct.unpack('>I', size)[0])
+            blob_type = None
+            data_size = 0
+            for field, wire, value in iter_fields(header):
+                if field == 1:
+                    blob_type = to_str(value)
+                elif field == 3:
+                    data_size = value
+            if data_size > MAX_BLOB_SIZE:
+                raise ValueError('blob of %d bytes exceeds the PBF size limit' % data_size)
+            yield blob_type, f.read(data_size)
+
+
+def blob_data(blob):
+    '''解压一个 Blob 消息，返回其中的数据。'''
+
+    raw_size = None
+    for field, wire, value in iter_fields(blob):
+        if field == 1:
+            return bytes(value)
+        elif field == 2:
+            raw_size = value
+        elif field == 3:
+            return zlib.decompress(value)
+        elif field == 7:
+            if zstandard is None:
+                raise ValueError('zstandard is required for zstd compressed PBF blobs')
+            return zstandard.ZstdDecompressor().decompress(bytes(value), max_output_size=raw_size)
+        elif field in (4, 5, 6):
+            raise ValueError('unsupported PBF blob compression (field %d)' % field)
+    return b''
+
+
+def check_header(data):
+    '''检查 HeaderBlock 中要求的特性是否都支持。'''
+
+    for field, wire, value in iter_fields(data):
+        if field == 4:
+            feature = to_str(value)
+            if feature not in SUPPORTED_FEATURES:
+                raise ValueError('unsupported PBF feature: %s' % feature)
+
+
+def format_coord(nano):
+    '''以 1e-9 度为单位的整数坐标 -> osm XML 中的七位小数格式。'''
+
+    if nano % 100 == 0:
+        units = abs(nano) // 100
+        return '%s%d.%07d' % ('-' if nano < 0 else '', units // 10 ** 7, units % 10 ** 7)
+    return '%.9f' % (nano * 1e-9)
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def format_timestamp(seconds):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
+
+
+def decode_info(data, strings, date_granularity):
+    info = {}
+    for field, wire, value in iter_fields(data):
+        if field == 1:
+            info['version'] = str(signed(value))
+        elif field == 2:
+            info['timestamp'] = format_timestamp(signed(value) * date_granularity // 1000)
+        elif field == 3:
+            info['changeset'] = str(signed(value))
+        elif field == 4:
+            info['uid'] = str(signed(value))
+        elif field == 5:
+            info['user'] = strings[value]
+    return info
+
+
+def decode_tags(keys, vals, strings):
+    return [(strings[k], strings[v]) for k, v in zip(keys, vals)]
+
+
+def decode_dense(data, strings, block):
+    '''解码 DenseNodes，返回节点记录列表。'''
+
+    granularity, lat_offset, lon_offset, date_granularity = block
+    ids = lats = lons = []
+    keys_vals = []
+    info = {}
+    for field, wire, value in iter_fields(data):
+        if field == 1:
+            ids = delta(varints(wire, value))
+        elif field == 5:
+            info = decode_dense_info(value)
+        elif field == 8:
+            lats = delta(varints(wire, value))
+        elif field == 9:
+            lons = delta(varints(wire, value))
+        elif field == 10:
+            keys_vals = varints(wire, value)
+
+    records = []
+    kv = iter(keys_vals)
+    for i, node_id in enumerate(ids):
+        attrib = {'id': str(node_id),
+                  'lat': format_coord(lat_offset + granularity * lats[i]),
+                  'lon': format_coord(lon_offset + granularity * lons[i])}
+        if info:
+            attrib['version'] = str(info['version'][i])
+            attrib['timestamp'] = format_timestamp(info['timestamp'][i] * date_granularity // 1000)
+            attrib['changeset'] = str(info['changeset'][i])
+            attrib['uid'] = str(info['uid'][i])
+            attrib['user'] = strings[info['user_sid'][i]]
+        else:
+            attrib.update(MISSING_INFO)
+        tags = []
+        if keys_vals:
+            # 每个节点的 tag 是一串 键, 值 编号，以0结束
+            for k in kv:
+                if k == 0:
+                    break
+                tags.append((strings[k], strings[next(kv)]))
+        records.append(('node', attrib, tags, None))
+    return records
+
+
+def decode_dense_info(data):
+    info = {}
+    for field, wire, value in iter_fields(data):
+        if field == 1:
+            info['version'] = [signed(v) for v in varints(wire, value)]
+        elif field == 2:
+            info['timestamp'] = delta(varints(wire, value))
+        elif field == 3:
+            info['changeset'] = delta(varints(wire, value))
+        elif field == 4:
+            info['uid'] = delta(varints(wire, value))
+        elif field == 5:
+            info['user_sid'] = delta(varints(wire, value))
+    return info
+
+
+def decode_entity(kind, data, strings, block):
+    '''解码一个 Node、Way 或 Relation 消息，返回 (类型, attrib, tags, 子元素)。'''
+
+    granularity, lat_offset, lon_offset, date_granularity = block
+    attrib = {}
+    keys = vals = ()
+    lat = lon = 0
+    refs = roles = memids = types = ()
+    info = None
+    for field, wire, value in iter_fields(data):
+        if field == 1:
+            attrib['id'] = str(zigzag(value) if kind == 'node' else signed(value))
+        elif field == 2:
+            keys = varints(wire, value)
+        elif field == 3:
+            vals = varints(wire, value)
+        elif field == 4:
+            info = decode_info(value, strings, date_granularity)
+        elif kind == 'node' and field == 8:
+            lat = zigzag(value)
+        elif kind == 'node' and field == 9:
+            lon = zigzag(value)
+        elif kind == 'way' and field == 8:
+            refs = delta(varints(wire, value))
+        elif kind == 'relation' and field == 8:
+            roles = [signed(v) for v in varints(wire, value)]
+        elif kind == 'relation' and field == 9:
+            memids = delta(varints(wire, value))
+        elif kind == 'relation' and field == 10:
+            types = varints(wire, value)
+
+    if kind == 'node':
+        attrib['lat'] = format_coord(lat_offset + granularity * lat)
+        attrib['lon'] = format_coord(lon_offset + granularity * lon)
+    attrib.update(info if info is not None else MISSING_INFO)
+    tags = decode_tags(keys, vals, strings)
+
+    if kind == 'way':
+        children = [str(ref) for ref in refs]
+    elif kind == 'relation':
+        children = [(MEMBER_TYPES[t], str(ref), strings[role])
+                    for t, ref, role in zip(types, memids, roles)]
+    else:
+        children = None
+    return kind, attrib, tags, children
+
+
+def decode_block(data):
+    """Decode a PrimitiveBlock into element records in file order
+
+    A record is (tag, attrib, [(k, v), ...], children) where children are
+    node refs for ways and (type, ref, role) for relation members.
+    """
+
+    strings = []
+    groups = []
+    granularity, lat_offset, lon_offset, date_granularity = 100, 0, 0, 1000
+    for field, wire, value in iter_fields(data):
+        if field == 1:
+            strings = [to_str(s) for f, w, s in iter_fields(value) if f == 1]
+        elif field == 2:
+            groups.append(value)
+        elif field == 17:
+            granularity = signed(value)
+        elif field == 18:
+            date_granularity = signed(value)
+        elif field == 19:
+            lat_offset = signed(value)
+        elif field == 20:
+            lon_offset = signed(value)
+    block = (granularity, lat_offset, lon_offset, date_granularity)
+
+    records = []
+    for group in groups:
+        for field, wire, value in iter_fields(group):
+            if field == 1:
+                records.append(decode_entity('node', value, strings, block))
+            elif field == 2:
+                records.extend(decode_dense(value, strings, block))
+            elif field == 3:
+                records.append(decode_entity('way', value, strings, block))
+            elif field == 4:
+                records.append(decode_entity('relation', value, strings, block))
+    return records
+
+
+def decode_blob(args):
+    '''解码一个数据块（在进程池中运行），OSMHeader 块只做检查。'''
+
+    blob_type, blob = args
+    data = blob_data(blob)
+    if blob_type == 'OSMHeader':
+        check_header(data)
+        return []
+    if blob_type == 'OSMData':
+        return decode_block(data)
+    return []   # 规范要求忽略不认识的块
+
+
+def make_element(record):
+    '''把解码得到的记录组装成与 iterparse 结果结构相同的 Element。'''
+
+    tag, attrib, tags, children = record
+    element = ET.Element(tag, attrib)
+    SubElement = ET.SubElement
+    if tag == 'way':
+        for ref in children:
+            SubElement(element, 'nd', {'ref': ref})
+    elif tag == 'relation':
+        for member_type, ref, role in children:
+            SubElement(element, 'member', {'type': member_type, 'ref': ref, 'role': role})
+    for k, v in tags:
+        SubElement(element, 'tag', {'k': k, 'v': v})
+    return element
+
+
+def decode_ahead(pool, blobs, window):
+    '''在进程池中解码 blobs，按顺序返回结果；同时提交的 blob 不超过 window 个。
+
+    pool.imap 会一次读完所有的 blob，解码结果在主进程中越积越多，所以这里自己控制提交的数量。'''
+
+    pending = collections.deque()
+    for blob in blobs:
+        pending.append(pool.apply_async(decode_blob, (blob,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def get_element(pbf_file, tags=MEMBER_TYPES, workers=1):
+    """Yield an Element for each node, way and relation of a PBF file
+
+    With workers > 1 the blobs are decoded in a process pool; elements are
+    still yielded in file order. At most 2 * workers blobs are read ahead,
+    so memory does not grow with the size of the file.
+    """
+
+    blobs = read_blobs(pbf_file)
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        blocks = decode_ahead(pool, blobs, 2 * workers)
+    else:
+        pool = None
+        blocks = map(decode_blob, blobs)
+    try:
+        for records in blocks:
+            for record in records:
+                if record[0] in tags:
+                    yield make_element(record)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+# ================================================== #
+#               Encoding                             #
+# ================================================== #
+
+def encode_varint(n):
+    if n < 0:
+        n += 1 << 64
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def encode_zigzag(n):
+    return (n << 1) if n >= 0 else ((-n) << 1) - 1
+
+
+def field_varint(field, n):
+    return encode_varint(field << 3) + encode_varint(n)
+
+
+def field_bytes(field, data):
+    return encode_varint(field << 3 | 2) + encode_varint(len(data)) + data
+
+
+def field_packed(field, values):
+    return field_bytes(field, b''.join(encode_varint(v) for v in values)) if values else b''
+
+
+def field_delta(field, values):
+    '''差分 + zigzag 编码的 packed sint 字段。'''
+
+    previous = 0
+    encoded = []
+    for v in values:
+        encoded.append(encode_zigzag(v - previous))
+        previous = v
+    return field_packed(field, encoded)
+
+
+class StringTable(object):
+    def __init__(self):
+        self.index = {'': 0}   # 编号0保留给空字符串（dense nodes 中作为分隔符）
+
+    def __call__(self, s):
+        i = self.index.get(s)
+        if i is None:
+            i = self.index[s] = len(self.index)
+        return i
+
+    def encode(self):
+        return b''.join(field_bytes(1, s.encode('utf-8')) for s in self.index)
+
+
+def parse_timestamp(timestamp):
+    import calendar
+    return calendar.timegm(time.strptime(timestamp, '%Y-%m-%dT%H:%M:%SZ'))
+
+
+def encode_info(attrib, strings):
+    return (field_varint(1, int(attrib['version'])) +
+            field_varint(2, parse_timestamp(attrib['timestamp'])) +
+            field_varint(3, int(attrib['changeset'])) +
+            field_varint(4, int(attrib['uid'])) +
+            field_varint(5, strings(attrib['user'])))
+
+
+def encode_block(elements):
+    '''把同一类型的一批元素编码成 PrimitiveBlock（节点用 DenseNodes）。'''
+
+    strings = StringTable()
+    kind = elements[0].tag
+    if kind == 'node':
+        nano = lambda value: int(round(float(value) * 10 ** 7))   # granularity 100
+        keys_vals = []
+        for element in elements:
+            for tag in element.iter('tag'):
+                keys_vals.append(strings(tag.attrib['k']))
+                keys_vals.append(strings(tag.attrib['v']))
+            keys_vals.append(0)
+        dense_info = (
+            field_packed(1, [int(e.attrib['version']) for e in elements]) +
+            field_delta(2, [parse_timestamp(e.attrib['timestamp']) for e in elements]) +
+            field_delta(3, [int(e.attrib['changeset']) for e in elements]) +
+            field_delta(4, [int(e.attrib['uid']) for e in elements]) +
+            field_delta(5, [strings(e.attrib['user']) for e in elements]))
+        dense = (field_delta(1, [int(e.attrib['id']) for e in elements]) +
+                 field_bytes(5, dense_info) +
+                 field_delta(8, [nano(e.attrib['lat']) for e in elements]) +
+                 field_delta(9, [nano(e.attrib['lon']) for e in elements]) +
+                 (field_packed(10, keys_vals) if any(keys_vals) else b''))
+        group = field_bytes(2, dense)
+    else:
+        entities = []
+        for element in elements:
+            tags = [(strings(t.attrib['k']), strings(t.attrib['v'])) for t in element.iter('tag')]
+            message = (field_varint(1, int(element.attrib['id'])) +
+                       field_packed(2, [k for k, v in tags]) +
+                       field_packed(3, [v for k, v in tags]) +
+                       field_bytes(4, encode_info(element.attrib, strings)))
+            if kind == 'way':
+                message += field_delta(8, [int(nd.attrib['ref']) for nd in element.iter('nd')])
+            else:
+                members = list(element.iter('member'))
+                message += (field_packed(8, [strings(m.attrib['role']) for m in members]) +
+                            field_delta(9, [int(m.attrib['ref']) for m in members]) +
+                            field_packed(10, [MEMBER_TYPES.index(m.attrib['type'])
+                                              for m in members]))
+            entities.append(field_bytes(3 if kind == 'way' else 4, message))
+        group = b''.join(entities)
+
+    return field_bytes(1, strings.encode()) + field_bytes(2, group)
+
+
+def write_blob(f, blob_type, data):
+    blob = field_varint(2, len(data)) + field_bytes(3, zlib.compress(data))
+    header = field_bytes(1, blob_type.encode('utf-8')) + field_varint(3, len(blob))
+    f.write(struct.pack('>I', len(header)))
+    f.write(header)
+    f.write(blob)
+
+
+def write_pbf(osm_file, pbf_file, block_size=BLOCK_SIZE):
+    """Convert an OSM XML file to PBF with dense nodes and zlib blobs
+
+    Return the number of elements written.
+    """
+
+    import osm2csv
+
+    count = 0
+    with open(pbf_file, 'wb') as f:
+        header = (field_bytes(4, b'OsmSchema-V0.6') + field_bytes(4, b'DenseNodes') +
+                  field_bytes(16, b'osm2csv pbf.py'))
+        write_blob(f, 'OSMHeader', header)
+
+        batch = []
+        for element in osm2csv.get_element(osm_file, tags=MEMBER_TYPES):
+            if batch and (batch[0].tag != element.tag or len(batch) >= block_size):
+                write_blob(f, 'OSMData', encode_block(batch))
+                batch = []
+            batch.append(element)
+            count += 1
+        if batch:
+            write_blob(f, 'OSMData', encode_block(batch))
+    return count
+
+
+# ================================================== #
+#               Comparison                           #
+# ================================================== #
+
+def read_csv_rows(path):
+    with open(path, encoding='utf-8') as f:
+        rows = list(csv.reader(f))
+    if os.path.basename(path) == 'nodes.csv':
+        # 坐标按数值比较，XML 中的小数位数可能与 PBF 的七位小数不同
+        for row in rows[1:]:
+            row[1] = round(float(row[1]), 7)
+            row[2] = round(float(row[2]), 7)
+    return rows
+
+
+def compare(osm_file, pbf_file=None, workers=1):
+    """Convert osm_file and its PBF version with osm2csv and compare every csv
+
+    Without pbf_file a PBF is written from osm_file first. Return
+    {csv name: number of differing rows}; all zeros means the PBF path
+    produced the same tables as the XML path.
+    """
+
+    import osm2csv
+
+    osm_file = os.path.abspath(osm_file)
+    cwd = os.getcwd()
+    tmp_dir = tempfile.mkdtemp(prefix='pbf_')
+    try:
+        if pbf_file is None:
+            pbf_file = os.path.join(tmp_dir, 'input.osm.pbf')
+            write_pbf(osm_file, pbf_file)
+        pbf_file = os.path.abspath(pbf_file)
+
+        for name, source, source_workers in (('xml', osm_file, 1), ('pbf', pbf_file, workers)):
+            os.mkdir(os.path.join(tmp_dir, name))
+            os.chdir(os.path.join(tmp_dir, name))
+            start = time.perf_counter()
+            osm2csv.process_map(source, validate=False, workers=source_workers)
+            print('%s: converted in %.2fs' % (name, time.perf_counter() - start))
+            os.chdir(cwd)
+
+        differences = {}
+        for path in osm2csv.OUTPUT_PATHS:
+            xml_rows = read_csv_rows(os.path.join(tmp_dir, 'xml', path))
+            pbf_rows = read_csv_rows(os.path.join(tmp_dir, 'pbf', path))
+            differences[path] = (sum(a != b for a, b in zip(xml_rows, pbf_rows))
+                                 + abs(len(xml_rows) - len(pbf_rows)))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return differences
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Write OSM XML as PBF, or compare the XML '
+                                                 'and PBF conversions.')
+    parser.add_argument('osm_file')
+    parser.add_argument('--to-pbf', metavar='PBF', help='write osm_file as PBF')
+    parser.add_argument('--compare', metavar='PBF', nargs='?', const='',
+                        help='compare the csv(s) converted from osm_file and from PBF '
+                             '(written from osm_file when not given)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes decoding PBF blobs')
+    args = parser.parse_args()
+
+    if args.to_pbf:
+        print('%d elements written to %s' % (write_pbf(args.osm_file, args.to_pbf), args.to_pbf))
+    if args.compare is not None:
+        differences = compare(args.osm_file, args.compare or None, args.workers)
+        for path, count in differences.items():
+            print('%-22s %s' % (path, 'same' if count == 0 else '%d rows differ' % count))
+        if any(differences.values()):
+            raise SystemExit(1)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# 后台写出线程：每个输出文件一个写线程，解析和清洗的主循环把成批的行格式化成 csv 文本后
+# 放进有界队列，编码和文件写入在写线程中进行（写文件时释放 GIL），
+# 慢速磁盘或网络文件系统的写入延迟不再阻塞解析。
+# csv 格式化仍在主线程中做：它需要持有 GIL，放到写线程里只会和解析争抢 GIL。
+# 队列满时 put 会阻塞主循环（背压），所以内存中最多有 queue_size 批未写出的数据。
+
+import csv
+import io
+import queue
+import threading
+
+import compressed
+
+
+BATCH_SIZE = 5000        # 每批的行数
+QUEUE_SIZE = 16          # 每个队列最多缓存的批数
+BUFFER_SIZE = 1 << 20    # 输出文件的缓冲区大小（字节）
+
+
+class ThreadedWriter(object):
+    '''与 csv.writer / csv.DictWriter 用法相同的写入器，数据在后台线程中写出。
+
+    dict_rows 为 True 时行是字典（按 fields 的顺序写出），否则是按字段顺序排列的元组。
+    append 为 True 时追加到已有的文件后面。
+    输出与直接用 csv.writer 写同一个文件完全相同。'''
+
+    def __init__(self, path, fields, dict_rows=False, batch_size=BATCH_SIZE,
+                 queue_size=QUEUE_SIZE, buffer_size=BUFFER_SIZE, append=False):
+        self.fields = fields
+        self.batch_size = batch_size
+        self.rows = 0
+        self.text = io.StringIO(newline='')   # 与 open() 的默认换行处理一致（Linux 上原样写出）
+        if dict_rows:
+            self.writer = csv.DictWriter(self.text, fields)
+        else:
+            self.writer = csv.writer(self.text)
+        self.error = None
+        self.queue = queue.Queue(maxsize=queue_size)
+        # 压缩输出时压缩也在写线程中进行（压缩模块在压缩时释放 GIL）
+        self.file = compressed.open_output(path, text=False, buffer_size=buffer_size,
+                                           append=append)
+        self.thread = threading.Thread(target=self.run, name='writer-%s' % path, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                return
+            if self.error is None:
+                try:
+                    self.file.write(chunk.encode('utf-8'))
+                except Exception as e:
+                    # 出错后继续取出队列中的数据（不再写出），避免主线程在 put 时永远阻塞
+                    self.error = e
+
+    def put(self):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(self.text.getvalue())   # 队列满时阻塞，形成背压
+        self.text.seek(0)
+        self.text.truncate()
+        self.rows = 0
+
+    def writeheader(self):
+        if isinstance(self.writer, csv.DictWriter):
+            self.writer.writeheader()
+        else:
+            self.writer.writerow(self.fields)
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+        self.rows += 1
+        if self.rows >= self.batch_size:
+            self.put()
+
+    def writerows(self, rows):
+        self.writer.writerows(rows)
+        self.rows += len(rows)
+        if self.rows >= self.batch_size:
+            self.put()
+
+    def close(self):
+        '''写出剩余的数据，等待写线程结束并关闭文件；写线程出错时在这里抛出。'''
+
+        if self.thread is None:
+            return
+        try:
+            if self.text.tell() and self.error is None:
+                self.queue.put(self.text.getvalue())
+        finally:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+            self.file.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
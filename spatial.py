@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# 节点经纬度的空间索引：SQLite 中的 R-tree 虚拟表，以及供 Python 调用的内存网格索引。
+# 提供矩形范围计数、矩形范围查询、半径查询和网格直方图。
+# 用法：python spatial.py openstreet.sqlite  （与原来全表扫描的查询做性能比较）
+
+import argparse
+import array
+import bisect
+import csv
+import math
+import sqlite3
+import time
+
+import osm2csv
+
+
+EARTH_RADIUS = 6371008.8   # 地球平均半径，单位米
+
+# R-tree 中存的是32位浮点数，边界会向外取整，所以查询时还要与 nodes 表中的精确坐标比较
+RTREE_TABLE = ('CREATE VIRTUAL TABLE IF NOT EXISTS nodes_rtree '
+               'USING rtree(id, min_lat, max_lat, min_lon, max_lon)')
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    '''返回两点之间的球面距离（米）。'''
+
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_bbox(lat, lon, radius):
+    '''返回以 (lat, lon) 为中心、半径为 radius 米的圆的外接矩形 (min_lat, min_lon, max_lat, max_lon)。'''
+
+    dlat = math.degrees(radius / EARTH_RADIUS)
+    coslat = math.cos(math.radians(lat))
+    if coslat < 1e-12:
+        dlon = 180.0
+    else:
+        dlon = min(180.0, math.degrees(radius / (EARTH_RADIUS * coslat)))
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+
+# ----------- SQLite R-tree ----------
+
+def create_rtree(conn):
+    '''建立并填充节点的 R-tree 表，在数据导入完成后调用。'''
+
+    conn.execute('DROP TABLE IF EXISTS nodes_rtree')
+    conn.execute(RTREE_TABLE)
+    conn.execute('INSERT INTO nodes_rtree SELECT id, lat, lat, lon, lon FROM nodes')
+
+
+RTREE_BBOX = '''FROM nodes_rtree JOIN nodes ON nodes.id = nodes_rtree.id
+WHERE nodes_rtree.max_lat >= ? AND nodes_rtree.min_lat <= ?
+AND nodes_rtree.max_lon >= ? AND nodes_rtree.min_lon <= ?
+AND nodes.lat BETWEEN ? AND ? AND nodes.lon BETWEEN ? AND ?'''
+
+
+def bbox_count(conn, min_lat, min_lon, max_lat, max_lon):
+    '''返回矩形范围内（含边界）的节点数。'''
+
+    query = 'SELECT COUNT(*) ' + RTREE_BBOX
+    args = (min_lat, max_lat, min_lon, max_lon, min_lat, max_lat, min_lon, max_lon)
+    return conn.execute(query, args).fetchone()[0]
+
+
+def bbox_nodes(conn, min_lat, min_lon, max_lat, max_lon):
+    '''返回矩形范围内（含边界）节点的 (id, lat, lon) 列表。'''
+
+    query = 'SELECT nodes.id, nodes.lat, nodes.lon ' + RTREE_BBOX
+    args = (min_lat, max_lat, min_lon, max_lon, min_lat, max_lat, min_lon, max_lon)
+    return conn.execute(query, args).fetchall()
+
+
+def radius_nodes(conn, lat, lon, radius):
+    '''返回距离 (lat, lon) 不超过 radius 米的节点的 (id, lat, lon, 距离) 列表，按距离排序。'''
+
+    result = []
+    for node_id, nlat, nlon in bbox_nodes(conn, *radius_bbox(lat, lon, radius)):
+        d = haversine(lat, lon, nlat, nlon)
+        if d <= radius:
+            result.append((node_id, nlat, nlon, d))
+    result.sort(key=lambda x: x[3])
+    return result
+
+
+def grid_histogram(conn, cell_size, bbox=None):
+    '''按 cell_size 度的网格统计节点数，返回 {(行, 列): 节点数}，行列从 (-90, -180) 起算。
+
+    指定 bbox 时只统计该矩形范围内的节点。'''
+
+    if bbox is None:
+        query = ('SELECT CAST((lat + 90) / ? AS INTEGER), CAST((lon + 180) / ? AS INTEGER), '
+                 'COUNT(*) FROM nodes GROUP BY 1, 2')
+        rows = conn.execute(query, (cell_size, cell_size))
+    else:
+        min_lat, min_lon, max_lat, max_lon = bbox
+        query = ('SELECT CAST((nodes.lat + 90) / ? AS INTEGER), '
+                 'CAST((nodes.lon + 180) / ? AS INTEGER), COUNT(*) ' + RTREE_BBOX + ' GROUP BY 1, 2')
+        rows = conn.execute(query, (cell_size, cell_size, min_lat, max_lat, min_lon, max_lon,
+                                    min_lat, max_lat, min_lon, max_lon))
+    return {(row, col): count for row, col, count in rows}
+
+
+# ----------- 内存网格索引 ----------
+
+class GridIndex(object):
+    '''节点的内存网格索引。
+
+    节点按所在网格排序后存放在紧凑的数组中，每个网格只记录它在数组中的起止位置。'''
+
+    def __init__(self, points, cell_size=0.01):
+        '''points 是 (id, lat, lon) 的可迭代对象，cell_size 是网格边长（度）。'''
+
+        self.cell_size = cell_size
+        cell = self.cell
+        items = sorted((cell(lat, lon), node_id, lat, lon) for node_id, lat, lon in points)
+
+        self.ids = array.array('q', (item[1] for item in items))
+        self.lats = array.array('d', (item[2] for item in items))
+        self.lons = array.array('d', (item[3] for item in items))
+
+        # 网格 -> (起始位置, 结束位置)；rows 记录有节点的行，便于按行范围查找
+        self.cells = {}
+        for i, item in enumerate(items):
+            start, end = self.cells.get(item[0], (i, i))
+            self.cells[item[0]] = (start, i + 1)
+        self.columns = {}
+        for row, col in self.cells:
+            self.columns.setdefault(row, []).append(col)
+        for cols in self.columns.values():
+            cols.sort()
+        self.rows = sorted(self.columns)
+
+    @classmethod
+    def from_csv(cls, path=osm2csv.NODES_PATH, cell_size=0.01):
+        '''从 osm2csv 输出的 nodes.csv 建立索引。'''
+
+        with open(path, encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            return cls(((int(r['id']), float(r['lat']), float(r['lon'])) for r in reader),
+                       cell_size)
+
+    @classmethod
+    def from_db(cls, conn, cell_size=0.01):
+        '''从数据库的 nodes 表建立索引。'''
+
+        return cls(conn.execute('SELECT id, lat, lon FROM nodes'), cell_size)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def cell(self, lat, lon):
+        return int(math.floor((lat + 90) / self.cell_size)), \
+               int(math.floor((lon + 180) / self.cell_size))
+
+    def _cells(self, min_lat, min_lon, max_lat, max_lon):
+        '''生成与矩形相交的非空网格，以及该网格是否完全在矩形内。'''
+
+        row0, col0 = self.cell(min_lat, min_lon)
+        row1, col1 = self.cell(max_lat, max_lon)
+        size = self.cell_size
+        for row in self.rows[bisect.bisect_left(self.rows, row0):
+                             bisect.bisect_right(self.rows, row1)]:
+            cols = self.columns[row]
+            inner_row = row0 < row < row1
+            for col in cols[bisect.bisect_left(cols, col0):bisect.bisect_right(cols, col1)]:
+                # 网格严格在矩形内部时不需要逐点比较（边界的浮点误差只出现在首尾行列）
+                inside = inner_row and col0 < col < col1
+                yield self.cells[(row, col)], inside
+
+    def _bbox_positions(self, min_lat, min_lon, max_lat, max_lon):
+        lats = self.lats
+        lons = self.lons
+        for (start, end), inside in self._cells(min_lat, min_lon, max_lat, max_lon):
+            if inside:
+                yield from range(start, end)
+            else:
+                for i in range(start, end):
+                    if min_lat <= lats[i] <= max_lat and min_lon <= lons[i] <= max_lon:
+                        yield i
+
+    def bbox_count(self, min_lat, min_lon, max_lat, max_lon):
+        '''返回矩形范围内（含边界）的节点数。'''
+
+        count = 0
+        lats = self.lats
+        lons = self.lons
+        for (start, end), inside in self._cells(min_lat, min_lon, max_lat, max_lon):
+            if inside:
+                count += end - start
+            else:
+                for i in range(start, end):
+                    if min_lat <= lats[i] <= max_lat and min_lon <= lons[i] <= max_lon:
+                        count += 1
+        return count
+
+    def bbox_nodes(self, min_lat, min_lon, max_lat, max_lon):
+        '''返回矩形范围内（含边界）节点的 (id, lat, lon) 列表。'''
+
+        return [(self.ids[i], self.lats[i], self.lons[i])
+                for i in self._bbox_positions(min_lat, min_lon, max_lat, max_lon)]
+
+    def radius_nodes(self, lat, lon, radius):
+        '''返回距离 (lat, lon) 不超过 radius 米的节点的 (id, lat, lon, 距离) 列表，按距离排序。'''
+
+        result = []
+        for i in self._bbox_positions(*radius_bbox(lat, lon, radius)):
+            d = haversine(lat, lon, self.lats[i], self.lons[i])
+            if d <= radius:
+                result.append((self.ids[i], self.lats[i], self.lons[i], d))
+        result.sort(key=lambda x: x[3])
+        return result
+
+    def histogram(self, bbox=None):
+        '''返回每个网格中的节点数 {(行, 列): 节点数}，与 grid_histogram 使用同样的行列编号。
+
+        指定 bbox 时只统计该矩形范围内的节点。'''
+
+        if bbox is None:
+            return {cell: end - start for cell, (start, end) in self.cells.items()}
+        hist = {}
+        for i in self._bbox_positions(*bbox):
+            cell = self.cell(self.lats[i], self.lons[i])
+            hist[cell] = hist.get(cell, 0) + 1
+        return hist
+
+
+# ----------- 性能比较 ----------
+
+# 报告中以北京市中心划分的四个区域
+CENTER = (39.905963, 116.391248)
+
+
+def best_time(func, repeat=3):
+    '''返回 func 多次运行的最短耗时（秒）和结果。'''
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def benchmark(conn, grid, repeat=3):
+    '''比较全表扫描、R-tree 和内存网格索引在矩形和半径查询上的耗时。'''
+
+    lat, lon = CENTER
+    min_lat, min_lon, max_lat, max_lon = conn.execute(
+        'SELECT MIN(lat), MIN(lon), MAX(lat), MAX(lon) FROM nodes').fetchone()
+    boxes = [
+        ('north east', (lat, lon, max_lat, max_lon)),
+        ('south west', (min_lat, min_lon, lat, lon)),
+        ('1km box', radius_bbox(lat, lon, 500)),
+        ('10km box', radius_bbox(lat, lon, 5000)),
+    ]
+    scan = 'SELECT COUNT(*) FROM nodes NOT INDEXED WHERE lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?'
+
+    print('%-12s %12s %12s %12s %10s' % ('query', 'scan ms', 'rtree ms', 'grid ms', 'nodes'))
+    for name, (a, b, c, d) in boxes:
+        t_scan, n_scan = best_time(lambda: conn.execute(scan, (a, c, b, d)).fetchone()[0], repeat)
+        t_rtree, n_rtree = best_time(lambda: bbox_count(conn, a, b, c, d), repeat)
+        t_grid, n_grid = best_time(lambda: grid.bbox_count(a, b, c, d), repeat)
+        assert n_scan == n_rtree == n_grid, (name, n_scan, n_rtree, n_grid)
+        print('%-12s %12.2f %12.2f %12.2f %10d'
+              % (name, t_scan * 1000, t_rtree * 1000, t_grid * 1000, n_scan))
+
+    for radius in (500, 5000):
+        scan_radius = lambda: sorted(
+            (haversine(lat, lon, y, x), i) for i, y, x in conn.execute(
+                'SELECT id, lat, lon FROM nodes NOT INDEXED')
+            if haversine(lat, lon, y, x) <= radius)
+        t_scan, n_scan = best_time(scan_radius, repeat)
+        t_rtree, n_rtree = best_time(lambda: radius_nodes(conn, lat, lon, radius), repeat)
+        t_grid, n_grid = best_time(lambda: grid.radius_nodes(lat, lon, radius), repeat)
+        assert len(n_scan) == len(n_rtree) == len(n_grid)
+        print('%-12s %12.2f %12.2f %12.2f %10d'
+              % ('%dm radius' % radius, t_scan * 1000, t_rtree * 1000, t_grid * 1000, len(n_scan)))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the node spatial indexes.')
+    parser.add_argument('db', nargs='?', default='openstreet.sqlite')
+    parser.add_argument('--cell-size', type=float, default=0.01, help='grid cell size in degrees')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    if conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name='nodes_rtree'").fetchone()[0] == 0:
+        create_rtree(conn)
+        conn.commit()
+    t_build, grid = best_time(lambda: GridIndex.from_db(conn, args.cell_size), 1)
+    print('grid index: %d nodes, %d cells, built in %.2f s' % (len(grid), len(grid.cells), t_build))
+    benchmark(conn, grid, args.repeat)
+    conn.close()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# 数据库表结构和索引，以及检查报告中SQL查询的执行计划和耗时的工具。
+# 用法：python sqlschema.py openstreet.sqlite [--create-indexes]
+
+import argparse
+import sqlite3
+import time
+
+
+# 节点和途径的 id 直接作为主键（即 SQLite 的 rowid），按 id 查找和去重都不需要额外的索引
+TABLES = {
+    'nodes': 'CREATE TABLE nodes (id INTEGER PRIMARY KEY, lat FLOAT, lon FLOAT, '
+             'user VARCHAR, uid INTEGER, version VARCHAR, changeset INTEGER, '
+             'timestamp VARCHAR)',
+    'nodes_tags': 'CREATE TABLE nodes_tags (id INTEGER, key VARCHAR, value VARCHAR, '
+                  'type VARCHAR)',
+    'ways': 'CREATE TABLE ways (id INTEGER PRIMARY KEY, user VARCHAR, uid INTEGER, '
+            'version VARCHAR, changeset INTEGER, timestamp VARCHAR)',
+    'ways_nodes': 'CREATE TABLE ways_nodes (id INTEGER, node_id INTEGER, position INTEGER)',
+    'ways_tags': 'CREATE TABLE ways_tags (id INTEGER, key VARCHAR, value VARCHAR, '
+                 'type VARCHAR)',
+    'relations': 'CREATE TABLE relations (id INTEGER PRIMARY KEY, user VARCHAR, uid INTEGER, '
+                 'version VARCHAR, changeset INTEGER, timestamp VARCHAR)',
+    'relation_members': 'CREATE TABLE relation_members (id INTEGER, member_id INTEGER, '
+                        'member_type VARCHAR, role VARCHAR, position INTEGER)',
+    'relation_tags': 'CREATE TABLE relation_tags (id INTEGER, key VARCHAR, value VARCHAR, '
+                     'type VARCHAR)',
+}
+
+# 字典编码的标签（见 tagdict.py）：标签表只存 key、value 的编号，字符串在两张查找表中各存一次
+ENCODED_TABLES = {
+    'tag_keys': 'CREATE TABLE tag_keys (id INTEGER PRIMARY KEY, key VARCHAR, type VARCHAR)',
+    'tag_values': 'CREATE TABLE tag_values (id INTEGER PRIMARY KEY, value VARCHAR)',
+    'nodes_tags': 'CREATE TABLE nodes_tags (id INTEGER, key_id INTEGER, value_id INTEGER)',
+    'ways_tags': 'CREATE TABLE ways_tags (id INTEGER, key_id INTEGER, value_id INTEGER)',
+    'relation_tags': 'CREATE TABLE relation_tags (id INTEGER, key_id INTEGER, value_id INTEGER)',
+}
+
+# 还原成原来的 (id, key, value, type) 的视图，e.g. nodes_tags_text
+ENCODED_VIEWS = {
+    '%s_text' % table: 'CREATE VIEW %s_text AS SELECT t.id, k.key, v.value, k.type FROM %s t '
+                       'JOIN tag_keys k ON k.id = t.key_id '
+                       'JOIN tag_values v ON v.id = t.value_id' % (table, table)
+    for table in ('nodes_tags', 'ways_tags', 'relation_tags')
+}
+
+# 报告中查询用到的索引
+INDEXES = [
+    # 按 id 关联节点、途径和它们的tag
+    'CREATE INDEX IF NOT EXISTS ways_nodes_id ON ways_nodes (id)',
+    # ways_nodes.node_id = nodes_tags.id 的关联
+    'CREATE INDEX IF NOT EXISTS ways_nodes_node_id ON ways_nodes (node_id, id)',
+    # 经纬度范围查询，id 是 rowid，所以这是覆盖索引
+    'CREATE INDEX IF NOT EXISTS nodes_lat_lon ON nodes (lat, lon)',
+    # 关系的成员和tag按关系 id 查找，反查某个途径属于哪些关系
+    'CREATE INDEX IF NOT EXISTS relation_members_id ON relation_members (id)',
+    'CREATE INDEX IF NOT EXISTS relation_members_member ON relation_members (member_type, member_id)',
+]
+
+# 标签表上的索引
+TAG_INDEXES = [
+    # key='tourism' AND value='hotel' 之类的过滤
+    'CREATE INDEX IF NOT EXISTS nodes_tags_key_value ON nodes_tags (key, value)',
+    'CREATE INDEX IF NOT EXISTS ways_tags_key_value ON ways_tags (key, value)',
+    # 只按 value 过滤的查询，e.g. value='traffic_signals'
+    'CREATE INDEX IF NOT EXISTS nodes_tags_value ON nodes_tags (value, id)',
+    'CREATE INDEX IF NOT EXISTS nodes_tags_id ON nodes_tags (id)',
+    'CREATE INDEX IF NOT EXISTS ways_tags_id ON ways_tags (id, key)',
+    'CREATE INDEX IF NOT EXISTS relation_tags_id ON relation_tags (id, key)',
+]
+
+# 字典编码时的同一组索引，比较的是整数编号
+ENCODED_TAG_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS nodes_tags_key_value ON nodes_tags (key_id, value_id)',
+    'CREATE INDEX IF NOT EXISTS ways_tags_key_value ON ways_tags (key_id, value_id)',
+    'CREATE INDEX IF NOT EXISTS nodes_tags_value ON nodes_tags (value_id, id)',
+    'CREATE INDEX IF NOT EXISTS nodes_tags_id ON nodes_tags (id)',
+    'CREATE INDEX IF NOT EXISTS ways_tags_id ON ways_tags (id, key_id)',
+    'CREATE INDEX IF NOT EXISTS relation_tags_id ON relation_tags (id, key_id)',
+    # 由字符串查编号
+    'CREATE UNIQUE INDEX IF NOT EXISTS tag_keys_key ON tag_keys (key, type)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS tag_values_value ON tag_values (value)',
+]
+
+# 报告中的查询：(名称, SQL, 是否必然要扫描整张表)
+# 统计整张表的查询（总数、去重、分组）无论如何都要读完所有行，只要求它们扫描的是索引
+REPORT_QUERIES = [
+    ('nodes count', 'SELECT COUNT(*) FROM nodes', True),
+    ('hotels', "SELECT COUNT(id) FROM nodes_tags WHERE key='tourism' AND value='hotel'", False),
+    ('ways count', 'SELECT COUNT(*) FROM ways', True),
+    ('viaducts', "SELECT count(id) FROM ways_tags WHERE key='bridge' AND value='viaduct'", False),
+    ('unique users', '''SELECT COUNT(DISTINCT uid)
+FROM (SELECT uid FROM nodes UNION ALL SELECT uid FROM ways)''', True),
+    ('top users', '''SELECT user, COUNT(user) AS num
+FROM (SELECT user FROM nodes UNION ALL SELECT user FROM ways)
+GROUP BY user
+ORDER BY num DESC
+LIMIT 10''', True),
+    ('signals per way', '''SELECT ways_nodes.id, COUNT(ways_nodes.id) AS sig_num
+FROM ways_nodes JOIN nodes_tags ON ways_nodes.node_id=nodes_tags.id
+WHERE nodes_tags.value='traffic_signals'
+GROUP BY ways_nodes.id
+ORDER BY sig_num DESC
+LIMIT 10''', False),
+    ('signals per way with names', '''SELECT ways_tags.id, ways_tags.value, e.sig_num
+FROM ways_tags JOIN
+(SELECT ways_nodes.id, COUNT(ways_nodes.id) AS sig_num
+FROM ways_nodes JOIN nodes_tags ON ways_nodes.node_id=nodes_tags.id
+WHERE nodes_tags.value='traffic_signals'
+GROUP BY ways_nodes.id
+ORDER BY sig_num DESC
+LIMIT 10) e
+ON ways_tags.id=e.id
+WHERE ways_tags.key='name'
+ORDER BY e.sig_num DESC''', False),
+    ('distinct nodes', 'SELECT COUNT(DISTINCT id) FROM nodes', True),
+    ('distinct tagged nodes', 'SELECT COUNT(DISTINCT id) FROM nodes_tags', True),
+    ('beijing id', "SELECT * FROM nodes_tags WHERE key='name' AND value='北京市'", False),
+    ('beijing node', 'SELECT * FROM nodes WHERE id=25248662', False),
+    ('north east', 'SELECT COUNT(DISTINCT id) FROM nodes WHERE lat>39.905963 AND lon>116.391248', False),
+    ('north west', 'SELECT COUNT(DISTINCT id) FROM nodes WHERE lat>39.905963 AND lon<116.391248', False),
+    ('south east', 'SELECT COUNT(DISTINCT id) FROM nodes WHERE lat<39.905963 AND lon>116.391248', False),
+    ('south west', 'SELECT COUNT(DISTINCT id) FROM nodes WHERE lat<39.905963 AND lon<116.391248', False),
+]
+
+# 字典编码的数据库（见 tagdict.py）上的同一组查询：value 先由查找表得到编号，
+# key 与 tag_keys 连接（同一个 key 可能有几种 type），标签表上比较的是整数编号
+VALUE_ID = "(SELECT id FROM tag_values WHERE value='%s')"
+ENCODED_QUERIES = {
+    'hotels': '''SELECT COUNT(t.id) FROM tag_keys k JOIN nodes_tags t ON t.key_id=k.id
+WHERE k.key='tourism' AND t.value_id=%s''' % (VALUE_ID % 'hotel'),
+    'viaducts': '''SELECT count(t.id) FROM tag_keys k JOIN ways_tags t ON t.key_id=k.id
+WHERE k.key='bridge' AND t.value_id=%s''' % (VALUE_ID % 'viaduct'),
+    'signals per way': '''SELECT ways_nodes.id, COUNT(ways_nodes.id) AS sig_num
+FROM ways_nodes JOIN nodes_tags ON ways_nodes.node_id=nodes_tags.id
+WHERE nodes_tags.value_id=%s
+GROUP BY ways_nodes.id
+ORDER BY sig_num DESC
+LIMIT 10''' % (VALUE_ID % 'traffic_signals'),
+    'signals per way with names': '''SELECT ways_tags.id, tag_values.value, e.sig_num
+FROM ways_tags JOIN
+(SELECT ways_nodes.id, COUNT(ways_nodes.id) AS sig_num
+FROM ways_nodes JOIN nodes_tags ON ways_nodes.node_id=nodes_tags.id
+WHERE nodes_tags.value_id=%s
+GROUP BY ways_nodes.id
+ORDER BY sig_num DESC
+LIMIT 10) e
+ON ways_tags.id=e.id
+JOIN tag_keys ON tag_keys.id=ways_tags.key_id
+JOIN tag_values ON tag_values.id=ways_tags.value_id
+WHERE tag_keys.key='name'
+ORDER BY e.sig_num DESC''' % (VALUE_ID % 'traffic_signals'),
+    'beijing id': '''SELECT t.id, k.key, v.value, k.type
+FROM tag_keys k JOIN nodes_tags t ON t.key_id=k.id JOIN tag_values v ON v.id=t.value_id
+WHERE k.key='name' AND t.value_id=%s''' % (VALUE_ID % '北京市'),
+}
+ENCODED_REPORT_QUERIES = [(name, ENCODED_QUERIES.get(name, query), scan_expected)
+                          for name, query, scan_expected in REPORT_QUERIES]
+
+
+def create_tables(conn, drop=True, encoded=False):
+    """Create the tables, dropping existing ones first when drop is True
+
+    With encoded=True the tag tables hold key and value ids, with the
+    tag_keys and tag_values lookup tables and *_tags_text views.
+    """
+
+    if drop:
+        for view in ENCODED_VIEWS:
+            conn.execute('DROP VIEW IF EXISTS %s' % view)
+        for table in list(TABLES) + [t for t in ENCODED_TABLES if t not in TABLES]:
+            conn.execute('DROP TABLE IF EXISTS %s' % table)
+    tables = dict(TABLES, **ENCODED_TABLES) if encoded else TABLES
+    for create in tables.values():
+        conn.execute(create)
+    if encoded:
+        for create in ENCODED_VIEWS.values():
+            conn.execute(create)
+
+
+def is_encoded(conn):
+    """Return True if the tag tables hold dictionary encoded key and value ids"""
+
+    return any(row[1] == 'key_id' for row in conn.execute('PRAGMA table_info(nodes_tags)'))
+
+
+def table_exists(conn, table):
+    """Return True if the database has the table"""
+
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+                        (table,)).fetchone() is not None
+
+
+def is_rowid(conn, table, column='id'):
+    """Return True if column is the INTEGER PRIMARY KEY of table"""
+
+    for cid, name, ctype, notnull, default, pk in conn.execute('PRAGMA table_info(%s)' % table):
+        if name == column:
+            return pk == 1 and ctype.upper() == 'INTEGER'
+    return False
+
+
+def create_indexes(conn):
+    """Create the report indexes, also on databases built by the notebook
+
+    Tables created by the notebook have an autoincrement "index" primary key,
+    so nodes.id and ways.id get a unique index there instead. The notebook
+    doesn't write the relation tables, their indexes are skipped then.
+    """
+
+    for index in INDEXES + (ENCODED_TAG_INDEXES if is_encoded(conn) else TAG_INDEXES):
+        table = index.split(' ON ')[1].split()[0]
+        if table.startswith('relation_') and not table_exists(conn, table):
+            continue
+        conn.execute(index)
+    for table in ('nodes', 'ways'):
+        if not is_rowid(conn, table):
+            conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS %s_id ON %s (id)' % (table, table))
+    conn.execute('ANALYZE')
+
+
+def explain(conn, query):
+    """Return the EXPLAIN QUERY PLAN lines of query"""
+
+    return [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + query)]
+
+
+def full_scans(plan):
+    """Return the plan lines that read a whole table without an index"""
+
+    # 子查询的结果（e.g. SCAN e）和使用索引的扫描都不算
+    return [line for line in plan
+            if line.startswith('SCAN ') and
+            (line.split()[1] in TABLES or line.split()[1] in ENCODED_TABLES)
+            and 'INDEX' not in line]
+
+
+def report_queries(conn):
+    """Return the report queries for the tag tables of conn (encoded or not)"""
+
+    return ENCODED_REPORT_QUERIES if is_encoded(conn) else REPORT_QUERIES
+
+
+def run_report(conn, queries=None, repeat=3):
+    """Run each report query with its query plan and best-of-repeat timing
+
+    queries defaults to report_queries(conn).
+    """
+
+    if queries is None:
+        queries = report_queries(conn)
+    results = []
+    for name, query, scan_expected in queries:
+        plan = explain(conn, query)
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows = conn.execute(query).fetchall()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results.append({'name': name,
+                        'plan': plan,
+                        'seconds': best,
+                        'rows': len(rows),
+                        'full_scans': full_scans(plan),
+                        'scan_expected': scan_expected})
+    return results
+
+
+def print_report(results):
+    """Print the query plans and flag the queries that unexpectedly scan"""
+
+    for result in results:
+        flag = ''
+        if result['full_scans'] and not result['scan_expected']:
+            flag = '  <-- FULL SCAN'
+        print('%-28s %9.2f ms%s' % (result['name'], result['seconds'] * 1000, flag))
+        for line in result['plan']:
+            print('    ' + line)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Explain and time the report queries.')
+    parser.add_argument('db', nargs='?', default='openstreet.sqlite')
+    parser.add_argument('--create-indexes', action='store_true',
+                        help='create the report indexes before running the queries')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    if args.create_indexes:
+        create_indexes(conn)
+        conn.commit()
+    results = run_report(conn, repeat=args.repeat)
+    print_report(results)
+    conn.close()
+
+    if any(r['full_scans'] and not r['scan_expected'] for r in results):
+        raise SystemExit(1)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# 可重复的合成 osm 数据：按给定的节点数、途径数和带tag节点的比例生成 osm XML，
+# 电话、邮编、营业时间、门牌号按格式模板随机生成，混合了标准格式和 clean.py 要处理的各种脏数据。
+# 相同的参数和随机种子总是生成完全相同的文件，用于基准测试。
+# 用法：python synthosm.py synthetic.osm --nodes 100000 --seed 1
+
+import argparse
+import random
+import re
+from xml.sax.saxutils import quoteattr
+
+
+# 北京范围内的坐标
+BOUNDS = (39.4, 115.4, 41.1, 117.5)
+
+# 有清洗规则的值（电话、邮编、营业时间、门牌号）按格式模板随机生成，每个值的号码、时间都不同，
+# 不同取值的比例接近真实数据，清洗缓存不会让基准测试只测到字典查找。
+# 模板中的 {字段} 由 FIELDS 中的函数填充；'standard' 是 clean.py 原样保留的标准格式，
+# 'dirty' 是要清洗的各种写法（包括不能标准化的），由 dirty 参数决定它们所占的比例，
+# 同一类中按权重抽取，权重大致按北京数据中的比例设置。
+DIRTY = 0.4
+
+PHONE_FORMATS = {
+    'standard': [
+        ('+86 10 {landline}', 30),
+        ('+86 {mobile}', 10),
+        ('+86 400{d7}', 2),
+    ],
+    'dirty': [
+        ('(010){landline}', 8),
+        ('010-{landline}', 8),
+        ('+86-10-{landline}', 6),
+        ('8610 {d4} {d4}', 4),
+        ('{mobile}', 6),
+        ('0086 {mobile}', 2),
+        ('400{d7}', 2),
+        ('+86 400 {d3} {d4}', 2),
+        ('010-{landline}/010-{landline}', 3),   # 多个号码
+        ('{landline};{mobile}', 2),
+        ('010-{landline}；{mobile}', 1),
+        ('{d5}', 2),                            # 无法标准化
+        ('电话', 1),
+    ],
+}
+
+POSTCODE_FORMATS = {
+    'standard': [
+        ('10{district}{d3}', 1),
+    ],
+    'dirty': [
+        ('{d4}', 3),
+        ('{other_postcode}', 2),
+        ('10{district} {d3}', 1),
+    ],
+}
+
+HOUR_FORMATS = {
+    'standard': [
+        ('{days} {open}-{close}', 25),
+        ('{days} {open}-{noon};{weekend} {open}-{close}', 5),
+        ('24/7', 5),
+    ],
+    'dirty': [
+        ('{days} {open}-{noon},{afternoon}-{close}', 6),   # clean.py 不支持，清洗成空字符串
+        ('24小时', 3),
+        ('24h', 2),
+        ('{open_h}am - {close_h12}pm', 3),
+        ('{open_h}:{minute} - {close_h}:{minute}', 4),
+        ('{open_h}:{minute}~{close_h}:{minute}', 3),
+        ('{open_h}.{minute}-{close_h}.{minute}', 2),
+        ('{open_h}：{minute}-{close_h}：{minute}', 2),
+        ('{open_h}: {minute}-{close_h}: {minute}', 1),
+        ('{long_days} {open}-{close}', 3),
+        ('{open}-{noon} am', 1),
+        ('{months}: {days} {open}-{close}', 1),
+        ('sunrise-sunset', 2),
+        ('营业中', 1),
+    ],
+}
+
+HOUSE_NUMBER_FORMATS = {
+    'standard': [
+        ('{number}', 40),
+        ('{number}号', 20),
+        ('甲{number}号', 10),
+        ('{number}-{small}', 5),
+    ],
+    'dirty': [
+        ('{letter}', 3),
+        ('东', 2),
+    ],
+}
+
+MOBILE_PREFIXES = ('130', '133', '135', '136', '138', '139', '150', '158', '177', '186', '189')
+
+DAYS = ('Mo-Su', 'Mo-Fr', 'Mo-Sa', 'Tu-Su', 'Sa-Su', 'Mo-Th')
+LONG_DAYS = ('Mon-Sun', 'Mon-Fri', 'Mon-Sat', 'Tue-Sun')
+WEEKEND = ('Sa', 'Su', 'Sa-Su')
+MONTHS = ('Jan-Dec', 'Apr-Oct', 'Mar-Nov')
+MINUTES = ('00', '00', '00', '30', '30', '15', '45')
+
+
+def digits(rng, n):
+    return '%0*d' % (n, rng.randrange(10 ** n))
+
+
+def clock(hour, minute):
+    return '%02d:%s' % (hour, minute)
+
+
+# 模板字段 -> 由随机数生成器生成字段值的函数
+FIELDS = {
+    'd3': lambda rng: digits(rng, 3),
+    'd4': lambda rng: digits(rng, 4),
+    'd5': lambda rng: digits(rng, 5),
+    'd7': lambda rng: digits(rng, 7),
+    'landline': lambda rng: str(rng.randint(2, 8)) + digits(rng, 7),   # 北京的固定电话8位
+    'mobile': lambda rng: rng.choice(MOBILE_PREFIXES) + digits(rng, 8),
+    'district': lambda rng: str(rng.randint(0, 2)),
+    'other_postcode': lambda rng: str(rng.randint(2, 8)) + digits(rng, 5),
+    'days': lambda rng: rng.choice(DAYS),
+    'long_days': lambda rng: rng.choice(LONG_DAYS),
+    'weekend': lambda rng: rng.choice(WEEKEND),
+    'months': lambda rng: rng.choice(MONTHS),
+    'minute': lambda rng: rng.choice(MINUTES),
+    'open': lambda rng: clock(rng.randint(6, 11), rng.choice(MINUTES)),
+    'noon': lambda rng: clock(rng.randint(11, 12), rng.choice(MINUTES)),
+    'afternoon': lambda rng: clock(rng.randint(13, 14), rng.choice(MINUTES)),
+    'close': lambda rng: clock(rng.randint(17, 24), '00'),
+    'open_h': lambda rng: str(rng.randint(6, 11)),
+    'close_h': lambda rng: str(rng.randint(17, 23)),
+    'close_h12': lambda rng: str(rng.randint(5, 11)),
+    'number': lambda rng: str(int(rng.expovariate(1 / 60)) + 1),   # 小的门牌号更常见
+    'small': lambda rng: str(rng.randint(1, 20)),
+    'letter': lambda rng: rng.choice('ABCDEFG'),
+}
+
+FIELD_RE = re.compile(r'\{(\w+)\}')
+
+# 清洗规则 -> 格式模板，供微基准测试使用
+RULE_FORMATS = {
+    'phone': PHONE_FORMATS,
+    'postcode': POSTCODE_FORMATS,
+    'opening_hours': HOUR_FORMATS,
+    'housenumber': HOUSE_NUMBER_FORMATS,
+}
+
+# 生成的 tag 键 -> 清洗规则
+TAG_RULES = {
+    'phone': 'phone',
+    'contact:phone': 'phone',
+    'addr:postcode': 'postcode',
+    'opening_hours': 'opening_hours',
+    'addr:housenumber': 'housenumber',
+}
+
+# 没有清洗规则的键取固定的值，也要有，才能反映真实数据中tag的比例
+TAG_VALUES = {
+    'name': [('北京市', 1), ('Cafe', 3), ('Shop & Co', 1), ('天安门', 1)],
+    'highway': [('traffic_signals', 3), ('crossing', 2), ('bus_stop', 2)],
+    'amenity': [('cafe', 2), ('restaurant', 3), ('bank', 1)],
+    'tourism': [('hotel', 2), ('attraction', 1)],
+}
+
+TAG_WEIGHTS = [('name', 30), ('highway', 20), ('amenity', 15), ('phone', 10),
+               ('contact:phone', 2), ('addr:postcode', 6), ('opening_hours', 8),
+               ('addr:housenumber', 10), ('tourism', 5)]
+
+
+def choices(rng, weighted, k):
+    values, weights = zip(*weighted)
+    return rng.choices(values, weights, k=k)
+
+
+def rule_value(rng, rule, dirty=DIRTY):
+    '''生成一个某类清洗规则的值：以 dirty 的概率取要清洗的格式，否则取标准格式。'''
+
+    formats = RULE_FORMATS[rule]['dirty' if rng.random() < dirty else 'standard']
+    template = choices(rng, formats, 1)[0]
+    return FIELD_RE.sub(lambda m: FIELDS[m.group(1)](rng), template)
+
+
+def sample_values(rule, count, seed=1, dirty=DIRTY):
+    '''生成 count 个某类清洗规则的值，dirty 是要清洗的格式所占的比例。'''
+
+    rng = random.Random(seed)
+    return [rule_value(rng, rule, dirty) for _ in range(count)]
+
+
+def element_attrs(rng, element_id):
+    uid = rng.randint(1, 500)
+    return ('id="%d" version="%d" timestamp="2017-%02d-%02dT00:00:00Z" changeset="%d" '
+            'uid="%d" user="user%d"' % (element_id, rng.randint(1, 9), rng.randint(1, 12),
+                                        rng.randint(1, 28), rng.randint(1, 10 ** 7), uid, uid))
+
+
+def node_attrs(rng, node_id):
+    min_lat, min_lon, max_lat, max_lon = BOUNDS
+    lat = rng.uniform(min_lat, max_lat)
+    lon = rng.uniform(min_lon, max_lon)
+    return '%s lat="%.7f" lon="%.7f"' % (element_attrs(rng, node_id), lat, lon)
+
+
+def write_tags(f, rng, count, exclude=(), dirty=DIRTY):
+    keys = set()
+    while len(keys) < count:
+        key = choices(rng, TAG_WEIGHTS, 1)[0]
+        if key not in exclude:
+            keys.add(key)
+    for key in sorted(keys):
+        if key in TAG_RULES:
+            value = rule_value(rng, TAG_RULES[key], dirty)
+        else:
+            value = choices(rng, TAG_VALUES[key], 1)[0]
+        f.write('    <tag k=%s v=%s/>\n' % (quoteattr(key), quoteattr(value)))
+
+
+def generate(path, nodes=100000, ways=None, tagged=0.2, seed=1, dirty=DIRTY):
+    """Write a synthetic OSM XML file; the same arguments give the same bytes
+
+    ways defaults to nodes // 10; tagged is the share of nodes with tags;
+    dirty is the share of phone, postcode, opening_hours and house number
+    values in a format that clean.py has to fix.
+    Ways reference 2-12 consecutive nodes, and one multipolygon relation per
+    thousand ways is added. Return the number of elements written.
+    """
+
+    if ways is None:
+        ways = nodes // 10
+    rng = random.Random(seed)
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+        f.write('<osm version="0.6" generator="synthosm">\n')
+        f.write(' <bounds minlat="%s" minlon="%s" maxlat="%s" maxlon="%s"/>\n' % BOUNDS)
+
+        for node_id in range(1, nodes + 1):
+            attrs = node_attrs(rng, node_id)
+            if rng.random() < tagged:
+                f.write('  <node %s>\n' % attrs)
+                write_tags(f, rng, rng.randint(1, 4), dirty=dirty)
+                f.write('  </node>\n')
+            else:
+                f.write('  <node %s/>\n' % attrs)
+
+        way_base = 10 ** 9
+        for i in range(1, ways + 1):
+            f.write('  <way %s>\n' % element_attrs(rng, way_base + i))
+            start = rng.randint(1, max(nodes - 12, 1))
+            for ref in range(start, min(start + rng.randint(2, 12), nodes + 1)):
+                f.write('    <nd ref="%d"/>\n' % ref)
+            f.write('    <tag k="highway" v="residential"/>\n')
+            if rng.random() < 0.3:
+                write_tags(f, rng, 1, exclude=('highway',), dirty=dirty)
+            f.write('  </way>\n')
+
+        relations = ways // 1000
+        for i in range(1, relations + 1):
+            f.write('  <relation %s>\n' % element_attrs(rng, i))
+            f.write('    <member type="way" ref="%d" role="outer"/>\n' % (way_base + i))
+            f.write('    <tag k="type" v="multipolygon"/>\n')
+            f.write('  </relation>\n')
+        f.write('</osm>\n')
+
+    return nodes + ways + relations
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Generate a deterministic synthetic OSM file.')
+    parser.add_argument('output')
+    parser.add_argument('--nodes', type=int, default=100000)
+    parser.add_argument('--ways', type=int, help='default: nodes / 10')
+    parser.add_argument('--tagged', type=float, default=0.2,
+                        help='share of nodes that carry tags')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--dirty', type=float, default=DIRTY,
+                        help='share of the cleaned values in a format that needs cleaning')
+    args = parser.parse_args()
+
+    count = generate(args.output, args.nodes, args.ways, args.tagged, args.seed, args.dirty)
+    print('%d elements written to %s' % (count, args.output))
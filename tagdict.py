@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# 标签的字典编码：nodes_tags、ways_tags、relation_tags 中的 key、type 和大部分 value 重复出现上百万次。
+# 编码后每个不同的 (key, type) 和 value 只在 tag_keys、tag_values 两张查找表中出现一次，
+# 标签表中只存它们的整数编号（id, key_id, value_id），输出更小，导入更快，按 key/value 过滤时只比较整数。
+# 编码时每个字符串只保留第一次出现的那个对象（与 sys.intern 相同的效果），内存中不会有重复的字符串。
+# 用法：python osm2csv.py beijing_china.osm --dictionary
+#       python osm2sqlite.py beijing_china.osm --dictionary
+#       python tagdict.py .  （读取编码后的 csv，还原成原来的 key、value、type 列并统计大小）
+
+import argparse
+import csv
+import os
+
+import compressed
+
+
+TAG_KEYS_PATH = 'tag_keys.csv'
+TAG_VALUES_PATH = 'tag_values.csv'
+
+TAG_KEYS_FIELDS = ['id', 'key', 'type']
+TAG_VALUES_FIELDS = ['id', 'value']
+
+# 编码后的标签表的字段
+ENCODED_TAGS_FIELDS = ['id', 'key_id', 'value_id']
+
+
+class TagDictionary(object):
+    '''(key, type) 和 value 到整数编号的映射，编号从0开始按第一次出现的顺序分配。
+
+    new_keys、new_values 记录上次 take_new 之后新分配的编号，供增量写入数据库。'''
+
+    def __init__(self):
+        self.keys = {}
+        self.values = {}
+        self.key_list = []
+        self.value_list = []
+        self.new_keys = []
+        self.new_values = []
+
+    @classmethod
+    def from_rows(cls, key_rows, value_rows):
+        '''由 tag_keys、tag_values 的行 (id, key, type) 和 (id, value) 重建字典。'''
+
+        dictionary = cls()
+        for key_id, key, ttype in sorted(key_rows):
+            assert key_id == len(dictionary.key_list)
+            dictionary.keys[key, ttype] = key_id
+            dictionary.key_list.append((key, ttype))
+        for value_id, value in sorted(value_rows):
+            assert value_id == len(dictionary.value_list)
+            dictionary.values[value] = value_id
+            dictionary.value_list.append(value)
+        return dictionary
+
+    def key_id(self, key, ttype):
+        key_id = self.keys.get((key, ttype))
+        if key_id is None:
+            key_id = self.keys[key, ttype] = len(self.key_list)
+            self.key_list.append((key, ttype))
+            self.new_keys.append((key_id, key, ttype))
+        return key_id
+
+    def value_id(self, value):
+        value_id = self.values.get(value)
+        if value_id is None:
+            value_id = self.values[value] = len(self.value_list)
+            self.value_list.append(value)
+            self.new_values.append((value_id, value))
+        return value_id
+
+    def encode_rows(self, rows):
+        '''把 (id, key, value, type) 的标签行编码成 (id, key_id, value_id)。'''
+
+        key_id = self.key_id
+        value_id = self.value_id
+        return [(element_id, key_id(key, ttype), value_id(value))
+                for element_id, key, value, ttype in rows]
+
+    def encode_dicts(self, rows):
+        '''把 {'id', 'key', 'value', 'type'} 的标签行编码成 {'id', 'key_id', 'value_id'}。'''
+
+        return [{'id': row['id'], 'key_id': self.key_id(row['key'], row['type']),
+                 'value_id': self.value_id(row['value'])}
+                for row in rows]
+
+    def take_new(self):
+        '''返回并清空新分配的 (key 行, value 行)。'''
+
+        new_keys, new_values = self.new_keys, self.new_values
+        self.new_keys, self.new_values = [], []
+        return new_keys, new_values
+
+    def write(self, keys_path=TAG_KEYS_PATH, values_path=TAG_VALUES_PATH):
+        """Write the tag_keys and tag_values lookup tables as csv(s)
+
+        The paths may end with a compression extension, e.g. tag_keys.csv.gz.
+        """
+
+        for path, fields, rows in ((keys_path, TAG_KEYS_FIELDS,
+                                    ((i, key, ttype) for i, (key, ttype) in
+                                     enumerate(self.key_list))),
+                                   (values_path, TAG_VALUES_FIELDS, enumerate(self.value_list))):
+            with compressed.open_output(path) as f:
+                writer = csv.writer(f)
+                writer.writerow(fields)
+                writer.writerows(rows)
+        self.take_new()
+
+    def __len__(self):
+        return len(self.key_list) + len(self.value_list)
+
+
+def read_tags(tags_path, keys_path=TAG_KEYS_PATH, values_path=TAG_VALUES_PATH):
+    """Read an encoded tag csv into a DataFrame with id, key, value, type
+
+    key, value and type are pandas categoricals built from the lookup
+    tables, so every distinct string is stored once.
+    """
+
+    import pandas as pd
+
+    keys = pd.read_csv(keys_path, dtype={'key': str, 'type': str}, keep_default_na=False,
+                       index_col='id')
+    values = pd.read_csv(values_path, dtype={'value': str}, keep_default_na=False,
+                         index_col='id')
+    tags = pd.read_csv(tags_path)
+
+    # 编号从0开始连续分配，查找表的行号就是编号；同一个 key 可能有几种 type，所以 key 再去一次重
+    columns = {'id': tags['id']}
+    for name in ('key', 'type'):
+        codes, uniques = pd.factorize(keys[name])
+        columns[name] = pd.Categorical.from_codes(codes[tags['key_id'].to_numpy()], uniques)
+    columns['value'] = pd.Categorical.from_codes(tags['value_id'].to_numpy(), values['value'])
+    return pd.DataFrame(columns)[['id', 'key', 'value', 'type']]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Decode the dictionary encoded tag csv(s).')
+    parser.add_argument('directory', nargs='?', default='.',
+                        help='directory of the csv(s) written with osm2csv.py --dictionary')
+    parser.add_argument('--output', help='write the decoded tag tables to this directory')
+    args = parser.parse_args()
+
+    keys_path = os.path.join(args.directory, TAG_KEYS_PATH)
+    values_path = os.path.join(args.directory, TAG_VALUES_PATH)
+    for name in ('nodes_tags.csv', 'ways_tags.csv', 'relation_tags.csv'):
+        path = os.path.join(args.directory, name)
+        tags = read_tags(path, keys_path, values_path)
+        print('%-18s %10d rows %10.2f MB encoded, %8.2f MB in memory'
+              % (name, len(tags), os.path.getsize(path) / 1e6,
+                 tags.memory_usage(deep=True).sum() / 1e6))
+        if args.output:
+            tags.to_csv(os.path.join(args.output, name), index=False, lineterminator='\r\n')
+    print('lookup tables %.2f MB' % ((os.path.getsize(keys_path) +
+                                      os.path.getsize(values_path)) / 1e6))
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# osc2sqlite.py 的测试：把变更文件应用到旧地图的数据库上，结果与直接导入新地图的数据库相同，
+# 字典编码的数据库（osm2sqlite.py --dictionary）也一样。
+# 用法：python -m pytest test_osc2sqlite.py
+
+import sqlite3
+
+import pytest
+
+import osc2sqlite
+import osm2sqlite
+
+
+NODE = ('  <node id="%d" lat="%s" lon="%s" version="%d" timestamp="2018-01-01T00:00:00Z" '
+        'changeset="1" uid="1" user="u1"%s')
+
+OLD_MAP = '\n'.join([
+    '<?xml version="1.0" encoding="UTF-8"?>',
+    '<osm version="0.6">',
+    NODE % (1, '39.9', '116.3', 1, '>'),
+    '    <tag k="highway" v="traffic_signals"/>',
+    '  </node>',
+    NODE % (2, '39.91', '116.31', 1, '>'),
+    '    <tag k="amenity" v="cafe"/>',
+    '    <tag k="name" v="Old cafe"/>',
+    '  </node>',
+    NODE % (3, '39.92', '116.32', 1, '/>'),
+    '  <way id="10" version="1" timestamp="2018-01-01T00:00:00Z" changeset="1" uid="1" user="u1">',
+    '    <nd ref="1"/>',
+    '    <nd ref="2"/>',
+    '    <tag k="highway" v="residential"/>',
+    '  </way>',
+    '</osm>',
+])
+
+CHANGE = '\n'.join([
+    '<osmChange version="0.6">',
+    '<modify>',
+    NODE % (2, '39.91', '116.31', 2, '>'),
+    '    <tag k="amenity" v="cafe"/>',
+    '    <tag k="name" v="New cafe"/>',
+    '    <tag k="addr:postcode" v="100083"/>',
+    '  </node>',
+    '  <way id="10" version="2" timestamp="2018-01-01T00:00:00Z" changeset="1" uid="1" user="u1">',
+    '    <nd ref="1"/>',
+    '    <nd ref="4"/>',
+    '    <tag k="highway" v="tertiary"/>',
+    '  </way>',
+    '</modify>',
+    '<create>',
+    NODE % (4, '39.93', '116.33', 1, '>'),
+    '    <tag k="shop" v="bakery"/>',
+    '  </node>',
+    '</create>',
+    '<delete>',
+    NODE % (3, '39.92', '116.32', 2, '/>'),
+    '</delete>',
+    '</osmChange>',
+])
+
+NEW_MAP = '\n'.join([
+    '<?xml version="1.0" encoding="UTF-8"?>',
+    '<osm version="0.6">',
+    NODE % (1, '39.9', '116.3', 1, '>'),
+    '    <tag k="highway" v="traffic_signals"/>',
+    '  </node>',
+    NODE % (2, '39.91', '116.31', 2, '>'),
+    '    <tag k="amenity" v="cafe"/>',
+    '    <tag k="name" v="New cafe"/>',
+    '    <tag k="addr:postcode" v="100083"/>',
+    '  </node>',
+    NODE % (4, '39.93', '116.33', 1, '>'),
+    '    <tag k="shop" v="bakery"/>',
+    '  </node>',
+    '  <way id="10" version="2" timestamp="2018-01-01T00:00:00Z" changeset="1" uid="1" user="u1">',
+    '    <nd ref="1"/>',
+    '    <nd ref="4"/>',
+    '    <tag k="highway" v="tertiary"/>',
+    '  </way>',
+    '</osm>',
+])
+
+TABLES = ['nodes', 'ways', 'ways_nodes', 'nodes_rtree']
+TAG_TABLES = ['nodes_tags', 'ways_tags']
+
+
+def write(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return str(path)
+
+
+def rows(conn, table):
+    return sorted(conn.execute('SELECT * FROM %s' % table).fetchall())
+
+
+@pytest.mark.parametrize('encode_tags', [False, True])
+def test_apply_change(tmp_path, encode_tags):
+    old_db = str(tmp_path / 'old.sqlite')
+    new_db = str(tmp_path / 'new.sqlite')
+    osm2sqlite.load_map(write(tmp_path / 'old.osm', OLD_MAP), old_db, encode_tags=encode_tags)
+    osm2sqlite.load_map(write(tmp_path / 'new.osm', NEW_MAP), new_db)
+    osc_file = write(tmp_path / 'change.osc', CHANGE)
+
+    conn = sqlite3.connect(old_db)
+    assert osc2sqlite.apply_change(conn, osc_file, 1) == {'create': 1, 'modify': 2, 'delete': 1}
+    assert osc2sqlite.apply_change(conn, osc_file, 1) is None
+
+    expected = sqlite3.connect(new_db)
+    for table in TABLES:
+        assert rows(conn, table) == rows(expected, table), table
+    # 编码后的标签通过 *_tags_text 视图还原成原来的列
+    suffix = '_text' if encode_tags else ''
+    for table in TAG_TABLES:
+        assert rows(conn, table + suffix) == rows(expected, table), table
+    conn.close()
+    expected.close()
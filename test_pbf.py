@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# pbf.py 的往返测试：synthosm 生成的地图写成 PBF 后再转换，与直接转换 XML 得到的 csv 完全相同。
+# 用法：python -m pytest test_pbf.py
+
+import pytest
+
+import pbf
+import synthosm
+
+
+@pytest.fixture
+def osm_file(tmp_path):
+    path = str(tmp_path / 'map.osm')
+    synthosm.generate(path, nodes=3000, seed=3)
+    return path
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_round_trip(osm_file, tmp_path, workers):
+    pbf_file = str(tmp_path / 'map.osm.pbf')
+    # 小的块让文件分成多个 blob，workers=2 时才会有多个 blob 同时在解码
+    pbf.write_pbf(osm_file, pbf_file, block_size=500)
+
+    differences = pbf.compare(osm_file, pbf_file, workers=workers)
+    assert differences and not any(differences.values()), differences